@@ -1,6 +1,8 @@
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Optional
+
+from run_metrics import RunMetrics
 
 
 @dataclass
@@ -9,6 +11,7 @@ class AIAssistantResponse:
     is_error: bool
     api_responses: list[Any]
     history: list[Any]
+    metrics: Optional[RunMetrics] = None
 
 
 class AIAssistantBase(ABC):
@@ -17,6 +20,10 @@ class AIAssistantBase(ABC):
         self, query: str, artifacts: list
     ) -> AIAssistantResponse: ...
 
+    async def close(self):
+        """Release clients held by the assistant"""
+
+
 class ToolCallingAIAssistant(AIAssistantBase):
     @abstractmethod
     def process_response(
@@ -1,6 +1,7 @@
 from enum import Enum
 import json
 import asyncio
+from dataclasses import replace
 import os
 from pathlib import Path
 from typing import List, Dict, Any, Literal, Optional
@@ -14,6 +15,18 @@ from o1_oracle_eval import AIAssistant as OpenAIOracleAssistant
 from claude35_oracle_eval import AIAssistant as ClaudeOracleAssistant
 import traceback
 from ai_assistant import AIAssistantResponse, AIAssistantBase, ToolCallingAIAssistant
+from scheduler import Provider, RateLimitScheduler, DEFAULT_LIMITS
+from db_pool import close_databases
+from llm_cache import ResponseCache, cache_sample
+from python_sandbox import close_sandbox_pool
+from run_metrics import RunMetrics
+from run_payloads import read_payload, write_payload
+from run_store import RunConfiguration, RunStore
+from schema_cache import (
+    DEFAULT_CACHE_DIR as DEFAULT_SCHEMA_CACHE_DIR,
+    configure_schema_cache,
+)
+import tracing
 
 
 class System(str, Enum):
@@ -29,6 +42,17 @@ class Model(str, Enum):
     O3_MINI = "o3-mini"
 
 
+def get_provider(system: System, model: Model) -> Provider:
+    """Provider whose rate limits a run of this configuration is subject to"""
+    if system == System.PROMPTQL:
+        return Provider.PROMPTQL
+    match model:
+        case Model.O1 | Model.O3_MINI:
+            return Provider.OPENAI
+        case Model.CLAUDE_3_5_SONNET | Model.CLAUDE_3_7_SONNET:
+            return Provider.ANTHROPIC
+
+
 class InputVariations(BaseModel):
     name: str
     parameters: Dict[str, Any]
@@ -74,6 +98,80 @@ def resolve_relative_path(file_path: str, config_filepath: str) -> str:
     return absolute_path
 
 
+def parse_timedelta(value: str) -> timedelta:
+    """Parse str(timedelta), eg: "0:01:02.345678" or "1 day, 0:01:02" """
+    days = 0
+    if "day" in value:
+        days_part, value = value.split(", ")
+        days = int(days_part.split()[0])
+    hours, minutes, seconds = value.split(":")
+    return timedelta(
+        days=days, hours=int(hours), minutes=int(minutes), seconds=float(seconds)
+    )
+
+
+def load_recorded_response(
+    base_filename: str,
+) -> Optional[tuple[AIAssistantResponse, timedelta]]:
+    """Rebuild the response of a previous run from its .history/.api/.err/.time/.metrics.json files"""
+    if not os.path.exists(f"{base_filename}.history"):
+        return None
+
+    history = read_payload(f"{base_filename}.history")
+    api_responses = read_payload(f"{base_filename}.api")
+    with open(f"{base_filename}.time") as f:
+        elapsed_time = parse_timedelta(f.read().strip())
+
+    # A run that failed and then succeeded when resumed may have a stale .err
+    is_error = not os.path.exists(f"{base_filename}.result") and os.path.exists(
+        f"{base_filename}.err"
+    )
+    if is_error:
+        with open(f"{base_filename}.err") as f:
+            response_text = f.read()
+    elif history and "assistant_actions" in history[-1]:
+        # PromptQL interactions
+        response_text = history[-1]["assistant_actions"][-1]["message"]
+    else:
+        # Tool calling assistants end the history with the final assistant message
+        response_text = history[-1]["content"] if history else ""
+
+    metrics = None
+    if os.path.exists(f"{base_filename}.metrics.json"):
+        with open(f"{base_filename}.metrics.json") as f:
+            metrics = RunMetrics.from_dict(json.load(f))
+
+    return (
+        AIAssistantResponse(
+            response=response_text,
+            is_error=is_error,
+            api_responses=api_responses,
+            history=history,
+            metrics=metrics,
+        ),
+        elapsed_time,
+    )
+
+
+class ReplayAssistant(ToolCallingAIAssistant):
+    """
+    Stands in for a tool calling assistant when replaying recorded runs, so that
+    no API client (or key) is needed. Only the assistant's response parsing runs.
+    """
+
+    def __init__(self, assistant_class: type[ToolCallingAIAssistant]):
+        self.assistant_class = assistant_class
+
+    async def process_query(self, query: str, artifacts: list) -> AIAssistantResponse:
+        raise RuntimeError(
+            "ReplayAssistant doesn't run queries, replayed runs are read with load_recorded_response"
+        )
+
+    def process_response(self, response: AIAssistantResponse, tag_name: str) -> str:
+        # process_response of the tool calling assistants doesn't use instance state
+        return self.assistant_class.process_response(self, response, tag_name)  # type: ignore
+
+
 def read_input(filepath: str) -> InputConfig:
     """Read and validate query from YAML file"""
     try:
@@ -92,12 +190,28 @@ class QueryProcessor:
         output_dir: str,
         repeat: int,
         oracle: bool,
+        scheduler: RateLimitScheduler,
+        provider: Provider,
+        replay_dir: Optional[str] = None,
+        run_store: Optional[RunStore] = None,
+        configuration: Optional[RunConfiguration] = None,
+        pretty_runs: bool = False,
     ):
         self.assistant = ai_assistant
         self.output_dir = output_dir
         self.input_config = input_config
         self.repeat = repeat
         self.oracle = oracle
+        self.scheduler = scheduler
+        self.provider = provider
+        self.replay_dir = replay_dir
+        # Runs are saved to the store instead of files when there is one
+        self.run_store = run_store
+        self.configuration = configuration
+        if run_store is not None:
+            assert configuration is not None
+        # Write .history/.api as indented JSON instead of compact payloads
+        self.pretty_runs = pretty_runs
 
     def save_results(
         self,
@@ -105,8 +219,26 @@ class QueryProcessor:
         run_index: int,
         response: AIAssistantResponse,
         elapsed_time: timedelta,
+        started_at: Optional[datetime] = None,
     ):
         """Save query results to output directory"""
+        if self.run_store is not None:
+            assert self.configuration is not None
+            self.run_store.save_run(
+                self.configuration,
+                variation_name,
+                run_index,
+                response,
+                (
+                    response.response
+                    if response.is_error
+                    else self.process_response(response)
+                ),
+                elapsed_time,
+                started_at,
+            )
+            return
+
         base_filename = f"{self.output_dir}/{variation_name}_run_{run_index}"
 
         os.makedirs(self.output_dir, exist_ok=True)
@@ -119,20 +251,41 @@ class QueryProcessor:
             # Save main output
             with open(f"{base_filename}.result", "w") as f:
                 f.write(self.process_response(response))
-
-        # Save conversation history
-        with open(f"{base_filename}.history", "w") as f:
-            json.dump(response.history, f, indent=2, default=str)
-
-        # Save actual API responses
-        with open(f"{base_filename}.api", "w") as f:
-            json.dump(response.api_responses, f, indent=2, default=str)
+            # Drop the error of a previous attempt of the run
+            if os.path.exists(f"{base_filename}.err"):
+                os.remove(f"{base_filename}.err")
+
+        if self.pretty_runs:
+            # Save conversation history
+            with open(f"{base_filename}.history", "w") as f:
+                json.dump(response.history, f, indent=2, default=str)
+
+            # Save actual API responses
+            with open(f"{base_filename}.api", "w") as f:
+                json.dump(response.api_responses, f, indent=2, default=str)
+        else:
+            # Shared prompts, schemas and artifacts are stored once for the
+            # directory, read them with run_payloads.read_payload
+            write_payload(f"{base_filename}.history", response.history)
+            write_payload(f"{base_filename}.api", response.api_responses)
 
         with open(f"{base_filename}.time", "w") as f:
             f.write(f"{elapsed_time}")
 
+        # Token usage and latencies, joined with the scores by evaluation.py
+        metrics = response.metrics.to_dict() if response.metrics is not None else {}
+        with open(f"{base_filename}.metrics.json", "w") as f:
+            json.dump(
+                {"elapsed_s": elapsed_time.total_seconds(), **metrics}, f, indent=2
+            )
+
     def should_skip(self, variation_name: str, run_index: int) -> bool:
         """Check if output already exists"""
+        if self.run_store is not None:
+            assert self.configuration is not None
+            return self.run_store.has_result(
+                self.configuration, variation_name, run_index
+            )
         output_file = Path(self.output_dir) / f"{variation_name}_run_{run_index}.result"
         return output_file.exists()
 
@@ -162,11 +315,7 @@ class QueryProcessor:
         query: str,
         variation: InputVariations,
         run_index: int,
-        wait: int,
     ):
-        await asyncio.sleep(wait)
-        # Process query and measure time
-        start_time = datetime.now()
         artifacts = []
 
         if self.oracle:
@@ -177,11 +326,53 @@ class QueryProcessor:
                 )
                 artifacts.append(json.loads(read_file_content(absolute_file_path)))
 
-        response = await self.assistant.process_query(query=query, artifacts=artifacts)
-        elapsed_time = datetime.now() - start_time
+        if self.replay_dir:
+            recorded = load_recorded_response(
+                f"{self.replay_dir}/{variation.name}_run_{run_index}"
+            )
+            if recorded is None:
+                print(
+                    f"No recorded run {run_index} of {variation.name} in {self.replay_dir}"
+                )
+                return
+            response, elapsed_time = recorded
+            self.save_results(variation.name, run_index, response, elapsed_time)
+            return
+
+        # Each repeat gets its own response cache entries
+        cache_sample.set(run_index)
+
+        # Wait for a free slot with the provider before starting the clock
+        async with self.scheduler.run_slot(self.provider):
+            with tracing.span(
+                "bench run",
+                {
+                    "bench.output_dir": self.output_dir,
+                    "bench.variation": variation.name,
+                    "bench.run": run_index,
+                    "bench.oracle": self.oracle,
+                    "bench.provider": self.provider.value,
+                },
+            ) as span:
+                start_time = datetime.now()
+                response = await self.assistant.process_query(
+                    query=query, artifacts=artifacts
+                )
+                elapsed_time = datetime.now() - start_time
+                span.set_attribute("bench.is_error", response.is_error)
+                if response.metrics is not None:
+                    span.set_attributes(
+                        {
+                            f"bench.{key}": value
+                            for key, value in response.metrics.summary().items()
+                            if value is not None
+                        }
+                    )
 
         print(f"TOTAL PROCESSING TIME: {elapsed_time} seconds")
-        self.save_results(variation.name, run_index, response, elapsed_time)
+        self.save_results(
+            variation.name, run_index, response, elapsed_time, started_at=start_time
+        )
 
     async def run(self, input_filepath: str):
         """Main processing loop"""
@@ -214,8 +405,10 @@ class QueryProcessor:
                         else ""
                     )
 
-                    # Skip if output exists
-                    if self.should_skip(variation.name, run_index):
+                    # Skip if output exists, replays always re-process recorded runs
+                    if not self.replay_dir and self.should_skip(
+                        variation.name, run_index
+                    ):
                         print(
                             f"Skipping existing output for {input_filepath} run {run_index}{param_info} targeting {self.output_dir}"
                         )
@@ -231,8 +424,6 @@ class QueryProcessor:
                             query=query,
                             variation=variation,
                             run_index=run_index,
-                            wait=len(tasks)
-                            * 30,  # Wait 30 seconds per task to avoid overload
                         )
                     )
 
@@ -243,6 +434,15 @@ class QueryProcessor:
             print(f"Error during processing: {e}")
 
 
+def get_run_dir(base_dir: str, system: System, oracle: bool, model: Model) -> str:
+    run_dir = f"{base_dir}/{model.value}/{system.value}"
+    if oracle:
+        run_dir += "/oracle"
+    else:
+        run_dir += "/retrieval"
+    return run_dir
+
+
 async def run(
     input_filepath: str,
     system: System,
@@ -250,35 +450,65 @@ async def run(
     model: Model,
     output_dir: str,
     repeat: int,
-    wait: int,
+    scheduler: RateLimitScheduler,
+    cache: ResponseCache,
+    replay_dir: Optional[str] = None,
+    promptql_stream: bool = False,
+    http2: bool = False,
+    assistant: Optional[AIAssistantBase] = None,
+    run_store: Optional[RunStore] = None,
+    pretty_runs: bool = False,
 ):
+    """
+    Run the queries of input_filepath with one configuration. assistant
+    replaces the configuration's assistant, eg: with a stand-in to benchmark
+    the harness itself. Runs are saved to run_store instead of output_dir
+    when given.
+    """
     input_config = read_input(input_filepath)
-    output_dir = f"{output_dir}/{model.value}/{system.value}"
-    if oracle:
-        output_dir += "/oracle"
-    else:
-        output_dir += "/retrieval"
-    if system == System.PROMPTQL:
-        match model:
-            case Model.O1 | Model.O3_MINI:
-                promptql_llm_provider = "openai"
-                promptql_llm_model = model.value
-            case Model.CLAUDE_3_5_SONNET | Model.CLAUDE_3_7_SONNET:
-                promptql_llm_provider = "anthropic"
-                promptql_llm_model = f"{model.value}-latest"
-
-        assistant = PromptQLAssistant(promptql_llm_provider, promptql_llm_model)
-    else:
-        has_python_tool = system == System.TOOL_CALLING_PYTHON
+    output_dir = get_run_dir(output_dir, system, oracle, model)
+    if replay_dir:
+        replay_dir = get_run_dir(replay_dir, system, oracle, model)
+    if assistant is None:
+        if system == System.PROMPTQL:
+            match model:
+                case Model.O1 | Model.O3_MINI:
+                    promptql_llm_provider = "openai"
+                    promptql_llm_model = model.value
+                case Model.CLAUDE_3_5_SONNET | Model.CLAUDE_3_7_SONNET:
+                    promptql_llm_provider = "anthropic"
+                    promptql_llm_model = f"{model.value}-latest"
+
+            assistant = PromptQLAssistant(
+                promptql_llm_provider,
+                promptql_llm_model,
+                scheduler=scheduler,
+                stream=promptql_stream,
+                http2=http2,
+            )
+        else:
+            has_python_tool = system == System.TOOL_CALLING_PYTHON
 
-        match model:
-            case Model.O1 | Model.O3_MINI:
-                assistant = (OpenAIOracleAssistant if oracle else OpenAIAssistant)(
-                    model.value, has_python_tool=has_python_tool
-                )
-            case Model.CLAUDE_3_5_SONNET | Model.CLAUDE_3_7_SONNET:
-                assistant = (ClaudeOracleAssistant if oracle else ClaudeAssistant)(
-                    model=f"{model.value}-latest", has_python_tool=has_python_tool
+            match model:
+                case Model.O1 | Model.O3_MINI:
+                    assistant_class = (
+                        OpenAIOracleAssistant if oracle else OpenAIAssistant
+                    )
+                    assistant_model = model.value
+                case Model.CLAUDE_3_5_SONNET | Model.CLAUDE_3_7_SONNET:
+                    assistant_class = (
+                        ClaudeOracleAssistant if oracle else ClaudeAssistant
+                    )
+                    assistant_model = f"{model.value}-latest"
+
+            if replay_dir:
+                assistant = ReplayAssistant(assistant_class)
+            else:
+                assistant = assistant_class(
+                    model=assistant_model,
+                    has_python_tool=has_python_tool,
+                    scheduler=scheduler,
+                    cache=cache,
                 )
 
     processor = QueryProcessor(
@@ -287,11 +517,18 @@ async def run(
         output_dir=output_dir,
         repeat=repeat,
         oracle=oracle,
+        scheduler=scheduler,
+        provider=get_provider(system, model),
+        replay_dir=replay_dir,
+        run_store=run_store,
+        configuration=RunConfiguration(model.value, system.value, oracle),
+        pretty_runs=pretty_runs,
     )
 
-    if wait > 0:
-        await asyncio.sleep(wait)
-    await processor.run(input_filepath)
+    try:
+        await processor.run(input_filepath)
+    finally:
+        await assistant.close()
 
 
 async def main():
@@ -300,7 +537,11 @@ async def main():
 
     parser = argparse.ArgumentParser(description="Process queries using AI Assistant")
     parser.add_argument("--input_filepath", help="Input query file path", required=True)
-    parser.add_argument("--output_dir", help="Output directory path", required=True)
+    parser.add_argument(
+        "--output_dir",
+        help="Output directory path",
+        required="--run_store" not in sys.argv,
+    )
     parser.add_argument(
         "--model",
         type=Model,
@@ -318,41 +559,132 @@ async def main():
     parser.add_argument("--oracle", help="Use oracle data", action="store_true")
     parser.add_argument("--all", help="Run all configurations", action="store_true")
     parser.add_argument("--repeat", help="Number of runs", type=int, default=3)
+    parser.add_argument(
+        "--max_concurrency",
+        help="Maximum concurrent runs per provider (defaults to per-provider limits)",
+        type=int,
+    )
+    parser.add_argument(
+        "--requests_per_minute",
+        help="Maximum requests per minute per provider (defaults to per-provider limits)",
+        type=float,
+    )
+
+    parser.add_argument(
+        "--cache_dir",
+        help="Cache LLM responses in this directory and reuse them for identical requests",
+    )
+    parser.add_argument(
+        "--schema_cache_dir",
+        help="Directory caching the database schemas of the system prompts, refreshed when a schema changes "
+        "(default: %(default)s, '' to only cache them in memory)",
+        default=DEFAULT_SCHEMA_CACHE_DIR,
+    )
+    parser.add_argument(
+        "--replay",
+        help="Re-process the recorded runs in this (previous --output_dir) directory instead of querying models",
+    )
+
+    parser.add_argument(
+        "--run_store",
+        help="Save the runs to this SQLite file instead of files under --output_dir "
+        "(`python run_store.py export` writes them as files)",
+    )
+
+    parser.add_argument(
+        "--pretty_runs",
+        help="Write .history/.api files as indented JSON instead of compressed, with shared values "
+        "stored once (read those with `python run_payloads.py cat`)",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--promptql_stream",
+        help="Use PromptQL's streaming API (records time to first action)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--http2",
+        help="Use HTTP/2 for PromptQL requests (needs `pip install 'httpx[http2]'`)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--otlp_endpoint",
+        help="Export traces of the runs to this OTLP endpoint, eg: the otel-collector of my-assistant at http://localhost:4317 "
+        "(needs `pip install opentelemetry-sdk opentelemetry-exporter-otlp`)",
+        default=os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT"),
+    )
 
     args = parser.parse_args()
 
     if not args.all and (bool(args.system) != bool(args.model)):
         parser.error("--system and --model must be specified together")
 
-    if args.all:
-        tasks = [
-            run(
+    limits = {
+        provider: replace(
+            limit,
+            max_concurrency=args.max_concurrency or limit.max_concurrency,
+            requests_per_minute=args.requests_per_minute or limit.requests_per_minute,
+        )
+        for provider, limit in DEFAULT_LIMITS.items()
+    }
+    # One scheduler shared by every configuration so limits apply across all of them
+    scheduler = RateLimitScheduler(limits)
+    cache = ResponseCache(args.cache_dir)
+    configure_schema_cache(args.schema_cache_dir or None)
+    if args.otlp_endpoint:
+        tracing.configure(args.otlp_endpoint)
+    run_store = RunStore(args.run_store) if args.run_store else None
+    # Only used in logs with a run store
+    output_dir = args.output_dir or args.run_store
+
+    try:
+        if args.all:
+            tasks = [
+                run(
+                    args.input_filepath,
+                    system,
+                    oracle,
+                    model,
+                    output_dir,
+                    args.repeat,
+                    scheduler,
+                    cache,
+                    args.replay,
+                    args.promptql_stream,
+                    args.http2,
+                    run_store=run_store,
+                    pretty_runs=args.pretty_runs,
+                )
+                for system in System
+                for model in [Model.CLAUDE_3_7_SONNET, Model.O3_MINI]
+                for oracle in [False, True]
+            ]
+            await asyncio.gather(*tasks)
+        else:
+            await run(
                 args.input_filepath,
-                system,
-                oracle,
-                model,
-                args.output_dir,
+                args.system,
+                args.oracle,
+                args.model,
+                output_dir,
                 args.repeat,
-                index * 7,
-            )
-            for index, (system, model, oracle) in enumerate(
-                (s, m, o)
-                for s in System
-                for m in [Model.CLAUDE_3_7_SONNET, Model.O3_MINI]
-                for o in [False, True]
+                scheduler,
+                cache,
+                args.replay,
+                args.promptql_stream,
+                args.http2,
+                run_store=run_store,
+                pretty_runs=args.pretty_runs,
             )
-        ]
-        await asyncio.gather(*tasks)
-    else:
-        await run(
-            args.input_filepath,
-            args.system,
-            args.oracle,
-            args.model,
-            args.output_dir,
-            args.repeat,
-            0,
-        )
+        if cache.cache_dir:
+            print(f"Response cache: {cache.hits} hits, {cache.misses} misses")
+    finally:
+        await close_databases()
+        await close_sandbox_pool()
+        if run_store is not None:
+            run_store.close()
+        tracing.shutdown()
 
 
 if __name__ == "__main__":
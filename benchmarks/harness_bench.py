@@ -0,0 +1,463 @@
+"""
+Benchmark of the harness itself: bench.run and evaluation.evaluate_directory
+driven by an in-process assistant which answers instantly with recorded
+responses, so what's measured is scheduling, serialization and file I/O.
+
+Each stage runs in a fresh process and records its wall-clock and CPU time,
+peak RSS and file-system operations (files opened, directory scans, renames
+and removals as seen by audit hooks, and read/write syscalls and bytes from
+/proc/self/io where available). Results are compared against a stored
+baseline to catch harness regressions before they distort the latencies
+measured for the assistants.
+
+    python -m benchmarks.harness_bench --scales 10 1000 100000
+    python -m benchmarks.harness_bench --update_baseline
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import bench
+import evaluation
+from ai_assistant import AIAssistantResponse, ToolCallingAIAssistant
+from bench import Model, Provider, ReplayAssistant, System
+from claude35_eval import AIAssistant as ClaudeAssistant
+from llm_cache import ResponseCache
+from run_metrics import LLMCall, RunMetrics, ToolCall, TOOL_KINDS
+from run_store import RunStore
+from scheduler import ProviderLimits, RateLimitScheduler
+
+BENCHMARKS_DIR = Path(__file__).parent
+REPO_DIR = BENCHMARKS_DIR.parent
+DEFAULT_INPUT = REPO_DIR / "queries/score_based_prioritization/task.yaml"
+DEFAULT_RECORDINGS = (
+    REPO_DIR
+    / "visualized_results/score_based_prioritization/claude/tool_calling/retrieval"
+)
+DEFAULT_EVALUATOR = REPO_DIR / "scoring/simple_json_scorer.py"
+DEFAULT_BASELINE = BENCHMARKS_DIR / "baseline.json"
+
+STAGES = ["bench", "bench_resume", "evaluate", "evaluate_incremental"]
+
+# Audit events of file-system operations (stat calls aren't audited)
+FS_EVENTS = {
+    "open": "opens",
+    "os.listdir": "dir_scans",
+    "os.scandir": "dir_scans",
+    "os.mkdir": "mkdirs",
+    "os.rename": "renames",
+    "os.remove": "removes",
+}
+
+# Allowed relative increase over the baseline before a metric is a regression
+TOLERANCES = {
+    "time_s": 0.5,
+    "cpu_s": 0.5,
+    "peak_rss_mb": 0.25,
+    "fs_ops": 0.1,
+    "write_bytes": 0.1,
+}
+# Differences in seconds too small to be told apart from noise
+TIME_SLACK_S = 0.05
+
+
+class RecordedRunAssistant(ReplayAssistant):
+    """Answers each query instantly (or after latency_s) with a recorded run of its variation"""
+
+    def __init__(
+        self,
+        responses: Dict[str, AIAssistantResponse],
+        assistant_class: type[ToolCallingAIAssistant],
+        latency_s: float = 0.0,
+    ):
+        super().__init__(assistant_class)
+        self.responses = responses
+        self.latency_s = latency_s
+
+    async def process_query(self, query: str, artifacts: list) -> AIAssistantResponse:
+        if self.latency_s:
+            await asyncio.sleep(self.latency_s)
+        recorded = self.responses[query]
+        # Each run gets its own metrics, like a live assistant's
+        return AIAssistantResponse(
+            response=recorded.response,
+            is_error=recorded.is_error,
+            api_responses=recorded.api_responses,
+            history=recorded.history,
+            metrics=RunMetrics.from_dict(recorded.metrics.to_dict()),
+        )
+
+
+def recorded_metrics(api_responses: List[Dict]) -> RunMetrics:
+    """RunMetrics of a recorded Anthropic run, for recordings made before metrics were saved"""
+    metrics = RunMetrics()
+    for entry in api_responses:
+        message = entry["response"]
+        usage = message.get("usage") or {}
+        metrics.llm_calls.append(
+            LLMCall(
+                model=message.get("model", ""),
+                latency_s=0.0,
+                input_tokens=usage.get("input_tokens", 0),
+                output_tokens=usage.get("output_tokens", 0),
+            )
+        )
+        for block in message.get("content") or []:
+            if block.get("type") == "tool_use":
+                metrics.tool_calls.append(
+                    ToolCall(block["name"], TOOL_KINDS.get(block["name"], "other"), 0.0)
+                )
+    metrics.loop_count = max(len(metrics.llm_calls) - 1, 0)
+    return metrics
+
+
+def load_assistant(
+    input_filepath: str, recordings_dir: str, latency_s: float
+) -> RecordedRunAssistant:
+    """
+    Map the query of each variation to the first recorded run of the variation,
+    or to the first recorded run when the variation has none
+    """
+    config = bench.read_input(input_filepath)
+    recordings = sorted(Path(recordings_dir).glob("*_run_*.history"))
+    if not recordings:
+        raise FileNotFoundError(f"No recorded runs in {recordings_dir}")
+    responses = {}
+    for variation in config.variations:
+        recorded = bench.load_recorded_response(
+            f"{recordings_dir}/{variation.name}_run_1"
+        ) or bench.load_recorded_response(str(recordings[0].with_suffix("")))
+        assert recorded is not None
+        response, _ = recorded
+        if response.metrics is None:
+            response.metrics = recorded_metrics(response.api_responses)
+        query = config.tool_calling.retrieval_prompt.format(**variation.parameters)
+        responses[query] = response
+    return RecordedRunAssistant(responses, ClaudeAssistant, latency_s)
+
+
+def prepare_bench(options: Dict[str, Any]) -> Callable[[], Any]:
+    assistant = load_assistant(
+        options["input_filepath"], options["recordings_dir"], options["latency_s"]
+    )
+    limits = ProviderLimits(
+        max_concurrency=options["concurrency"], requests_per_minute=1e9
+    )
+    scheduler = RateLimitScheduler({provider: limits for provider in Provider})
+    run_store = RunStore(options["run_store"]) if options["run_store"] else None
+
+    def work():
+        asyncio.run(
+            bench.run(
+                options["input_filepath"],
+                System.TOOL_CALLING,
+                False,
+                Model.CLAUDE_3_7_SONNET,
+                options["output_dir"],
+                options["repeat"],
+                scheduler,
+                ResponseCache(),
+                assistant=assistant,
+                run_store=run_store,
+                pretty_runs=options["pretty_runs"],
+            )
+        )
+
+    return work
+
+
+def prepare_evaluate(options: Dict[str, Any], incremental: bool) -> Callable[[], Any]:
+    config = evaluation.read_input_config(options["input_filepath"])
+    results_file = Path(options["output_dir"]) / "evaluation-results.csv"
+    manifest_path = results_file.with_name(results_file.name + ".manifest.json")
+
+    def work():
+        manifest = evaluation.load_manifest(manifest_path) if incremental else {}
+        if options["run_store"]:
+            results = evaluation.evaluate_store(
+                RunStore(options["run_store"]),
+                config,
+                options["input_filepath"],
+                options["evaluator_module"],
+                manifest=manifest,
+                max_workers=options["workers"],
+            )
+        else:
+            results = evaluation.evaluate_directory(
+                Path(options["output_dir"]),
+                config,
+                options["input_filepath"],
+                options["evaluator_module"],
+                manifest=manifest,
+                max_workers=options["workers"],
+            )
+        evaluation.save_results(results, results_file)
+        evaluation.save_manifest(manifest, manifest_path)
+        if len(results) != options["runs"]:
+            raise RuntimeError(f"Scored {len(results)} of {options['runs']} runs")
+
+    return work
+
+
+def read_proc_io() -> Dict[str, int]:
+    """Read/write syscalls and bytes of this process so far (Linux only)"""
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+    except OSError:
+        return {}
+    return {
+        "read_syscalls": int(fields["syscr"]),
+        "write_syscalls": int(fields["syscw"]),
+        "read_bytes": int(fields["rchar"]),
+        "write_bytes": int(fields["wchar"]),
+    }
+
+
+def max_rss_mb(who: int) -> float:
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    rss = resource.getrusage(who).ru_maxrss
+    return rss / 1024**2 if sys.platform == "darwin" else rss / 1024
+
+
+def run_stage(stage: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """Run a stage in this (fresh) process and measure it, after its setup"""
+    match stage:
+        case "bench" | "bench_resume":
+            work = prepare_bench(options)
+        case "evaluate" | "evaluate_incremental":
+            work = prepare_evaluate(options, incremental=stage != "evaluate")
+        case _:
+            raise ValueError(f"Unknown stage {stage}")
+
+    fs_ops: Counter = Counter()
+
+    def audit(event: str, args):
+        if event in FS_EVENTS:
+            fs_ops[FS_EVENTS[event]] += 1
+
+    # Audit hooks can't be removed, this process only runs one stage
+    sys.addaudithook(audit)
+    io_start = read_proc_io()
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        work()
+    cpu_s = time.process_time() - cpu_start
+    time_s = time.perf_counter() - start
+    io_end = read_proc_io()
+    fs_ops_total = sum(fs_ops.values())
+
+    return {
+        "time_s": time_s,
+        "cpu_s": cpu_s,
+        "peak_rss_mb": max_rss_mb(resource.RUSAGE_SELF),
+        # Scoring workers of the evaluate stages
+        "children_peak_rss_mb": max_rss_mb(resource.RUSAGE_CHILDREN),
+        "fs_ops": fs_ops_total,
+        **{f"fs_{kind}": count for kind, count in sorted(fs_ops.items())},
+        **{key: io_end[key] - io_start[key] for key in io_end},
+    }
+
+
+def run_scale(
+    scale: int, label: str, args: argparse.Namespace
+) -> Dict[str, Dict[str, Any]]:
+    variations = len(bench.read_input(args.input_filepath).variations)
+    repeat = math.ceil(scale / variations)
+    work_dir = tempfile.mkdtemp(prefix=f"harness_bench_{scale}_", dir=args.work_dir)
+    options = {
+        "input_filepath": args.input_filepath,
+        "recordings_dir": args.recordings_dir,
+        "evaluator_module": args.evaluator_module,
+        "output_dir": work_dir,
+        "repeat": repeat,
+        "runs": repeat * variations,
+        "latency_s": args.latency,
+        "concurrency": args.concurrency,
+        "workers": args.workers,
+        "run_store": os.path.join(work_dir, "runs.sqlite") if args.run_store else None,
+        "pretty_runs": args.pretty_runs,
+    }
+    results = {}
+    try:
+        for stage in args.stages:
+            # Spawned so peak RSS is the stage's own, not inherited
+            with ProcessPoolExecutor(
+                max_workers=1, mp_context=get_context("spawn")
+            ) as executor:
+                results[stage] = executor.submit(run_stage, stage, options).result()
+            results[stage]["runs"] = options["runs"]
+            print(format_row(label, stage, results[stage]))
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def format_row(label: str, stage: str, result: Dict[str, Any]) -> str:
+    return (
+        f"{label:>7} {stage:<21} {result['time_s']:>9.2f}s {result['cpu_s']:>9.2f}s "
+        f"{result['peak_rss_mb']:>8.1f}MB {result['fs_ops']:>10} fs ops "
+        f"{result.get('write_bytes', 0) / 1024**2:>9.1f}MB written"
+    )
+
+
+def compare(
+    results: Dict[str, Dict[str, Dict[str, Any]]],
+    baseline: Dict[str, Dict[str, Dict[str, Any]]],
+) -> List[str]:
+    """Regressions of results against the baseline, for the scales and stages both have"""
+    regressions = []
+    for scale, stages in results.items():
+        for stage, result in stages.items():
+            expected = baseline.get(scale, {}).get(stage)
+            if expected is None:
+                continue
+            for metric, tolerance in TOLERANCES.items():
+                if metric not in result or metric not in expected:
+                    continue
+                value, limit = result[metric], expected[metric] * (1 + tolerance)
+                if metric in ("time_s", "cpu_s"):
+                    limit = max(limit, expected[metric] + TIME_SLACK_S)
+                if value > limit:
+                    regressions.append(
+                        f"{scale} runs, {stage}: {metric} {value:.6g} > {expected[metric]:.6g} "
+                        f"(+{tolerance:.0%} allowed)"
+                    )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--scales",
+        type=int,
+        nargs="+",
+        default=[10, 100, 1000],
+        help="Number of runs of each benchmark (rounded up to a multiple of the variations)",
+    )
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--input_filepath", default=str(DEFAULT_INPUT))
+    parser.add_argument(
+        "--recordings_dir",
+        default=str(DEFAULT_RECORDINGS),
+        help="Recorded tool calling runs the assistant answers with",
+    )
+    parser.add_argument("--evaluator_module", default=str(DEFAULT_EVALUATOR))
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Seconds each run of the assistant takes",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1000,
+        help="Runs in flight (the scheduler's max_concurrency)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Scoring processes (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--run_store",
+        action="store_true",
+        help="Save and score the runs with a run store instead of files "
+        "(benchmarks are labeled <runs>+store)",
+    )
+    parser.add_argument(
+        "--pretty_runs",
+        action="store_true",
+        help="Write runs as indented JSON like bench.py --pretty_runs "
+        "(benchmarks are labeled <runs>+pretty)",
+    )
+    parser.add_argument(
+        "--work_dir", help="Directory of the benchmark outputs (default: temp dir)"
+    )
+    parser.add_argument(
+        "--keep", action="store_true", help="Keep the benchmark outputs"
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+    parser.add_argument(
+        "--update_baseline",
+        action="store_true",
+        help="Store the results as the baseline instead of comparing with it",
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'runs':>7} {'stage':<21} {'wall':>10} {'cpu':>10} {'peak RSS':>10} "
+        f"{'fs ops':>17} {'written':>18}"
+    )
+    suffix = ("+store" if args.run_store else "") + (
+        "+pretty" if args.pretty_runs else ""
+    )
+    results = {
+        f"{scale}{suffix}": run_scale(scale, f"{scale}{suffix}", args)
+        for scale in args.scales
+    }
+    report = {
+        "platform": {
+            "python": platform.python_version(),
+            "system": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "scales": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.update_baseline:
+        baseline_scales = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline_scales = json.load(f)["scales"]
+        # Scales that weren't run keep their baseline
+        report["scales"] = {**baseline_scales, **results}
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}, run with --update_baseline")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("platform") != report["platform"]:
+        print(
+            f"\nWarning: the baseline was recorded on {baseline.get('platform')}, "
+            "times and memory may not be comparable"
+        )
+    regressions = compare(results, baseline["scales"])
+    if regressions:
+        print("\nRegressions against the baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print("\nNo regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
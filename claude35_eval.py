@@ -1,16 +1,33 @@
+import asyncio
 import os
-import psycopg2
 import anthropic
 from ai_assistant import AIAssistantResponse, ToolCallingAIAssistant
-from anthropic.types import TextBlock, ToolParam
+from db_pool import ReadOnlyDatabase, close_databases, get_database
+from llm_cache import (
+    ResponseCache,
+    cached_system_prompt,
+    cached_tools,
+    with_cache_breakpoint,
+)
+from python_sandbox import close_sandbox_pool, get_sandbox_pool
+from run_metrics import RunMetrics
+from schema_cache import get_schema_cache
+from scheduler import Provider, RateLimitScheduler
+import tracing
+from anthropic.types import (
+    Message,
+    TextBlock,
+    ToolParam,
+    ToolResultBlockParam,
+    ToolUseBlock,
+)
 from typing import List, Dict, Any
 import logging
 import json
 from datetime import datetime, date
 from decimal import Decimal
-import tempfile
-import subprocess
 import re
+import time
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -35,80 +52,56 @@ class DateTimeEncoder(json.JSONEncoder):
 
 
 class DatabaseTool:
-    _control_plane_conn = None
-    _support_tickets_conn = None
-
     def __init__(self, has_python_tool: bool = False):
-        # Initialize database connections
-        if DatabaseTool._control_plane_conn is None:
-            DatabaseTool._control_plane_conn = psycopg2.connect(CONTROL_PLANE_URL)
-        if DatabaseTool._support_tickets_conn is None:
-            DatabaseTool._support_tickets_conn = psycopg2.connect(SUPPORT_TICKETS_URL)
-        self.control_plane_conn = DatabaseTool._control_plane_conn
-        self.support_tickets_conn = DatabaseTool._support_tickets_conn
+        # Pools are shared by every assistant in the process
+        self.control_plane_db = get_database(CONTROL_PLANE_URL)
+        self.support_tickets_db = get_database(SUPPORT_TICKETS_URL)
         self.has_python_tool = has_python_tool
         self.schema_cache = {}
 
-    def get_database_schema(
-        self, conn: psycopg2.extensions.connection, custom_where_clause: str
+    async def get_database_schema(
+        self, db: ReadOnlyDatabase, custom_where_clause: str
     ) -> str:
         """Get database schema information"""
-        with conn.cursor() as cursor:
-            query = """
-                SELECT 
-                    table_name,
-                    column_name,
-                    data_type
-                FROM 
-                    information_schema.columns
-                WHERE 
-                    table_schema = 'public' AND {}
-                ORDER BY 
-                    table_name, ordinal_position;
-            """.format(
-                custom_where_clause
+        query = """
+            SELECT 
+                table_name,
+                column_name,
+                data_type
+            FROM 
+                information_schema.columns
+            WHERE 
+                table_schema = 'public' AND {}
+            ORDER BY 
+                table_name, ordinal_position;
+        """.format(custom_where_clause)
+
+        # Served from the schema cache while the database's schema is unchanged
+        results = await get_schema_cache().fetch(db, query)
+
+        schema = {}
+        for row in results:
+            table_name = row["table_name"]
+            if table_name not in schema:
+                schema[table_name] = {"columns": []}
+            schema[table_name]["columns"].append(
+                {"name": row["column_name"], "type": row["data_type"]}
             )
 
-            cursor.execute(query)
-            results = cursor.fetchall()
-
-            schema = {}
-            for row in results:
-                table_name, column_name, data_type = row
-                if table_name not in schema:
-                    schema[table_name] = {"columns": []}
-                schema[table_name]["columns"].append(
-                    {"name": column_name, "type": data_type}
-                )
-
-            schema_str = "\n"
-            for table, details in schema.items():
-                schema_str += f"table {table} columns ("
-                for col in details["columns"]:
-                    schema_str += f" {col['name']} {col['type']},"
-                schema_str += ")\n"
+        schema_str = "\n"
+        for table, details in schema.items():
+            schema_str += f"table {table} columns ("
+            for col in details["columns"]:
+                schema_str += f" {col['name']} {col['type']},"
+            schema_str += ")\n"
 
-            return schema_str.strip()
+        return schema_str.strip()
 
-    def execute_query(
-        self, conn: psycopg2.extensions.connection, sql: str
-    ) -> List[Dict]:
+    async def execute_query(self, db: ReadOnlyDatabase, sql: str) -> List[Dict]:
         """Execute a read-only SQL query"""
 
         logger.info("Executing SQL: \n %s", sql)
-        with conn.cursor() as cursor:
-            try:
-                cursor.execute("BEGIN TRANSACTION READ ONLY")
-                cursor.execute(sql)
-                description = cursor.description
-                assert description is not None
-                columns = [desc[0] for desc in description]
-                results = [dict(zip(columns, row)) for row in cursor.fetchall()]
-                conn.rollback()
-                return results
-            except Exception as e:
-                conn.rollback()
-                raise e
+        return await db.execute_query(sql)
 
     @property
     def tool_schemas(self) -> List[ToolParam]:
@@ -157,50 +150,51 @@ class DatabaseTool:
 
         return tools
 
-    def execute_python_code(self, python_code: str) -> Dict[str, str | int]:
-        """Execute Python code and return the results"""
+    async def execute_python_code(self, python_code: str) -> Dict[str, str | int]:
+        """Execute Python code in the sandbox pool and return the results"""
 
         logger.info("Executing Python: \n %s", python_code)
 
-        with tempfile.NamedTemporaryFile(mode="w", suffix=".py", delete=False) as tmp:
-            tmp.write(python_code)
-            tmp_path = tmp.name
-
-        try:
-            process = subprocess.Popen(
-                ["python3", tmp_path],
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-            )
-            stdout, stderr = process.communicate()
-            return {"stdout": stdout, "stderr": stderr, "exitCode": process.returncode}
-        finally:
-            os.unlink(tmp_path)
+        result = await get_sandbox_pool().run(python_code)
+        return {
+            "stdout": result.stdout,
+            "stderr": result.stderr,
+            "exitCode": result.exit_code,
+        }
 
     def close(self):
-        """Close database connections"""
+        """Connection pools are shared, they are closed with db_pool.close_databases()"""
         pass
-        # self.control_plane_conn.close()
-        # self.support_tickets_conn.close()
 
 
 class AIAssistant(ToolCallingAIAssistant):
-    def __init__(self, model: str, has_python_tool: bool = False):
+    def __init__(
+        self,
+        model: str,
+        has_python_tool: bool = False,
+        scheduler: RateLimitScheduler | None = None,
+        cache: ResponseCache | None = None,
+    ):
         self.model = model
         self.tools = DatabaseTool(has_python_tool=has_python_tool)
         self.client = anthropic.AsyncAnthropic(
             api_key=os.environ.get("ANTHROPIC_API_KEY")
         )
-        # Cache schemas on initialization
-        self.control_plane_schema = self.tools.get_database_schema(
-            self.tools.control_plane_conn, "table_name NOT LIKE 'support%'"
-        )
-        self.support_tickets_schema = self.tools.get_database_schema(
-            self.tools.support_tickets_conn, "table_name LIKE 'support%'"
-        )
-        self.system_prompt = f"""You are an assistant with access to two databases with the following schemas:
+        self.scheduler = scheduler or RateLimitScheduler()
+        self.cache = cache or ResponseCache()
+        # Schemas are fetched on the first query since they need the event loop
+        self.system_prompt: str | None = None
+
+    async def get_system_prompt(self) -> str:
+        """Build the system prompt (with database schemas) once and cache it"""
+        if self.system_prompt is None:
+            self.control_plane_schema = await self.tools.get_database_schema(
+                self.tools.control_plane_db, "table_name NOT LIKE 'support%'"
+            )
+            self.support_tickets_schema = await self.tools.get_database_schema(
+                self.tools.support_tickets_db, "table_name LIKE 'support%'"
+            )
+            self.system_prompt = f"""You are an assistant with access to two databases with the following schemas:
 
 1. Control Plane Database Schema:
 {self.control_plane_schema}
@@ -210,8 +204,60 @@ class AIAssistant(ToolCallingAIAssistant):
 
 Additional Instructions:
 - Always write queries that are compatible with PostgreSQL
-- Current timestamp is: {datetime.now()}
+- Current timestamp is: {datetime.now().date()}
 """
+        return self.system_prompt
+
+    async def create_message(self, metrics: RunMetrics, **request) -> Message:
+        """Create a message (from the response cache when possible) and record it"""
+        with tracing.span(
+            f"chat {request['model']}",
+            {"gen_ai.system": "anthropic", "gen_ai.request.model": request["model"]},
+        ):
+            start = time.monotonic()
+            message = await self.cache.fetch(
+                Provider.ANTHROPIC,
+                request,
+                Message,
+                lambda: self.scheduler.call(
+                    Provider.ANTHROPIC,
+                    lambda: self.client.messages.create(**request),
+                ),
+            )
+            metrics.record_anthropic(message, time.monotonic() - start)
+        return message
+
+    async def call_tool(
+        self, metrics: RunMetrics, tool_use: ToolUseBlock
+    ) -> ToolResultBlockParam:
+        """Run a tool call, the tool result answering it has its result or error"""
+        function_name = tool_use.name
+        function_args = tool_use.input
+        assert isinstance(function_args, dict)
+        try:
+            result = None
+            with metrics.tool_call(function_name):
+                if function_name == "query_control_plane_data":
+                    result = await self.tools.execute_query(
+                        self.tools.control_plane_db,
+                        function_args.get("sql", ""),
+                    )
+                elif function_name == "query_support_tickets":
+                    result = await self.tools.execute_query(
+                        self.tools.support_tickets_db,
+                        function_args.get("sql", ""),
+                    )
+                elif function_name == "execute_python_program":
+                    result = await self.tools.execute_python_code(
+                        function_args.get("pythonCode", "")
+                    )
+            content = json.dumps(result, cls=DateTimeEncoder)
+        except Exception as e:
+            error_message = f"Error executing {function_name}: {str(e)}"
+            logger.error(error_message)
+            content = json.dumps({"error": error_message})
+
+        return {"type": "tool_result", "tool_use_id": tool_use.id, "content": content}
 
     async def process_query(self, query: str, artifacts: list) -> AIAssistantResponse:
         assert len(artifacts) == 0, "Artifacts unsupported in this assistant"
@@ -219,8 +265,10 @@ Additional Instructions:
         messages = []
         api_responses = []
         is_error = False
+        metrics = RunMetrics()
         """Process a query using available tools and Claude while maintaining conversation history"""
         messages.append({"role": "user", "content": query})
+        system_prompt = await self.get_system_prompt()
 
         tool_loop_count = 0
         MAX_TOOL_LOOPS = 10
@@ -229,12 +277,15 @@ Additional Instructions:
             while tool_loop_count < MAX_TOOL_LOOPS:
                 max_tokens = 64000 if self.model.startswith("claude-3-7") else 4096
                 print(f"\n[{datetime.now()}] waiting for Anthropic response...")
-                message = await self.client.messages.create(
+                message = await self.create_message(
+                    metrics,
                     model=self.model,
                     max_tokens=max_tokens,
-                    system=self.system_prompt,
-                    messages=messages,
-                    tools=self.tools.tool_schemas,
+                    # The schemas and tools are resent every loop, mark them
+                    # (and the conversation so far) for prompt caching
+                    system=cached_system_prompt(system_prompt),
+                    messages=with_cache_breakpoint(messages),
+                    tools=cached_tools(self.tools.tool_schemas),
                 )
                 print(f"[{datetime.now()}] received Anthropic response...\n")
                 api_responses.append(
@@ -258,54 +309,21 @@ Additional Instructions:
                     # Add assistant's response with structured content
                     messages.append({"role": "assistant", "content": response_content})
 
-                    # Process all tool calls and collect results
-                    tool_results = []
-                    for content_block in response_content:
-                        if content_block.type == "tool_use":
-                            tool_call = content_block
-                            function_name = tool_call.name
-                            function_args = tool_call.input
-                            tool_use_id = tool_call.id
-                            assert isinstance(function_args, dict)
-                            try:
-                                result = None
-                                if function_name == "query_control_plane_data":
-                                    result = self.tools.execute_query(
-                                        self.tools.control_plane_conn,
-                                        function_args.get("sql", ""),
-                                    )
-                                elif function_name == "query_support_tickets":
-                                    result = self.tools.execute_query(
-                                        self.tools.support_tickets_conn,
-                                        function_args.get("sql", ""),
-                                    )
-                                elif function_name == "execute_python_program":
-                                    result = self.tools.execute_python_code(
-                                        function_args.get("pythonCode", "")
-                                    )
-
-                                # Collect tool result
-                                tool_results.append(
-                                    {
-                                        "type": "tool_result",
-                                        "tool_use_id": tool_use_id,
-                                        "content": json.dumps(
-                                            result, cls=DateTimeEncoder
-                                        ),
-                                    }
-                                )
-                            except Exception as e:
-                                error_message = (
-                                    f"Error executing {function_name}: {str(e)}"
-                                )
-                                logger.error(error_message)
-                                tool_results.append(
-                                    {
-                                        "type": "tool_result",
-                                        "tool_use_id": tool_use_id,
-                                        "content": json.dumps({"error": error_message}),
-                                    }
-                                )
+                    # Run all tool calls concurrently (eg: queries to both
+                    # databases) and collect their results in the order of the calls
+                    tool_uses = [
+                        block for block in response_content if block.type == "tool_use"
+                    ]
+                    for tool_use in tool_uses:
+                        assert isinstance(tool_use.input, dict)
+                    tool_results = list(
+                        await asyncio.gather(
+                            *(
+                                self.call_tool(metrics, tool_use)
+                                for tool_use in tool_uses
+                            )
+                        )
+                    )
 
                     # Add all tool results in a single message
                     messages.append({"role": "user", "content": tool_results})
@@ -336,11 +354,13 @@ Additional Instructions:
             response_text = error_message
             is_error = True
 
+        metrics.loop_count = tool_loop_count
         return AIAssistantResponse(
             response=response_text,
             is_error=is_error,
             api_responses=api_responses,
             history=messages,
+            metrics=metrics,
         )
 
     def process_response(self, response: AIAssistantResponse, tag_name: str) -> str:
@@ -398,9 +418,9 @@ async def main():
         print("\nExiting...")
     finally:
         await assistant.close()
+        await close_databases()
+        await close_sandbox_pool()
 
 
 if __name__ == "__main__":
-    import asyncio
-
     asyncio.run(main())
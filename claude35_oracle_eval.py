@@ -1,17 +1,27 @@
+import asyncio
 import os
 import psycopg2
 import anthropic
-from anthropic.types import TextBlock
+from anthropic.types import Message, TextBlock, ToolResultBlockParam, ToolUseBlock
 from typing import List, Dict, Any
 import logging
 import json
 from datetime import datetime, date
 from decimal import Decimal
-import tempfile
-import subprocess
 import re
+import time
 
 from ai_assistant import AIAssistantResponse, ToolCallingAIAssistant
+from llm_cache import (
+    ResponseCache,
+    cached_system_prompt,
+    cached_tools,
+    with_cache_breakpoint,
+)
+from python_sandbox import close_sandbox_pool, get_sandbox_pool
+from run_metrics import RunMetrics
+from scheduler import Provider, RateLimitScheduler
+import tracing
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -23,31 +33,17 @@ class DatabaseTool:
     def __init__(self, has_python_tool: bool = False):
         self.has_python_tool = has_python_tool
 
-    def execute_python_code(self, python_code: str) -> Dict[str, str]:
-        """Execute Python code and return the results"""
+    async def execute_python_code(self, python_code: str) -> Dict[str, str]:
+        """Execute Python code in the sandbox pool and return the results"""
 
         logger.info("Executing Python: \n %s", python_code)
 
-        with tempfile.NamedTemporaryFile(mode="w", suffix=".py", delete=False) as tmp:
-            tmp.write(python_code)
-            tmp_path = tmp.name
-
-        try:
-            process = subprocess.Popen(
-                ["python3", tmp_path],
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-            )
-            stdout, stderr = process.communicate()
-            return {
-                "stdout": stdout,
-                "stderr": stderr,
-                "exitCode": str(process.returncode),
-            }
-        finally:
-            os.unlink(tmp_path)
+        result = await get_sandbox_pool().run(python_code)
+        return {
+            "stdout": result.stdout,
+            "stderr": result.stderr,
+            "exitCode": str(result.exit_code),
+        }
 
     @property
     def tool_schemas(self) -> List[Dict]:
@@ -75,13 +71,62 @@ class DatabaseTool:
 
 
 class AIAssistant(ToolCallingAIAssistant):
-    def __init__(self, model: str, has_python_tool: bool):
+    def __init__(
+        self,
+        model: str,
+        has_python_tool: bool,
+        scheduler: RateLimitScheduler | None = None,
+        cache: ResponseCache | None = None,
+    ):
         self.model = model
         self.has_python_tool = has_python_tool
         self.python_tool = DatabaseTool(has_python_tool=has_python_tool)
         self.client = anthropic.AsyncAnthropic(
             api_key=os.environ.get("ANTHROPIC_API_KEY")
         )
+        self.scheduler = scheduler or RateLimitScheduler()
+        self.cache = cache or ResponseCache()
+
+    async def create_message(self, metrics: RunMetrics, **request) -> Message:
+        """Create a message (from the response cache when possible) and record it"""
+        with tracing.span(
+            f"chat {request['model']}",
+            {"gen_ai.system": "anthropic", "gen_ai.request.model": request["model"]},
+        ):
+            start = time.monotonic()
+            message = await self.cache.fetch(
+                Provider.ANTHROPIC,
+                request,
+                Message,
+                lambda: self.scheduler.call(
+                    Provider.ANTHROPIC,
+                    lambda: self.client.messages.create(**request),
+                ),
+            )
+            metrics.record_anthropic(message, time.monotonic() - start)
+        return message
+
+    async def call_tool(
+        self, metrics: RunMetrics, tool_use: ToolUseBlock
+    ) -> ToolResultBlockParam:
+        """Run a tool call, the tool result answering it has its result or error"""
+        function_name = tool_use.name
+        function_args = tool_use.input
+        assert isinstance(function_args, dict)
+        try:
+            result = None
+            with metrics.tool_call(function_name):
+                if function_name == "execute_python_program":
+                    result = await self.python_tool.execute_python_code(
+                        function_args.get("pythonCode", "")
+                    )
+            content = json.dumps(result)
+        except Exception as e:
+            error_message = f"Error executing {function_name}: {str(e)}"
+            logger.error(error_message)
+            content = json.dumps({"error": error_message})
+
+        return {"type": "tool_result", "tool_use_id": tool_use.id, "content": content}
 
     async def process_query(self, query: str, artifacts: list) -> AIAssistantResponse:
         """Process a query using available tools and Claude while maintaining conversation history"""
@@ -98,6 +143,7 @@ The user has uploaded the following files/artifacts for the conversation:
         api_responses = []
         response_text = None
         is_error = False
+        metrics = RunMetrics()
 
         messages.append({"role": "user", "content": query})
 
@@ -109,12 +155,15 @@ The user has uploaded the following files/artifacts for the conversation:
 
                 max_tokens = 64000 if self.model.startswith("claude-3-7") else 4096
                 print(f"\n[{datetime.now()}] waiting for Anthropic response...")
-                message = await self.client.messages.create(
+                message = await self.create_message(
+                    metrics,
                     model=self.model,
                     max_tokens=max_tokens,
-                    system=system_prompt,
-                    messages=messages,
-                    tools=self.python_tool.tool_schemas if self.has_python_tool else [],  # type: ignore
+                    # The artifacts are resent every loop, mark them (and the
+                    # conversation so far) for prompt caching
+                    system=cached_system_prompt(system_prompt),
+                    messages=with_cache_breakpoint(messages),
+                    tools=cached_tools(self.python_tool.tool_schemas if self.has_python_tool else []),  # type: ignore
                 )
                 print(f"[{datetime.now()}] received Anthropic response...\n")
                 api_responses.append(
@@ -138,42 +187,21 @@ The user has uploaded the following files/artifacts for the conversation:
                     # Add assistant's response with structured content
                     messages.append({"role": "assistant", "content": response_content})
 
-                    # Process all tool calls and collect results
-                    tool_results = []
-                    for content_block in response_content:
-                        if content_block.type == "tool_use":
-                            tool_call = content_block
-                            function_name = tool_call.name
-                            function_args = tool_call.input
-                            tool_use_id = tool_call.id
-                            assert isinstance(function_args, dict)
-                            try:
-                                result = None
-                                if function_name == "execute_python_program":
-                                    result = self.python_tool.execute_python_code(
-                                        function_args.get("pythonCode", "")
-                                    )
-
-                                # Collect tool result
-                                tool_results.append(
-                                    {
-                                        "type": "tool_result",
-                                        "tool_use_id": tool_use_id,
-                                        "content": json.dumps(result),
-                                    }
-                                )
-                            except Exception as e:
-                                error_message = (
-                                    f"Error executing {function_name}: {str(e)}"
-                                )
-                                logger.error(error_message)
-                                tool_results.append(
-                                    {
-                                        "type": "tool_result",
-                                        "tool_use_id": tool_use_id,
-                                        "content": json.dumps({"error": error_message}),
-                                    }
-                                )
+                    # Run all tool calls concurrently (eg: queries to both
+                    # databases) and collect their results in the order of the calls
+                    tool_uses = [
+                        block for block in response_content if block.type == "tool_use"
+                    ]
+                    for tool_use in tool_uses:
+                        assert isinstance(tool_use.input, dict)
+                    tool_results = list(
+                        await asyncio.gather(
+                            *(
+                                self.call_tool(metrics, tool_use)
+                                for tool_use in tool_uses
+                            )
+                        )
+                    )
 
                     # Add all tool results in a single message
                     messages.append({"role": "user", "content": tool_results})
@@ -204,11 +232,13 @@ The user has uploaded the following files/artifacts for the conversation:
             messages.append({"role": "assistant", "content": error_message})
             response_text = error_message
             is_error = True
+        metrics.loop_count = tool_loop_count
         return AIAssistantResponse(
             response=response_text,
             is_error=is_error,
             api_responses=api_responses,
             history=messages,
+            metrics=metrics,
         )
 
     def process_response(self, response: AIAssistantResponse, tag_name: str) -> str:
@@ -260,9 +290,9 @@ async def main():
 
     except KeyboardInterrupt:
         print("\nExiting...")
+    finally:
+        await close_sandbox_pool()
 
 
 if __name__ == "__main__":
-    import asyncio
-
     asyncio.run(main())
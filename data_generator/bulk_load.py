@@ -0,0 +1,56 @@
+import io
+import csv
+from typing import Any, Dict, Iterable, Sequence
+
+# NULL marker of the CSV COPYs, so that '' stays an empty string
+NULL = '\\N'
+
+
+def copy_rows(cursor, table: str, columns: Sequence[str], rows: Iterable[Sequence[Any]]):
+    """COPY rows (sequences of values in column order) into a table"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([NULL if value is None else value for value in row])
+    buffer.seek(0)
+    cursor.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '{NULL}')",
+        buffer
+    )
+
+
+class BulkWriter:
+    """
+    Buffers rows of several tables as CSV and COPYs them into the database
+    when the buffers get large (and on flush). Tables are written in the order
+    they are given, so list referenced tables before the tables referencing
+    them.
+    """
+    def __init__(self, cursor, tables: Dict[str, Sequence[str]], max_buffer_bytes: int = 64 * 1024 * 1024):
+        self.cursor = cursor
+        self.tables = tables
+        self.max_buffer_bytes = max_buffer_bytes
+        self.buffers = {table: io.StringIO() for table in tables}
+        self.writers = {table: csv.writer(buffer) for table, buffer in self.buffers.items()}
+        self.row_counts = {table: 0 for table in tables}
+
+    def add(self, table: str, rows: Iterable[Sequence[Any]]):
+        writer = self.writers[table]
+        for row in rows:
+            writer.writerow([NULL if value is None else value for value in row])
+            self.row_counts[table] += 1
+        if sum(buffer.tell() for buffer in self.buffers.values()) > self.max_buffer_bytes:
+            self.flush()
+
+    def flush(self):
+        for table, columns in self.tables.items():
+            buffer = self.buffers[table]
+            if buffer.tell() == 0:
+                continue
+            buffer.seek(0)
+            self.cursor.copy_expert(
+                f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '{NULL}')",
+                buffer
+            )
+            self.buffers[table] = io.StringIO()
+            self.writers[table] = csv.writer(self.buffers[table])
@@ -1,13 +1,8 @@
-from pprint import pprint
-import random
-import user_generator
-import usage_generator
-import plan_change_generator
-import invoice_generator
-import support_agent_generator
-import support_ticket_generator
+import os
+import argparse
+import pipeline
 from typing import List, Dict
-from datetime import datetime
+from datetime import date
 
 import psycopg2
 from psycopg2.extras import execute_values
@@ -46,9 +41,6 @@ PLANS = [
     }
 ]
 
-def months_between(date1, date2):
-    return (date1.year - date2.year) * 12 + (date1.month - date2.month)
-
 def insert_plans(connection_params, plans: List[Dict]):
 
     conn = psycopg2.connect(**connection_params)
@@ -79,6 +71,25 @@ def insert_plans(connection_params, plans: List[Dict]):
     conn.close()
 
 def main():
+    parser = argparse.ArgumentParser(description='Generate the control plane and support tickets datasets')
+    parser.add_argument('--users', type=int, default=50, help='Number of users (default: 50)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Number of generator processes (default: number of CPUs)')
+    parser.add_argument('--shard_size', type=int, default=100,
+                        help='Users generated and loaded per transaction (default: 100)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the dataset (default: 0)')
+    parser.add_argument('--as_of', type=date.fromisoformat, default=None,
+                        help='Generate usage and invoices up to this date, YYYY-MM-DD (default: today)')
+    parser.add_argument('--no_tickets', action='store_true',
+                        help="Skip the support agents and tickets, which need an OpenAI call per ticket")
+    parser.add_argument('--offline_tickets', action='store_true',
+                        help='Fill ticket texts from templates instead of calling the OpenAI API')
+    parser.add_argument('--ticket_cache_dir', type=str, default=None,
+                        help='Cache the generated ticket texts in this directory, to reuse them when regenerating')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='Concurrent ticket text requests per worker (default: 8)')
+    args = parser.parse_args()
+
     cp_connection_params = {
         'dbname': 'control_plane_new',
         'user': 'postgres',
@@ -93,68 +104,22 @@ def main():
         'host': 'localhost',
         'port': '5432'
     }
-    
+
     insert_plans(cp_connection_params, PLANS)
-    support_agent_generator.create_support_agents(5)
-    
-    num_users=50
-   
-    for _ in range(0,num_users):
-        
-        plan = random.choices(['free', 'base', 'advanced'], weights=[0.5, 0.3, 0.2])[0]
-        # Determine project behavior pattern
-        request_pattern_type = random.choices(
-                ['silent', 'increasing', 'intermittent', 'decreasing', 'steady'],
-                weights=[0.1, 0.2, 0.3, 0.2, 0.2]
-        )[0]
 
-        # Random price between $30-100 per model for advanced plan. Fixed for a project
-        price_per_model_advanced = int(random.uniform(30, 100))
-    
-        ticket_frequency = random.choices(['low', 'medium', 'high'], weights=[0.4, 0.5, 0.1])[0]
-    
-        print('plan:', plan)
-        print('request_pattern_type: ', request_pattern_type)
-        print('price_per_model_advanced: ', price_per_model_advanced)
-        print('ticket_frequency: ', ticket_frequency)
-    
-        user = user_generator.generate_and_insert_user(cp_connection_params, plan = plan, 
-                                                       initial_request_pattern_type=request_pattern_type, 
-                                                       price_per_model_advanced=price_per_model_advanced,
-                                                       ticket_frequency=ticket_frequency)
-        pprint(user)
-    
-        for project, plan in zip(user['projects'], user['plan_changes']):
-            usage = usage_generator.generate_and_insert_usage(cp_connection_params, project_id=project['id'], request_pattern_type=request_pattern_type)
-            print(usage)
-            plan_changes = plan_change_generator.generate_and_insert_plan_changes(cp_connection_params, project_id=project['id'])
-            print(plan_changes)
-            invoices = invoice_generator.generate_and_insert_invoices(cp_connection_params, project_id=project['id'], price_per_model_advanced=price_per_model_advanced)
-            print(invoices)
-            
-            months_diff = months_between(datetime.now(), project['created_at']) 
-            if ticket_frequency == "low" and plan['name'] in ['base', 'advanced']:
-                num_tickets = random.randint(0, int(months_diff/8))
-            elif ticket_frequency == 'medium' and plan['name'] in ['base', 'advanced']:
-                num_tickets = random.randint(1, max(1, int(months_diff/4)))
-            elif ticket_frequency == 'high' and plan['name'] in ['base', 'advanced']:
-                num_tickets = random.randint(2, max(2, int(months_diff/2)))
-            elif ticket_frequency == "low" and plan['name'] == "free":
-                num_tickets = 0
-            elif ticket_frequency == "medium" and plan['name'] == "free":
-                num_tickets = random.randint(0, 1)
-            elif ticket_frequency == "high" and plan['name'] == "free":
-                num_tickets = random.randint(0, 2)
-            else:
-                num_tickets = random.randint(0, 2)               
-            support_tickets = support_ticket_generator.generate_and_insert_support_tickets(cp_connection_params, st_connection_params, 
-                                                                                           project_id=project['id'], 
-                                                                                           num_tickets=num_tickets
-                                                                                           )
-            print(support_tickets)
+    pipeline.run_pipeline(
+        cp_connection_params,
+        st_connection_params,
+        num_users=args.users,
+        shard_size=args.shard_size,
+        workers=args.workers,
+        seed=args.seed,
+        as_of=args.as_of,
+        tickets=not args.no_tickets,
+        offline_tickets=args.offline_tickets,
+        ticket_cache_dir=args.ticket_cache_dir,
+        ticket_concurrency=args.concurrency,
+    )
 
 if __name__ == "__main__":
     main()
-
- 
-
@@ -1,18 +1,36 @@
-from datetime import datetime, timedelta, date
-import uuid
+from datetime import datetime, timedelta, date, time
 import random
 from typing import List, Dict, Optional, Tuple
 import psycopg2
 from psycopg2.extras import execute_values
 from decimal import Decimal
 
+from bulk_load import copy_rows
+from user_generator import new_id
+
+INVOICE_COLUMNS = [
+    'stripe_invoice_id', 'customer_id', 'subscription_id', 'month', 'year',
+    'description', 'status', 'invoice_url', 'attempt_count',
+    'created_at', 'updated_at'
+]
+
+INVOICE_ITEM_COLUMNS = [
+    'id', 'invoice_id', 'amount', 'description', 'project_id', 'type',
+    'month', 'year', 'has_updated_to_stripe', 'error',
+    'created_at', 'updated_at'
+]
+
+# Plan changes of a project as (created_at, plan_name), oldest first
+PlanHistory = List[Tuple[datetime, str]]
+
 class ProjectInvoiceGenerator:
-    def __init__(self, connection_params: Dict):
-        self.conn = psycopg2.connect(**connection_params)
-        self.cursor = self.conn.cursor()
+    def __init__(self, connection_params: Optional[Dict] = None):
+        # Without a connection only the build_* methods can be used
+        self.conn = psycopg2.connect(**connection_params) if connection_params else None
+        self.cursor = self.conn.cursor() if self.conn else None
     
-    def get_project_info(self, project_id: str) -> Dict:
-        """Get project and customer information"""
+    def get_projects_info(self, project_ids: List[str]) -> Dict[str, Dict]:
+        """Get project and customer information of many projects in one query"""
         self.cursor.execute("""
             SELECT 
                 p.id,
@@ -22,50 +40,63 @@ class ProjectInvoiceGenerator:
                 u.customer_id
             FROM Projects p
             JOIN Users u ON p.owner_id = u.id
-            WHERE p.id = %s
-        """, (project_id,))
+            WHERE p.id = ANY(%s::uuid[])
+        """, (list(project_ids),))
         
-        row = self.cursor.fetchone()
-        if not row:
-            raise ValueError(f"Project {project_id} not found")
-            
-        return {
-            'id': str(row[0]),
-            'active_models': row[1],
-            'created_at': row[2],
-            'deleted_at': row[3],
-            'customer_id': row[4]
-        }
-    
-    def get_project_plan(self, project_id: str, month: int, year: int) -> Optional[Dict]:
-        """Get the active plan for a project in a given month"""
-        month_start = date(year, month, 1)
-        month_end = date(year, month + 1, 1) if month < 12 else date(year + 1, 1, 1)
+        projects = {}
+        for row in self.cursor.fetchall():
+            projects[str(row[0])] = {
+                'id': str(row[0]),
+                'active_models': row[1],
+                'created_at': row[2],
+                'deleted_at': row[3],
+                'customer_id': row[4]
+            }
         
+        missing = set(project_ids) - projects.keys()
+        if missing:
+            raise ValueError(f"Project {sorted(missing)[0]} not found")
+        return projects
+    
+    def get_project_info(self, project_id: str) -> Dict:
+        """Get project and customer information"""
+        return self.get_projects_info([project_id])[project_id]
+    
+    def get_plan_histories(self, project_ids: List[str]) -> Dict[str, PlanHistory]:
+        """Get the plan changes of many projects in one query"""
         self.cursor.execute("""
-            WITH ordered_changes AS (
-                SELECT 
-                    pc.created_at,
-                    pl.name as plan_name,
-                    LEAD(pc.created_at) OVER (ORDER BY pc.created_at) as next_change_date
-                FROM Project_Plan_Changelogs pc
-                JOIN Plans pl ON pl.id = pc.plan_id
-                WHERE pc.project_id = %s
-                AND pc.created_at <= %s
-                ORDER BY pc.created_at DESC
-                LIMIT 1
-            )
-            SELECT * FROM ordered_changes
-        """, (project_id, month_end))
+            SELECT pc.project_id, pc.created_at, pl.name as plan_name
+            FROM Project_Plan_Changelogs pc
+            JOIN Plans pl ON pl.id = pc.plan_id
+            WHERE pc.project_id = ANY(%s::uuid[])
+            ORDER BY pc.project_id, pc.created_at
+        """, (list(project_ids),))
         
-        row = self.cursor.fetchone()
-        if not row:
+        histories: Dict[str, PlanHistory] = {project_id: [] for project_id in project_ids}
+        for project_id, created_at, plan_name in self.cursor.fetchall():
+            histories[str(project_id)].append((created_at, plan_name))
+        return histories
+    
+    def get_project_plan(self, project_id: str, month: int, year: int,
+                         plan_history: Optional[PlanHistory] = None) -> Optional[Dict]:
+        """Get the active plan for a project in a given month"""
+        if plan_history is None:
+            plan_history = self.get_plan_histories([project_id])[project_id]
+        
+        # The latest change made before the end of the month
+        month_end = date(year, month + 1, 1) if month < 12 else date(year + 1, 1, 1)
+        active = None
+        for created_at, plan_name in plan_history:
+            if created_at > datetime.combine(month_end, time(), tzinfo=created_at.tzinfo):
+                break
+            active = (created_at, plan_name)
+        if not active:
             return None
             
         return {
-            'start_date': row[0].date(),
-            'plan_name': row[1],
-            'end_date': row[2].date() if row[2] else None
+            'start_date': active[0].date(),
+            'plan_name': active[1],
+            'end_date': None
         }
     
     def calculate_amount(self, active_models: int, plan_name: str, price_per_model: int) -> Decimal:
@@ -79,150 +110,166 @@ class ProjectInvoiceGenerator:
     
     def generate_invoice_id(self, customer_id: str, month: int, year: int) -> str:
         """Generate a unique invoice ID"""
-        unique_id = str(uuid.uuid4())
+        unique_id = new_id()
         return f"inv_{unique_id}_{month}_{year}"
     
+    def build_project_invoice(self, project: Dict, plan_history: PlanHistory,
+                              month: int, year: int, price_per_model) -> Optional[Tuple[Dict, Dict]]:
+        """Build the invoice and invoice item of a project in a given month, without querying"""
+        # Check if project was active in this month
+        month_start = date(year, month, 1)
+        if (project['created_at'].date() > month_start or 
+            (project['deleted_at'] and project['deleted_at'].date() < month_start)):
+            return None
+        
+        # Get active plan for the month
+        plan = self.get_project_plan(project['id'], month, year, plan_history)
+        if not plan or plan['plan_name'] == 'free':
+            return None
+        
+        # Generate invoice timestamp
+        invoice_date = datetime(year, month, 26, 9, 0, 41, 625067)
+        
+        # Calculate amount
+        amount = self.calculate_amount(project['active_models'], plan['plan_name'], price_per_model)
+        if amount == 0:
+            return None
+        
+        # Create invoice
+        invoice_id = self.generate_invoice_id(project['customer_id'], month, year)
+        invoice = {
+            'stripe_invoice_id': invoice_id,
+            'customer_id': project['customer_id'],
+            'subscription_id': None,
+            'month': month,
+            'year': year,
+            'description': '',
+            'status': 'paid',
+            'invoice_url': None,
+            'attempt_count': None,
+            'created_at': invoice_date,
+            'updated_at': invoice_date
+        }
+        
+        # Create invoice item
+        invoice_item = {
+            'id': new_id(),
+            'invoice_id': invoice_id,
+            'amount': amount,
+            'description': '',
+            'project_id': project['id'],
+            'type': 'active-model-count',
+            'month': month,
+            'year': year,
+            'has_updated_to_stripe': True,
+            'error': None,
+            'created_at': invoice_date,
+            'updated_at': invoice_date
+        }
+        
+        return invoice, invoice_item
+    
     def generate_project_invoice(self, project_id: str, month: int, year: int, price_per_model) -> Optional[Tuple[Dict, Dict]]:
         """Generate invoice and invoice item for a project in a given month"""
-        try:
-            # Get project info
-            project = self.get_project_info(project_id)
-            
-            # Check if project was active in this month
-            month_start = date(year, month, 1)
-            if (project['created_at'].date() > month_start or 
-                (project['deleted_at'] and project['deleted_at'].date() < month_start)):
-                return None
-            
-            # Get active plan for the month
-            plan = self.get_project_plan(project_id, month, year)
-            if not plan or plan['plan_name'] == 'free':
-                return None
-            
-            # Generate invoice timestamp
-            invoice_date = datetime(year, month, 26, 9, 0, 41, 625067)
-            
-            # Calculate amount
-            amount = self.calculate_amount(project['active_models'], plan['plan_name'], price_per_model)
-            if amount == 0:
-                return None
-            
-            # Create invoice
-            invoice_id = self.generate_invoice_id(project['customer_id'], month, year)
-            invoice = {
-                'stripe_invoice_id': invoice_id,
-                'customer_id': project['customer_id'],
-                'subscription_id': None,
-                'month': month,
-                'year': year,
-                'description': '',
-                'status': 'paid',
-                'invoice_url': None,
-                'attempt_count': None,
-                'created_at': invoice_date,
-                'updated_at': invoice_date
-            }
-            
-            # Create invoice item
-            invoice_item = {
-                'id': str(uuid.uuid4()),
-                'invoice_id': invoice_id,
-                'amount': amount,
-                'description': '',
-                'project_id': project_id,
-                'type': 'active-model-count',
-                'month': month,
-                'year': year,
-                'has_updated_to_stripe': True,
-                'error': None,
-                'created_at': invoice_date,
-                'updated_at': invoice_date
-            }
+        project = self.get_project_info(project_id)
+        plan_history = self.get_plan_histories([project_id])[project_id]
+        return self.build_project_invoice(project, plan_history, month, year, price_per_model)
+    
+    def build_all_invoices(self, project: Dict, plan_history: PlanHistory,
+                           price_per_model_advanced: int, as_of: Optional[date] = None) -> List[Tuple[Dict, Dict]]:
+        """Build the invoices of a project from its creation to the current date (or as_of)"""
+        # Get date ranges
+        start_date = project['created_at'].date()
+        end_date = project['deleted_at'].date() if project['deleted_at'] else (as_of or date.today())
+        
+        invoices = []
+        current_date = start_date
+        
+        # Generate invoices for each month
+        while current_date <= end_date:
+            month = current_date.month
+            year = current_date.year
             
-            return invoice, invoice_item
+            result = self.build_project_invoice(project, plan_history, month, year, price_per_model_advanced)
+            if result:
+                invoices.append(result)
             
-        except Exception as e:
-            self.conn.rollback()
-            raise e
+            # Move to next month
+            if month == 12:
+                current_date = date(year + 1, 1, 1)
+            else:
+                current_date = date(year, month + 1, 1)
+        
+        return invoices
     
-    def generate_all_invoices(self, project_id: str, price_per_model_advanced: int) -> List[Dict]:
-        """Generate all invoices from project creation to current date"""
+    def insert_invoices(self, invoices: List[Tuple[Dict, Dict]]):
+        """
+        Write invoices and their items with COPY into staging tables and one
+        upsert per table (same conflict handling as inserting them one by one)
+        """
+        self.cursor.execute("""
+            CREATE TEMP TABLE invoice_staging (LIKE Invoice) ON COMMIT DROP;
+            CREATE TEMP TABLE invoice_item_staging (LIKE Invoice_item) ON COMMIT DROP;
+        """)
+        copy_rows(self.cursor, 'invoice_staging', INVOICE_COLUMNS,
+                  [[invoice[column] for column in INVOICE_COLUMNS] for invoice, _ in invoices])
+        copy_rows(self.cursor, 'invoice_item_staging', INVOICE_ITEM_COLUMNS,
+                  [[item[column] for column in INVOICE_ITEM_COLUMNS] for _, item in invoices])
+        
+        self.cursor.execute(f"""
+            INSERT INTO Invoice ({', '.join(INVOICE_COLUMNS)})
+            SELECT {', '.join(INVOICE_COLUMNS)} FROM invoice_staging
+            ON CONFLICT (stripe_invoice_id) 
+            DO UPDATE SET
+                status = EXCLUDED.status,
+                updated_at = EXCLUDED.updated_at
+        """)
+        self.cursor.execute(f"""
+            INSERT INTO Invoice_item ({', '.join(INVOICE_ITEM_COLUMNS)})
+            SELECT {', '.join(INVOICE_ITEM_COLUMNS)} FROM invoice_item_staging
+            ON CONFLICT (id) 
+            DO UPDATE SET
+                amount = EXCLUDED.amount,
+                updated_at = EXCLUDED.updated_at
+        """)
+    
+    def generate_invoices_for_projects(self, prices_per_model_advanced: Dict[str, int]) -> Dict[str, List[Dict]]:
+        """
+        Generate all invoices of many projects, from their creation to the current date.
+        
+        Projects and their plan history are loaded in one query each, invoices are
+        built in memory and written in bulk, all in one transaction.
+        
+        Args:
+            prices_per_model_advanced: Advanced plan price per model of each project id
+        
+        Returns:
+            The generated invoices of each project id
+        """
         try:
-            # Get project info
-            project = self.get_project_info(project_id)
+            project_ids = list(prices_per_model_advanced)
+            projects = self.get_projects_info(project_ids)
+            plan_histories = self.get_plan_histories(project_ids)
             
-            # Get date ranges
-            start_date = project['created_at'].date()
-            end_date = project['deleted_at'].date() if project['deleted_at'] else date.today()
-            
-            results = []
-            current_date = start_date
-            
-            print('current_date: ', current_date)
-            print('end_date: ', end_date)
-            
-            # Generate invoices for each month
-            while current_date <= end_date:
-                month = current_date.month
-                year = current_date.year
-                
-                result = self.generate_project_invoice(project_id, month, year, price_per_model_advanced)
-                if result:
-                    invoice, invoice_item = result
-                    
-                    # Insert invoice
-                    self.cursor.execute("""
-                        INSERT INTO Invoice (
-                            stripe_invoice_id, customer_id, subscription_id, month, year,
-                            description, status, invoice_url, attempt_count,
-                            created_at, updated_at
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        ON CONFLICT (stripe_invoice_id) 
-                        DO UPDATE SET
-                            status = EXCLUDED.status,
-                            updated_at = EXCLUDED.updated_at
-                        RETURNING stripe_invoice_id
-                    """, (
-                        invoice['stripe_invoice_id'], invoice['customer_id'],
-                        invoice['subscription_id'], invoice['month'], invoice['year'],
-                        invoice['description'], invoice['status'], invoice['invoice_url'],
-                        invoice['attempt_count'], invoice['created_at'], invoice['updated_at']
-                    ))
-                    
-                    # Insert invoice item
-                    self.cursor.execute("""
-                        INSERT INTO Invoice_item (
-                            id, invoice_id, amount, description, project_id, type,
-                            month, year, has_updated_to_stripe, error,
-                            created_at, updated_at
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        ON CONFLICT (id) 
-                        DO UPDATE SET
-                            amount = EXCLUDED.amount,
-                            updated_at = EXCLUDED.updated_at
-                        RETURNING id
-                    """, (
-                        invoice_item['id'], invoice_item['invoice_id'],
-                        invoice_item['amount'], invoice_item['description'],
-                        invoice_item['project_id'], invoice_item['type'],
-                        invoice_item['month'], invoice_item['year'],
-                        invoice_item['has_updated_to_stripe'], invoice_item['error'],
-                        invoice_item['created_at'], invoice_item['updated_at']
-                    ))
-                    
-                    results.append({
-                        'month': month,
-                        'year': year,
+            results = {}
+            all_invoices = []
+            for project_id in project_ids:
+                invoices = self.build_all_invoices(
+                    projects[project_id], plan_histories[project_id], prices_per_model_advanced[project_id]
+                )
+                all_invoices.extend(invoices)
+                results[project_id] = [
+                    {
+                        'month': invoice['month'],
+                        'year': invoice['year'],
                         'invoice_id': invoice['stripe_invoice_id'],
                         'amount': invoice_item['amount']
-                    })
-                
-                # Move to next month
-                if month == 12:
-                    current_date = date(year + 1, 1, 1)
-                else:
-                    current_date = date(year, month + 1, 1)
+                    }
+                    for invoice, invoice_item in invoices
+                ]
             
+            if all_invoices:
+                self.insert_invoices(all_invoices)
             self.conn.commit()
             return results
             
@@ -230,10 +277,15 @@ class ProjectInvoiceGenerator:
             self.conn.rollback()
             raise e
     
+    def generate_all_invoices(self, project_id: str, price_per_model_advanced: int) -> List[Dict]:
+        """Generate all invoices from project creation to current date"""
+        return self.generate_invoices_for_projects({project_id: price_per_model_advanced})[project_id]
+    
     def close(self):
         """Close database connection"""
-        self.cursor.close()
-        self.conn.close()
+        if self.conn:
+            self.cursor.close()
+            self.conn.close()
 
 def generate_and_insert_invoices(connection_params, project_id, price_per_model_advanced):
     try:
@@ -253,6 +305,26 @@ def generate_and_insert_invoices(connection_params, project_id, price_per_model_
     finally:
         generator.close() # type: ignore    
 
+def generate_and_insert_all_invoices(connection_params, prices_per_model_advanced: Dict[str, int]) -> Dict[str, List[Dict]]:
+    """Generate and insert the invoices of many projects in bulk"""
+    try:
+        generator = ProjectInvoiceGenerator(connection_params)
+        
+        results = generator.generate_invoices_for_projects(prices_per_model_advanced)
+        
+        total_invoices = sum(len(r) for r in results.values())
+        total_amount = sum(Decimal(str(r['amount'])) for project in results.values() for r in project)
+        print(f"Generated invoices for {len(results)} projects:")
+        print(f"Total invoices generated: {total_invoices}")
+        print(f"Total amount: ${total_amount:.2f}")
+        return results
+        
+    except Exception as e:
+        print(f"Error occurred: {e}")
+        raise
+    finally:
+        generator.close() # type: ignore
+
 def main():
     connection_params = {
         'dbname': 'control_plane_new',
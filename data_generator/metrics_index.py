@@ -0,0 +1,157 @@
+from bisect import bisect_right
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+@dataclass
+class ProjectInfo:
+    created_at: datetime
+    owner_id: str
+    owner_email: str
+
+
+@dataclass
+class PlanChange:
+    created_at: datetime
+    plan_name: str
+
+
+def _aware(value: datetime) -> datetime:
+    # Naive timestamps are compared as UTC, like a UTC database session does
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+class ProjectMetricsIndex:
+    """
+    In-memory index of the daily metrics and plan history of projects, built
+    from one scan of the tables, to find ticket dates without a query per
+    project and date.
+
+    Daily metrics are NumPy arrays sorted by (project, date), each project
+    owning the [start, end) slice recorded in `slices`.
+    """
+    def __init__(
+        self,
+        projects: Dict[str, ProjectInfo],
+        plan_changes: Dict[str, List[PlanChange]],
+        metric_rows: Sequence[Tuple[str, date, int, float, Optional[int], bool]],
+    ):
+        self.projects = projects
+        self.plan_changes = plan_changes
+
+        self.slices: Dict[str, Tuple[int, int]] = {}
+        project_ids = [row[0] for row in metric_rows]
+        start = 0
+        for i in range(1, len(project_ids) + 1):
+            if i == len(project_ids) or project_ids[i] != project_ids[start]:
+                self.slices[project_ids[start]] = (start, i)
+                start = i
+
+        self.dates = np.array([row[1] for row in metric_rows], dtype='datetime64[D]')
+        self.request_counts = np.array([row[2] for row in metric_rows], dtype=np.int64)
+        self.error_rates = np.array([row[3] for row in metric_rows], dtype=np.float64)
+        # success + error count of Error_Rate_Daily, -1 when either is NULL
+        self.error_request_counts = np.array(
+            [row[4] if row[4] is not None else -1 for row in metric_rows], dtype=np.int64
+        )
+        # Whether the date has an Error_Rate_Daily row
+        self.has_error_rate = np.array([row[5] for row in metric_rows], dtype=bool)
+
+    @classmethod
+    def load(cls, cursor, project_ids: Optional[List[str]] = None) -> 'ProjectMetricsIndex':
+        """Load the index of the given projects (default: all) from the control plane"""
+        where, params = ("WHERE p.id = ANY(%s::uuid[])", (list(project_ids),)) if project_ids is not None else ("", ())
+
+        cursor.execute(f"""
+            SELECT p.id::text, p.created_at, p.owner_id::text, u.email
+            FROM Projects p
+            JOIN Users u ON u.id = p.owner_id
+            {where}
+        """, params)
+        projects = {
+            project_id: ProjectInfo(created_at, owner_id, email)
+            for project_id, created_at, owner_id, email in cursor.fetchall()
+        }
+
+        cursor.execute(f"""
+            SELECT pc.project_id::text, pc.created_at, pl.name
+            FROM Project_Plan_Changelogs pc
+            JOIN Plans pl ON pl.id = pc.plan_id
+            JOIN Projects p ON p.id = pc.project_id
+            {where}
+            ORDER BY pc.project_id, pc.created_at
+        """, params)
+        plan_changes: Dict[str, List[PlanChange]] = {}
+        for project_id, created_at, plan_name in cursor.fetchall():
+            plan_changes.setdefault(project_id, []).append(PlanChange(created_at, plan_name))
+
+        # Either table may lack a date, like the LEFT JOINs of the per date queries
+        cursor.execute(f"""
+            SELECT
+                project_id::text,
+                date,
+                COALESCE(r.request_count, 0),
+                COALESCE(e.error_rate, 0),
+                e.success_count + e.error_count,
+                e.project_id IS NOT NULL
+            FROM Requests_Daily_Count r
+            FULL OUTER JOIN Error_Rate_Daily e USING (project_id, date)
+            {where.replace('p.id', 'project_id')}
+            ORDER BY project_id, date
+        """, params)
+        return cls(projects, plan_changes, cursor.fetchall())
+
+    def _slice(self, project_id: str) -> slice:
+        start, end = self.slices.get(project_id, (0, 0))
+        return slice(start, end)
+
+    def metrics(self, project_id: str, day: date) -> Tuple[int, float]:
+        """Request count and error rate of a project on a date, 0 when there are none"""
+        s = self._slice(project_id)
+        dates = self.dates[s]
+        i = np.searchsorted(dates, np.datetime64(day, 'D'))
+        if i < len(dates) and dates[i] == np.datetime64(day, 'D'):
+            return int(self.request_counts[s][i]), float(self.error_rates[s][i])
+        return 0, 0.0
+
+    def high_error_dates(
+        self, project_id: str, top_n: int, threshold: float = 0.1, start_date: Optional[date] = None
+    ) -> List[Tuple[date, Optional[int], float]]:
+        """
+        (date, request count, error rate) of the top_n dates with the highest error
+        rate above threshold. The request count is None when the success or error
+        count is NULL, like the sum in SQL.
+        """
+        s = self._slice(project_id)
+        dates, error_rates = self.dates[s], self.error_rates[s]
+        mask = (error_rates > threshold) & self.has_error_rate[s]
+        if start_date is not None:
+            mask &= dates >= np.datetime64(start_date, 'D')
+        candidates = np.flatnonzero(mask)
+        top = candidates[np.argsort(-error_rates[candidates], kind='stable')[:top_n]]
+        error_request_counts = self.error_request_counts[s]
+        return [
+            (
+                dates[i].astype(date),
+                int(error_request_counts[i]) if error_request_counts[i] >= 0 else None,
+                float(error_rates[i]),
+            )
+            for i in top.tolist()
+        ]
+
+    def plan_at(self, project_id: str, at: datetime, default: str = 'base') -> str:
+        """Plan of a project at a time, default when it had none yet"""
+        changes = self.plan_changes.get(project_id, [])
+        i = bisect_right([_aware(c.created_at) for c in changes], _aware(at))
+        return changes[i - 1].plan_name if i else default
+
+    def plan_transitions(self, project_id: str) -> List[Tuple[datetime, str, str]]:
+        """(date of the previous plan, old plan, new plan) of each plan change, latest first"""
+        changes = self.plan_changes.get(project_id, [])
+        return [
+            (old.created_at, old.plan_name, new.plan_name)
+            for old, new in reversed(list(zip(changes, changes[1:])))
+        ]
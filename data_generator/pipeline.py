@@ -0,0 +1,347 @@
+import time
+import random
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import psycopg2
+
+import user_generator
+import usage_generator
+import plan_change_generator
+import invoice_generator
+from bulk_load import BulkWriter
+from metrics_index import ProjectMetricsIndex
+
+# Control plane tables in foreign key order, with the columns that are loaded
+CONTROL_PLANE_TABLES = {
+    'Users': ['id', 'email', 'customer_id', 'created_at', 'updated_at', 'first_name', 'last_name'],
+    'Projects': ['id', 'name', 'owner_id', 'created_at', 'updated_at', 'deleted_at', 'active_models'],
+    'Project_Plan_Changelogs': ['id', 'plan_id', 'project_id', 'comment', 'created_at'],
+    'data_generation_seeds': ['project_id', 'initial_request_pattern_type', 'price_per_model_advanced', 'ticket_frequency'],
+    'Requests_Daily_Count': ['project_id', 'date', 'request_count'],
+    'Error_Rate_Daily': ['project_id', 'date', 'success_count', 'error_count', 'error_rate'],
+    'Invoice': invoice_generator.INVOICE_COLUMNS,
+    'Invoice_item': invoice_generator.INVOICE_ITEM_COLUMNS,
+}
+
+
+@dataclass(frozen=True)
+class Shard:
+    index: int
+    num_users: int
+    seed: int
+
+
+@dataclass(frozen=True)
+class PipelineConfig:
+    cp_connection_params: Dict
+    st_connection_params: Dict
+    start_date: datetime
+    # Usage and invoices are generated up to this date
+    as_of: datetime
+    tickets: bool = False
+    # Fill ticket texts from templates instead of calling the OpenAI API
+    offline_tickets: bool = False
+    ticket_cache_dir: Optional[str] = None
+    # Concurrent ticket text requests of each worker
+    ticket_concurrency: int = 8
+
+
+@dataclass
+class ShardResult:
+    index: int
+    users: int = 0
+    projects: int = 0
+    rows: int = 0
+    # (project_id, num_tickets) of the projects which get support tickets
+    ticket_plan: List[Tuple[str, int]] = field(default_factory=list)
+
+
+def plan_shards(num_users: int, shard_size: int, seed: int) -> List[Shard]:
+    """
+    Split the users into shards with their own seeds. A shard's seed only
+    depends on the seed and its index, so a shard generates the same data
+    whatever the number of workers.
+    """
+    num_shards = (num_users + shard_size - 1) // shard_size
+    seeds = np.random.SeedSequence(seed).spawn(num_shards)
+    return [
+        Shard(
+            index=i,
+            num_users=min(shard_size, num_users - i * shard_size),
+            seed=int(seeds[i].generate_state(1)[0]),
+        )
+        for i in range(num_shards)
+    ]
+
+
+def months_between(date1, date2):
+    return (date1.year - date2.year) * 12 + (date1.month - date2.month)
+
+
+def plan_num_tickets(ticket_frequency: str, plan_name: str, months_diff: int) -> int:
+    """Number of support tickets of a project, as generator.py always chose it"""
+    if ticket_frequency == "low" and plan_name in ['base', 'advanced']:
+        return random.randint(0, int(months_diff/8))
+    elif ticket_frequency == 'medium' and plan_name in ['base', 'advanced']:
+        return random.randint(1, max(1, int(months_diff/4)))
+    elif ticket_frequency == 'high' and plan_name in ['base', 'advanced']:
+        return random.randint(2, max(2, int(months_diff/2)))
+    elif ticket_frequency == "low" and plan_name == "free":
+        return 0
+    elif ticket_frequency == "medium" and plan_name == "free":
+        return random.randint(0, 1)
+    elif ticket_frequency == "high" and plan_name == "free":
+        return random.randint(0, 2)
+    else:
+        return random.randint(0, 2)
+
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    # Generated timestamps are naive UTC, the database returns them as aware ones
+    return value.replace(tzinfo=timezone.utc) if value and value.tzinfo is None else value
+
+
+# Connections of a worker process, opened once and reused by all its shards
+_connections: Dict[str, psycopg2.extensions.connection] = {}
+# Ticket text generator of a worker process, its client is reused the same way
+_text_generator = None
+
+
+def _get_connection(connection_params: Dict):
+    key = repr(sorted(connection_params.items()))
+    if key not in _connections:
+        _connections[key] = psycopg2.connect(**connection_params)
+    return _connections[key]
+
+
+def generate_shard(shard: Shard, config: PipelineConfig) -> ShardResult:
+    """Generate the users of a shard with all their control plane data, and bulk load them in one transaction"""
+    random.seed(shard.seed)
+    user_generator.fake.seed_instance(shard.seed)
+    rng = np.random.default_rng(shard.seed)
+
+    users = user_generator.UserProjectGenerator(config.start_date, config.as_of)
+    plan_changes = plan_change_generator.PlanChangelogGenerator()
+    invoices = invoice_generator.ProjectInvoiceGenerator()
+    result = ShardResult(index=shard.index)
+
+    # Per user behaviour, with the distributions of generator.py
+    plans = rng.choice(['free', 'base', 'advanced'], shard.num_users, p=[0.5, 0.3, 0.2])
+    request_pattern_types = rng.choice(
+        ['silent', 'increasing', 'intermittent', 'decreasing', 'steady'],
+        shard.num_users, p=[0.1, 0.2, 0.3, 0.2, 0.2]
+    )
+    prices_per_model_advanced = rng.uniform(30, 100, shard.num_users).astype(int)
+    ticket_frequencies = rng.choice(['low', 'medium', 'high'], shard.num_users, p=[0.4, 0.5, 0.1])
+
+    conn = _get_connection(config.cp_connection_params)
+    writer = BulkWriter(conn.cursor(), CONTROL_PLANE_TABLES)
+    try:
+        for plan, request_pattern_type, price_per_model_advanced, ticket_frequency in zip(
+            plans.tolist(), request_pattern_types.tolist(), prices_per_model_advanced.tolist(), ticket_frequencies.tolist()
+        ):
+            dataset = users.generate_complete_dataset(plan)
+            user = dataset['user']
+            writer.add('Users', [[user[c] for c in CONTROL_PLANE_TABLES['Users']]])
+            result.users += 1
+
+            for project, initial_plan in zip(dataset['projects'], dataset['plan_changes']):
+                project_id = project['id']
+
+                # Usage follows the initial plan, like generating it before the plan changes
+                daily_records, _ = usage_generator.generate_project_requests(
+                    project_id, project['created_at'], config.as_of,
+                    initial_plan['name'], request_pattern_type, seed=rng
+                )
+
+                # Plan changes, which may delete the project
+                changing_project = {
+                    'id': project_id,
+                    'created_at': _as_utc(project['created_at']),
+                    'plan_name': initial_plan['name'],
+                    'deleted_at': _as_utc(project['deleted_at']),
+                }
+                changes = plan_changes.determine_plan_changes(
+                    changing_project, request_pattern_type, as_of=_as_utc(config.as_of)
+                )
+                changelogs = [initial_plan] + plan_changes.build_changelogs(project_id, changes)
+                project['deleted_at'] = changing_project['deleted_at']
+
+                # Invoices of the whole plan history
+                plan_names = {plan_id: name for name, plan_id in plan_changes.plans.items()}
+                plan_history = sorted((_as_utc(c['created_at']), plan_names[c['plan_id']]) for c in changelogs)
+                project_invoices = invoices.build_all_invoices(
+                    {
+                        'id': project_id,
+                        'active_models': project['active_models'],
+                        'created_at': _as_utc(project['created_at']),
+                        'deleted_at': project['deleted_at'],
+                        'customer_id': user['customer_id'],
+                    },
+                    plan_history,
+                    price_per_model_advanced,
+                    as_of=config.as_of.date(),
+                )
+
+                writer.add('Projects', [[project[c] for c in CONTROL_PLANE_TABLES['Projects']]])
+                writer.add('Project_Plan_Changelogs', [
+                    [c[column] for column in CONTROL_PLANE_TABLES['Project_Plan_Changelogs']] for c in changelogs
+                ])
+                writer.add('data_generation_seeds', [
+                    [project_id, request_pattern_type, price_per_model_advanced, ticket_frequency]
+                ])
+                writer.add('Requests_Daily_Count', [
+                    [project_id, r['date'], r['request_count']] for r in daily_records
+                ])
+                writer.add('Error_Rate_Daily', [
+                    [project_id, r['date'], r['request_count'] - r['error_count'], r['error_count'], r['error_rate']]
+                    for r in daily_records
+                ])
+                writer.add('Invoice', [
+                    [invoice[c] for c in invoice_generator.INVOICE_COLUMNS] for invoice, _ in project_invoices
+                ])
+                writer.add('Invoice_item', [
+                    [item[c] for c in invoice_generator.INVOICE_ITEM_COLUMNS] for _, item in project_invoices
+                ])
+                result.projects += 1
+
+                if config.tickets:
+                    months_diff = months_between(config.as_of, project['created_at'])
+                    num_tickets = plan_num_tickets(ticket_frequency, initial_plan['name'], months_diff)
+                    if num_tickets:
+                        result.ticket_plan.append((project_id, num_tickets))
+
+        writer.flush()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    result.rows = sum(writer.row_counts.values())
+    return result
+
+
+def generate_shard_tickets(shard: Shard, ticket_plan: List[Tuple[str, int]], config: PipelineConfig) -> List[Tuple]:
+    """
+    Generate the support tickets of a shard's projects (one LLM call per ticket
+    and comment thread) without inserting them: the (requester email, tickets)
+    of each project, for support_ticket_generator.insert_tickets
+    """
+    # Imported here, only the tickets stage uses it
+    import support_ticket_generator
+    import ticket_text_generator
+
+    global _text_generator
+    if _text_generator is None:
+        _text_generator = ticket_text_generator.TicketTextGenerator(
+            ticket_text_generator.TemplateBackend() if config.offline_tickets else None,
+            cache_dir=config.ticket_cache_dir,
+            concurrency=config.ticket_concurrency,
+        )
+    # The shard's texts are the same whichever worker generates it, after
+    # whichever other shards
+    _text_generator.start_scope(f"shard {shard.seed}")
+
+    random.seed(shard.seed)
+    conn = _get_connection(config.st_connection_params)
+    cp_conn = _get_connection(config.cp_connection_params)
+    # Metrics and plans of the shard's projects, in one scan
+    metrics = ProjectMetricsIndex.load(cp_conn.cursor(), [project_id for project_id, _ in ticket_plan])
+    shard_tickets = [
+        support_ticket_generator.generate_tickets(
+            conn, cp_conn, project_id, num_tickets=project_num_tickets,
+            text_generator=_text_generator, metrics=metrics, as_of=_as_utc(config.as_of)
+        )
+        for project_id, project_num_tickets in ticket_plan
+    ]
+    # Nothing was written, end the read transactions
+    conn.rollback()
+    cp_conn.rollback()
+    return shard_tickets
+
+
+def _map(function, *iterables, workers: int):
+    """Map over a process pool, or in this process with a single worker"""
+    if workers == 1:
+        yield from map(function, *iterables)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(function, *iterables)
+
+
+def run_pipeline(
+    cp_connection_params: Dict,
+    st_connection_params: Dict,
+    num_users: int,
+    shard_size: int = 100,
+    workers: int = 1,
+    seed: int = 0,
+    start_date: datetime = datetime(2022, 1, 1),
+    as_of: Optional[date] = None,
+    tickets: bool = False,
+    offline_tickets: bool = False,
+    ticket_cache_dir: Optional[str] = None,
+    ticket_concurrency: int = 8,
+) -> List[ShardResult]:
+    """
+    Generate num_users users with their projects, usage, plan changes and
+    invoices (and optionally support tickets) on a pool of worker processes.
+
+    Users are split into shards of shard_size users, each generated from its own
+    seed and written with COPY in one transaction. The same seed, as_of date and
+    shard size generate the same dataset: ticket texts are generated by the
+    workers, but this process inserts the tickets in shard order, so their ids
+    don't depend on which worker finished first.
+    """
+    as_of = as_of or date.today()
+    config = PipelineConfig(
+        cp_connection_params=cp_connection_params,
+        st_connection_params=st_connection_params,
+        start_date=start_date,
+        as_of=datetime.combine(as_of, datetime.min.time()),
+        tickets=tickets,
+        offline_tickets=offline_tickets,
+        ticket_cache_dir=ticket_cache_dir,
+        ticket_concurrency=ticket_concurrency,
+    )
+    shards = plan_shards(num_users, shard_size, seed)
+    print(f"Generating {num_users} users in {len(shards)} shards with {workers} workers")
+
+    start = time.time()
+    results = []
+    for result in _map(generate_shard, shards, [config] * len(shards), workers=workers):
+        results.append(result)
+        users = sum(r.users for r in results)
+        rows = sum(r.rows for r in results)
+        elapsed = time.time() - start
+        print(f"Shard {result.index}: {users}/{num_users} users, {rows} rows ({rows / elapsed:.0f} rows/s)")
+
+    if tickets:
+        import support_agent_generator
+        import support_ticket_generator
+        support_agent_generator.create_support_agents(5)
+
+        ticket_shards = [(shards[r.index], r.ticket_plan) for r in results if r.ticket_plan]
+        # Not one of _connections, which forked workers would share
+        conn = psycopg2.connect(**config.st_connection_params)
+        total_tickets = 0
+        # In shard order, as the pool returns them
+        for shard_tickets in _map(
+            generate_shard_tickets,
+            [shard for shard, _ in ticket_shards],
+            [plan for _, plan in ticket_shards],
+            [config] * len(ticket_shards),
+            workers=workers,
+        ):
+            for user_email, project_tickets in shard_tickets:
+                ticket_ids, _ = support_ticket_generator.insert_tickets(conn, user_email, project_tickets)
+                total_tickets += len(ticket_ids)
+        conn.close()
+        print(f"Generated {total_tickets} support tickets")
+
+    print(f"Done in {time.time() - start:.1f}s")
+    return results
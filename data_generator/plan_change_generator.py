@@ -1,15 +1,18 @@
-import uuid
 from datetime import datetime, timedelta, timezone
 import random
 from typing import List, Dict, Optional
 import psycopg2
 from psycopg2.extras import execute_values
 
+from user_generator import PLANS, new_id
+
 class PlanChangelogGenerator:
-    def __init__(self, connection_params: Dict):
-        self.conn = psycopg2.connect(**connection_params)
-        self.cursor = self.conn.cursor()
-        self.plans = self._get_plans()
+    def __init__(self, connection_params: Optional[Dict] = None):
+        # Without a connection only determine_plan_changes/build_changelogs
+        # can be used, with the ids of the standard plans
+        self.conn = psycopg2.connect(**connection_params) if connection_params else None
+        self.cursor = self.conn.cursor() if self.conn else None
+        self.plans = self._get_plans() if self.conn else {plan['name']: plan['id'] for plan in PLANS}
         
     def _get_plans(self) -> Dict[str, str]:
         """Fetch all plans and store their IDs"""
@@ -63,15 +66,7 @@ class PlanChangelogGenerator:
             changes = self.determine_plan_changes(project, pattern_type)
             
             # Convert changes to changelog entries
-            changelogs = []
-            for change in changes:
-                changelogs.append({
-                    'id': str(uuid.uuid4()),  # Convert UUID to string
-                    'plan_id': self.plans[change['target_plan']],
-                    'project_id': str(project_id),  # Convert UUID to string
-                    'comment': change['comment'],
-                    'created_at': change['date']
-                })
+            changelogs = self.build_changelogs(project_id, changes)
             
             # Update project deleted_at if needed
             if project.get('deleted_at'):
@@ -87,8 +82,22 @@ class PlanChangelogGenerator:
             self.conn.rollback()
             raise e
 
-    def determine_plan_changes(self, project: Dict, pattern_type: str) -> List[Dict]:
-        """Determine plan changes based on pattern type and current plan"""
+    def build_changelogs(self, project_id: str, changes: List[Dict]) -> List[Dict]:
+        """Convert plan changes to changelog entries"""
+        return [
+            {
+                'id': new_id(),
+                'plan_id': self.plans[change['target_plan']],
+                'project_id': str(project_id),  # Convert UUID to string
+                'comment': change['comment'],
+                'created_at': change['date']
+            }
+            for change in changes
+        ]
+
+    def determine_plan_changes(self, project: Dict, pattern_type: str, as_of: Optional[datetime] = None) -> List[Dict]:
+        """Determine plan changes based on pattern type and current plan, up to as_of (default: now)"""
+        as_of = as_of or datetime.now(timezone.utc)
         changes = []
         project_created = project['created_at']
         current_plan = project['plan_name']
@@ -100,7 +109,7 @@ class PlanChangelogGenerator:
         if current_plan == 'free':
             if pattern_type == 'increasing':
                 # 50% chance to upgrade to base after 3 months
-                if three_months_later < datetime.now(timezone.utc):
+                if three_months_later < as_of:
                     if random.random() < 0.5:
                         changes.append({
                             'target_plan': 'base',
@@ -109,7 +118,7 @@ class PlanChangelogGenerator:
                         })
                 # 20% chance to upgrade to advanced after 1 year
                 elif random.random() < 0.2:
-                    if one_year_later < datetime.now(timezone.utc):
+                    if one_year_later < as_of:
                         
                         changes.append({
                             'target_plan': 'advanced',
@@ -120,7 +129,7 @@ class PlanChangelogGenerator:
             elif pattern_type == 'intermittent':
                 # 25% chance to upgrade to base after 3 months
                 if random.random() < 0.25:
-                    if three_months_later < datetime.now(timezone.utc):
+                    if three_months_later < as_of:
                         changes.append({
                             'target_plan': 'base',
                             'date': three_months_later,
@@ -130,7 +139,7 @@ class PlanChangelogGenerator:
             elif pattern_type == 'steady':
                 # 25% chance to upgrade to base after 1 year
                 if random.random() < 0.25:
-                    if one_year_later < datetime.now(timezone.utc):
+                    if one_year_later < as_of:
                         changes.append({
                             'target_plan': 'base',
                             'date': one_year_later,
@@ -138,7 +147,7 @@ class PlanChangelogGenerator:
                         })
                 # 10% chance to upgrade to advanced after 1 year
                 elif random.random() < 0.1:
-                    if one_year_later < datetime.now(timezone.utc):
+                    if one_year_later < as_of:
                         changes.append({
                             'target_plan': 'advanced',
                             'date': one_year_later,
@@ -148,26 +157,26 @@ class PlanChangelogGenerator:
         elif current_plan == 'base':
             if pattern_type == 'silent':
                 if random.random() < 0.5:  # 50% chance to downgrade to free
-                    if one_year_later < datetime.now(timezone.utc):
+                    if one_year_later < as_of:
                         changes.append({
                             'target_plan': 'free',
                             'date': one_year_later,
                             'comment': 'Downgrade to free plan due to inactivity'
                         })
                 elif random.random() < 0.25:  # 25% chance to delete
-                    if one_year_later < datetime.now(timezone.utc):
+                    if one_year_later < as_of:
                         project['deleted_at'] = one_year_later
                     
             elif pattern_type == 'increasing':
                 if random.random() < 0.25:  # 25% chance to upgrade after 6 months
-                    if six_months_later < datetime.now(timezone.utc):
+                    if six_months_later < as_of:
                         changes.append({
                             'target_plan': 'advanced',
                             'date': six_months_later,
                             'comment': 'Early upgrade to advanced plan due to rapid growth'
                         })
                 elif random.random() < 0.75:  # 75% chance to upgrade after a year
-                    if one_year_later < datetime.now(timezone.utc):
+                    if one_year_later < as_of:
                         changes.append({
                             'target_plan': 'advanced',
                             'date': one_year_later,
@@ -176,14 +185,14 @@ class PlanChangelogGenerator:
                     
             elif pattern_type == 'intermittent':
                 if random.random() < 0.25:  # 25% chance to upgrade
-                    if one_year_later < datetime.now(timezone.utc):
+                    if one_year_later < as_of:
                         changes.append({
                             'target_plan': 'advanced',
                             'date': one_year_later,
                             'comment': 'Upgrade to advanced plan for periodic high usage'
                         })
                 elif random.random() < 0.1:  # 10% chance to downgrade
-                    if one_year_later < datetime.now(timezone.utc):
+                    if one_year_later < as_of:
                         changes.append({
                             'target_plan': 'free',
                             'date': one_year_later,
@@ -192,7 +201,7 @@ class PlanChangelogGenerator:
                     
             elif pattern_type == 'decreasing':
                 if random.random() < 0.25:  # 25% chance to downgrade
-                    if one_year_later < datetime.now(timezone.utc):
+                    if one_year_later < as_of:
                         changes.append({
                             'target_plan': 'free',
                             'date': one_year_later,
@@ -202,14 +211,14 @@ class PlanChangelogGenerator:
         elif current_plan == 'advanced':
             if pattern_type == 'silent':
                 if random.random() < 0.5:  # 50% chance to downgrade to base
-                    if one_year_later < datetime.now(timezone.utc):
+                    if one_year_later < as_of:
                         changes.append({
                             'target_plan': 'base',
                             'date': one_year_later,
                             'comment': 'Downgrade to base plan due to reduced activity'
                         })
                 else:  # 50% chance to downgrade to free
-                    if one_year_later < datetime.now(timezone.utc):
+                    if one_year_later < as_of:
                         changes.append({
                             'target_plan': 'free',
                             'date': one_year_later,
@@ -218,7 +227,7 @@ class PlanChangelogGenerator:
                     
             elif pattern_type in ['intermittent', 'decreasing', 'steady']:
                 if random.random() < 0.25:  # 25% chance to downgrade to base
-                    if one_year_later < datetime.now(timezone.utc):
+                    if one_year_later < as_of:
                         changes.append({
                             'target_plan': 'base',
                             'date': one_year_later,
@@ -250,8 +259,9 @@ class PlanChangelogGenerator:
     
     def close(self):
         """Close database connection"""
-        self.cursor.close()
-        self.conn.close()
+        if self.conn:
+            self.cursor.close()
+            self.conn.close()
 
 def generate_and_insert_plan_changes(connection_params, project_id):
     try:
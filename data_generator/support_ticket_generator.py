@@ -1,4 +1,3 @@
-import json
 import random
 from faker import Faker
 from datetime import datetime, timedelta, timezone
@@ -7,9 +6,11 @@ from psycopg2.extras import execute_values
 from enum import Enum
 from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass
-from openai import OpenAI
 import os
 
+import ticket_text_generator
+from metrics_index import ProjectMetricsIndex
+
 @dataclass
 class MetricDate:
     date: datetime
@@ -54,33 +55,15 @@ def get_plan_tier(plan_name: str) -> int:
         return 1
 
 
-def get_significant_dates(cursor, project_id: str, top_n: int = 5, start_date: datetime | None = None) -> List[MetricDate]:
+def get_significant_dates(metrics: ProjectMetricsIndex, project_id: str, top_n: int = 5, start_date: datetime | None = None) -> List[MetricDate]:
     """Find dates with significant metrics (high error rates or request counts)"""
 
     significant_dates = []
 
     # Get dates with high error rates
-    if start_date is None:
-        cursor.execute("""
-            SELECT date, success_count + error_count as request_count, error_rate
-            FROM Error_Rate_Daily
-            WHERE project_id = %s 
-            AND error_rate > 0.1  -- Significant error rate threshold
-            ORDER BY error_rate DESC
-            LIMIT %s
-        """, (project_id, top_n))
-    else:
-        cursor.execute("""
-            SELECT date, success_count + error_count as request_count, error_rate
-            FROM Error_Rate_Daily
-            WHERE project_id = %s 
-            AND error_rate > 0.1  -- Significant error rate threshold
-            AND date >= %s
-            ORDER BY error_rate DESC
-            LIMIT %s
-        """, (project_id, start_date, top_n))
-
-    for date, request_count, error_rate in cursor.fetchall():
+    for date, request_count, error_rate in metrics.high_error_dates(
+        project_id, top_n, threshold=0.1, start_date=start_date.date() if start_date else None
+    ):
         significant_dates.append(
             MetricDate(
                 date=datetime.combine(date, datetime.min.time()),
@@ -95,48 +78,13 @@ def get_significant_dates(cursor, project_id: str, top_n: int = 5, start_date: d
         significant_dates.sort(key=lambda x: x.date)
         return significant_dates
 
-    cursor.execute("""
-        WITH plan_changes AS (
-            SELECT 
-                pc1.created_at as change_date,
-                p1.name as old_plan,
-                p2.name as new_plan
-            FROM Project_Plan_Changelogs pc1
-            JOIN Project_Plan_Changelogs pc2 ON 
-                pc2.project_id = pc1.project_id AND
-                pc2.created_at > pc1.created_at
-            JOIN Plans p1 ON p1.id = pc1.plan_id
-            JOIN Plans p2 ON p2.id = pc2.plan_id
-            WHERE pc1.project_id = %s AND
-                pc2.created_at = (
-                    SELECT MIN(pc3.created_at)
-                    FROM Project_Plan_Changelogs pc3
-                    WHERE pc3.project_id = pc1.project_id AND
-                        pc3.created_at > pc1.created_at
-                )
-        )
-        SELECT 
-            change_date,
-            old_plan,
-            new_plan,
-            COALESCE(r.request_count, 0) as request_count,
-            COALESCE(e.error_rate, 0) as error_rate
-        FROM plan_changes pc
-        LEFT JOIN Requests_Daily_Count r ON 
-            r.project_id = %s AND 
-            r.date = pc.change_date::date
-        LEFT JOIN Error_Rate_Daily e ON 
-            e.project_id = %s AND 
-            e.date = pc.change_date::date
-        ORDER BY change_date DESC
-    """, (project_id, project_id, project_id))
-
     # Process plan changes and find downgrades
-    for date, old_plan, new_plan, request_count, error_rate in cursor.fetchall():
+    for date, old_plan, new_plan in metrics.plan_transitions(project_id):
         # Check if this is a downgrade
         if get_plan_tier(new_plan) < get_plan_tier(old_plan):
             # Only add if not already added from previous queries
             if not any(d.date.date() == date.date() for d in significant_dates):
+                request_count, error_rate = metrics.metrics(project_id, date.date())
                 significant_dates.append(
                     MetricDate(
                         date=datetime.combine(
@@ -279,59 +227,28 @@ def generate_message_content(
     return f"{content}{suffix}"
 
 
-def get_project_metrics(cursor, project_id: str, date: datetime) -> Tuple[int, float]:
-    """Get request count and error rate for a given date"""
-    # Check requests
-    cursor.execute("""
-        SELECT request_count 
-        FROM Requests_Daily_Count 
-        WHERE project_id = %s AND date = %s
-    """, (project_id, date.date()))
-    request_count = cursor.fetchone()
-    request_count = request_count[0] if request_count else 0
-
-    # Check error rate
-    cursor.execute("""
-        SELECT error_rate 
-        FROM Error_Rate_Daily 
-        WHERE project_id = %s AND date = %s
-    """, (project_id, date.date()))
-    error_rate = cursor.fetchone()
-    error_rate = error_rate[0] if error_rate else 0.0
-
-    return request_count, error_rate
-
-
-def get_project_plan(cursor, project_id: str, date: datetime) -> str:
+def get_project_plan(metrics: ProjectMetricsIndex, project_id: str, date: datetime) -> str:
     """Get the plan type for a project at a given date"""
-    cursor.execute("""
-        SELECT p.name 
-        FROM Project_Plan_Changelogs pc
-        JOIN Plans p ON p.id = pc.plan_id
-        WHERE pc.project_id = %s 
-        AND pc.created_at <= %s
-        ORDER BY pc.created_at DESC 
-        LIMIT 1
-    """, (project_id, date))
-    result = cursor.fetchone()
-    return result[0] if result else "base"
+    return metrics.plan_at(project_id, date, default="base")
 
 
 def get_random_dates(
-    cursor,
+    metrics: ProjectMetricsIndex,
     project_id: str,
     project_created_at: datetime,
     remaining_dates: int,
-    start_date: datetime | None = None
+    start_date: datetime | None = None,
+    as_of: datetime | None = None
 ) -> List[MetricDate]:
     """
-    Generate random dates between project creation and now, with their metrics
+    Generate random dates between project creation and as_of (default: now), with their metrics
 
     Args:
-        cursor: Database cursor for metrics lookup
+        metrics: Metrics index of the project
         project_id: ID of the project
         project_created_at: Project creation timestamp
         num_dates: Number of random dates to generate
+        as_of: Latest date
 
     Returns:
         List of MetricDate objects with random dates and their metrics
@@ -341,7 +258,7 @@ def get_random_dates(
         return []
 
     random_dates = []
-    current_time = datetime.now(timezone.utc)
+    current_time = as_of or datetime.now(timezone.utc)
     if start_date is None:
         total_days = (current_time - project_created_at).days
     else:
@@ -360,20 +277,7 @@ def get_random_dates(
     # Convert random dates to MetricDate objects
     for date in sorted(selected_dates):
         # Get metrics for this date if they exist
-        cursor.execute("""
-            SELECT 
-                COALESCE(r.request_count, 0) as request_count,
-                COALESCE(e.error_rate, 0) as error_rate
-            FROM (SELECT %s::date as date) d
-            LEFT JOIN Requests_Daily_Count r ON 
-                r.project_id = %s AND 
-                r.date = d.date
-            LEFT JOIN Error_Rate_Daily e ON 
-                e.project_id = %s AND 
-                e.date = d.date
-        """, (date.date(), project_id, project_id))
-
-        request_count, error_rate = cursor.fetchone()
+        request_count, error_rate = metrics.metrics(project_id, date.date())
         random_dates.append(
             MetricDate(
                 date=date,
@@ -392,82 +296,92 @@ def create_tickets(
     project_id: str,
     num_tickets: int,
     ticket_status: str | None = None,
-    start_date: datetime | None = None
+    start_date: datetime | None = None,
+    text_generator: ticket_text_generator.TicketTextGenerator | None = None,
+    metrics: ProjectMetricsIndex | None = None,
+    as_of: datetime | None = None
 ) -> tuple[List[int], List[str]]:
     """
-    Generate support tickets based on project metrics and interaction patterns
+    Generate support tickets based on project metrics and interaction patterns,
+    and insert them with their comments (see generate_tickets).
+    """
+    user_email, tickets = generate_tickets(
+        conn, cp_conn, project_id, num_tickets, ticket_status=ticket_status,
+        text_generator=text_generator, metrics=metrics, as_of=as_of
+    )
+    ticket_ids, ticket_types = insert_tickets(conn, user_email, tickets)
+    cp_conn.commit()
+    return ticket_ids, ticket_types
+
+
+def generate_tickets(
+    conn,
+    cp_conn,
+    project_id: str,
+    num_tickets: int,
+    ticket_status: str | None = None,
+    text_generator: ticket_text_generator.TicketTextGenerator | None = None,
+    metrics: ProjectMetricsIndex | None = None,
+    as_of: datetime | None = None
+) -> tuple[str, List[Tuple[Dict, str, List[Dict]]]]:
     """
+    Generate the support tickets of a project without inserting them: the
+    email of their requester and the (ticket, status, comments) of each ticket,
+    to insert with insert_tickets. The databases are only read.
+
+    Their texts are generated concurrently, the descriptions of all tickets and
+    then their comments, by text_generator (default: the configured generator).
+
+    The project, its metrics and plans are read from metrics, an index which
+    may cover many projects (default: the index of this project, loaded here).
+    Ticket dates and the current plan are as of as_of (default: now).
+    """
+    as_of = as_of or datetime.now(timezone.utc)
+    text_generator = text_generator or ticket_text_generator.default_generator()
     fake = Faker()
     cursor = conn.cursor()
     cp_cursor = cp_conn.cursor()
 
+    if metrics is None:
+        metrics = ProjectMetricsIndex.load(cp_cursor, [project_id])
+
     # Get project creation date
-    cp_cursor.execute("""
-        SELECT created_at, owner_id 
-        FROM Projects 
-        WHERE id = %s
-    """, (project_id,))
-    project_data = cp_cursor.fetchone()
+    project_data = metrics.projects.get(str(project_id))
     if not project_data:
         raise Exception("Project not found")
 
-    project_created_at, owner_id = project_data
+    project_created_at = project_data.created_at
+    user_email = project_data.owner_email
 
-    months_diff = months_between(datetime.now(), project_created_at)
+    months_diff = months_between(as_of, project_created_at)
     print('MONTHS_DIFF: ', months_diff)
     
-    project_plan = get_project_plan(cp_cursor, project_id=project_id, date=datetime.now(timezone.utc))
+    project_plan = get_project_plan(metrics, project_id=project_id, date=as_of)
 
     print('number of support tickets to generate: ', num_tickets, ', plan: ', project_plan)
 
     # Get significant dates for ticket creation
     significant_dates = get_significant_dates(
-        cp_cursor, project_id, num_tickets)
+        metrics, project_id, num_tickets)
     if not significant_dates:
         print("WARNING: No significant metric dates found for project")
 
     more_dates = get_random_dates(
-        cp_cursor, project_id, project_created_at, num_tickets - len(significant_dates))
+        metrics, project_id, project_created_at, num_tickets - len(significant_dates), as_of=as_of)
 
     ticket_dates = (significant_dates + more_dates)[0:num_tickets]
 
-    cp_cursor.execute("""
-        SELECT email 
-        FROM Users 
-        WHERE id = %s
-    """, (owner_id,))
-    user_email = cp_cursor.fetchone()[0]
-
-    # Insert or get requester ID from Support_User table
-    cursor.execute("""
-        INSERT INTO Support_User (email, role)
-        VALUES (%s, 'user')
-        ON CONFLICT (email) DO NOTHING
-        RETURNING id
-    """, (user_email,))
-    result = cursor.fetchone()
-
-    if result:
-        requester_support_id = result[0]
-    else:
-        # If no ID returned from insert (due to ON CONFLICT), get the existing ID
-        cursor.execute("""
-            SELECT id FROM Support_User 
-            WHERE email = %s AND role = 'user'
-        """, (user_email,))
-        requester_support_id = cursor.fetchone()[0]
-
     # Get agent IDs
     cursor.execute("SELECT id FROM Support_User WHERE role = 'agent'")
     agent_ids = [row[0] for row in cursor.fetchall()]
     if not agent_ids:
         raise Exception("No support agents found")
 
-    tickets = []
+    proto_tickets = []
     # Create tickets for each significant date
     for metric_date in ticket_dates:
         # Get project plan for this date
-        plan = get_project_plan(cp_cursor, project_id, metric_date.date)
+        plan = get_project_plan(metrics, project_id, metric_date.date)
 
         # Determine ticket type based on metrics
         ticket_type = determine_ticket_type(metric_date, plan)
@@ -480,8 +394,11 @@ def create_tickets(
         )
 
         created_at = metric_date.date + timedelta(hours=random.randint(1, 8))
+        proto_tickets.append((ticket_type, proto_description, created_at))
 
-        maybe_content = get_ai_generated_description(proto_description)
+    tickets = []
+    descriptions = text_generator.descriptions([proto_description for _, proto_description, _ in proto_tickets])
+    for (ticket_type, _, created_at), maybe_content in zip(proto_tickets, descriptions):
         if maybe_content:
             subject, description = maybe_content
             print(subject + ":\n")
@@ -499,31 +416,12 @@ def create_tickets(
                 "original_type": ticket_type.value,
                 # Using Support_User agent ID
                 "assignee_id": random.choice(agent_ids),
-                "requester_id": requester_support_id,     # Using Support_User customer ID
                 "created_at": created_at,
             }
             tickets.append(ticket)
 
-    # Insert tickets
-    insert_query = """
-        INSERT INTO Support_Ticket (
-            is_public, priority, status, subject, description, type,
-            assignee_id, requester_id, created_at
-        ) VALUES (
-            %(is_public)s, %(priority)s, %(status)s, %(subject)s, 
-            %(description)s, %(type)s, %(assignee_id)s, %(requester_id)s, 
-            %(created_at)s
-        ) RETURNING id
-    """
-
-    ticket_ids = []
-    ticket_types = []
+    comments_requests = []
     for ticket in tickets:
-        cursor.execute(insert_query, ticket)
-        ticket_id = cursor.fetchone()[0]
-        ticket_ids.append(ticket_id)
-        ticket_types.append(ticket['original_type'])
-        
         response_pattern = random.choices(
             ['smooth', 'average', 'struggling'], weights=[0.25, 0.5, 0.25])[0]
         if ticket['priority'] == 'high':
@@ -544,8 +442,65 @@ def create_tickets(
                 ['open', 'pending', 'closed'], weights=[0.3, 0.3, 0.4])[0] if ticket_status is None else ticket_status
 
         print('EXPECTED STATUS: ', status)
-        status, ticket_comments = get_ai_generated_ticket_comments(
-            ticket['description'], ticket['created_at'], status, num_comments, response_pattern)
+        comments_requests.append(ticket_text_generator.CommentsRequest(
+            description=ticket['description'],
+            created_at=ticket['created_at'],
+            status=status,
+            num_comments=num_comments,
+            response_pattern=response_pattern,
+        ))
+    generated_comments = text_generator.comments(comments_requests)
+    return user_email, [
+        (ticket, status, ticket_comments)
+        for ticket, (status, ticket_comments) in zip(tickets, generated_comments)
+    ]
+
+
+def insert_tickets(conn, user_email: str, tickets: List[Tuple[Dict, str, List[Dict]]]) -> tuple[List[int], List[str]]:
+    """Insert tickets of generate_tickets requested by user_email, with their comments, in one transaction"""
+    cursor = conn.cursor()
+
+    # Insert or get requester ID from Support_User table
+    cursor.execute("""
+        INSERT INTO Support_User (email, role)
+        VALUES (%s, 'user')
+        ON CONFLICT (email) DO NOTHING
+        RETURNING id
+    """, (user_email,))
+    result = cursor.fetchone()
+
+    if result:
+        requester_support_id = result[0]
+    else:
+        # If no ID returned from insert (due to ON CONFLICT), get the existing ID
+        cursor.execute("""
+            SELECT id FROM Support_User 
+            WHERE email = %s AND role = 'user'
+        """, (user_email,))
+        requester_support_id = cursor.fetchone()[0]
+
+    # Insert tickets
+    insert_query = """
+        INSERT INTO Support_Ticket (
+            is_public, priority, status, subject, description, type,
+            assignee_id, requester_id, created_at
+        ) VALUES (
+            %(is_public)s, %(priority)s, %(status)s, %(subject)s, 
+            %(description)s, %(type)s, %(assignee_id)s, %(requester_id)s, 
+            %(created_at)s
+        ) RETURNING id
+    """
+
+    ticket_ids = []
+    ticket_types = []
+    for ticket, status, ticket_comments in tickets:
+        # Using Support_User customer ID
+        ticket = {**ticket, "requester_id": requester_support_id}
+        cursor.execute(insert_query, ticket)
+        ticket_id = cursor.fetchone()[0]
+        ticket_ids.append(ticket_id)
+        ticket_types.append(ticket['original_type'])
+
         print('status: ', status)
         print(ticket_comments)
 
@@ -567,133 +522,17 @@ def create_tickets(
                        """, (status, ticket_id))
 
     conn.commit()
-    cp_conn.commit()
     return ticket_ids, ticket_types
 
 
 def get_ai_generated_description(proto_description)  -> Tuple[str, str] | None:
-
-    with open('sample_support_conversations.txt', 'r') as file:
-        sample_tickets = file.read()
-
-    system_prompt = f"""
-
-Sample tickets with subject, description and comments for reference:
-
-{sample_tickets}
-
-You are supposed to generate fake support tickets for an API SaaS company. You will be given some initial context. You need to create a realistic subject and description for this ticket as coming from a genuine user.
-
-Be straightforward in your description.
-
-IMPORTANT GUIDELINES:
-1. If dealing with bug, feature requests or how-to tickets, add names of database(s) that the customer might be using in the description, popular ones being Postgres, Snowflake, MySQL, MongoDB and SQL Server. Less popular ones being BigQuery, Oracle
-2. For bug or production issues, add a software version somewhere in the description like this "Version: v2.41.0". Versions are in the form "v2.x.x" where the max version is "v2.50.10"
-
-Generate a json like `{{"subject": string, "description": string}}` . Always return a valid JSON object, without any additional text or formatting.
-
-
-"""
-
-    try:
-
-        OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-        if not OPENAI_API_KEY:
-            print("Error: OPENAI_API_KEY not found in environment variables")
-            print("Please create a .env file with your OpenAI API key like this:")
-            print("OPENAI_API_KEY=your-api-key-here")
-            exit(1)
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        completion = client.chat.completions.create(
-            model="o1-preview",
-            messages=[
-                # {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"""
-                 
-{system_prompt}
-
-
-Generate subject and description based on:
-Context: {proto_description}
-"""
-                }
-            ],
-        )
-
-        chat_message = json.loads(
-            completion.choices[0].message.content)  # type: ignore
-        print(chat_message)
-        return (chat_message['subject'], chat_message['description'])
-    except Exception as e:
-        # Handle errors from OpenAI's API
-        print(f"An error occurred: {e}")
-        return None
+    return ticket_text_generator.default_generator().descriptions([proto_description])[0]
 
 
 def get_ai_generated_ticket_comments(description: str, created_at: datetime, status: str, num_comments: int, response_pattern: str) -> Tuple[str, List[Dict]]:
-
-    with open('sample_support_conversations.txt', 'r') as file:
-        sample_tickets = file.read()
-
-    system_prompt = f"""
-You are supposed to generate fake support tickets comments for an API SaaS company.
-
-You will be provided with `num_comments` to denote the expected length of the conversation.
-
-You will also be given `created_at` so the comments should be after this time (each comment could range from few hours to few days after the previous comment)
-
-You will also be given a `status` which can be one of `open`, `pending` or `closed`. It is very IMPORTANT to generate the comments based on the status.
-`open` status means that the last comment would mean that the support agent needs to follow up.
-`pending` status means that the user has to furnish more information or confirm some data. This usually means that the last comment is from an agent asking for more information
-`closed` status means that the ticket has been successfully resolved. This usually means that the last comment is from the user and has acknowledged the successful resolution.
-
-Note that you may be given a field called agent_response_pattern which would be one of smooth, average or struggling. You should use this to generate the general quality of response from an agent
-
-Generate a json which has the status and an array of comments following the shape: `{{ "status": <open or pending or closed>, "comments": [{{"body": string, "created_at": timestamptz, "role" : <user or agent>}}] }}` .
-Always return a valid JSON object, without any additional text or formatting.
-
-Sample tickets with subject, description and comments for reference:
-
-{sample_tickets}
-"""
-
-    try:
-
-        OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-        if not OPENAI_API_KEY:
-            print("Error: OPENAI_API_KEY not found in environment variables")
-            print("Please create a .env file with your OpenAI API key like this:")
-            print("OPENAI_API_KEY=your-api-key-here")
-            exit(1)
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"""
-Generate comments with the following properties
-- created_at: {created_at}
-- status: {status}
-- num_comments: {num_comments}
-- agent_response_pattern: {response_pattern}
-- description: {description}
-"""
-                }
-            ],
-            temperature=0.7,
-            max_tokens=10000
-        )
-
-        chat_message = json.loads(
-            completion.choices[0].message.content)  # type: ignore
-        print("expected num_comments: ", num_comments)
-        print("status: ", chat_message['status'])
-        print(chat_message['comments'])
-        return chat_message['status'], chat_message['comments']
-    except Exception as e:
-        # Handle errors from OpenAI's API
-        print(f"An error occurred: {e}")
-        return 'open', []
+    return ticket_text_generator.default_generator().comments([
+        ticket_text_generator.CommentsRequest(description, created_at, status, num_comments, response_pattern)
+    ])[0]
 
 
 def generate_and_insert_support_tickets(cp_connection_params, st_connection_params, project_id, num_tickets):
@@ -725,8 +564,15 @@ if __name__ == "__main__":
                        help='UUID of the project')
     parser.add_argument('--num-tickets', type=int, required=True,
                        help='Number of tickets to create')
+    parser.add_argument('--offline', action='store_true',
+                       help='Fill ticket texts from templates instead of calling the OpenAI API')
+    parser.add_argument('--cache-dir', type=str, default=None,
+                       help='Cache the generated ticket texts in this directory')
+    parser.add_argument('--concurrency', type=int, default=8,
+                       help='Maximum number of concurrent text generation requests')
 
     args = parser.parse_args()
+    ticket_text_generator.configure(offline=args.offline, cache_dir=args.cache_dir, concurrency=args.concurrency)
 
     # Database connection parameters
     conn = psycopg2.connect(
@@ -11,6 +11,7 @@ from openai import OpenAI
 import os
 
 from support_ticket_generator import create_tickets
+from metrics_index import ProjectMetricsIndex
 
 def update_tickets(num_tickets: Optional[int] = None, num_open_tickets: Optional[int] = None):
     if num_tickets is not None and num_open_tickets is not None:
@@ -56,6 +57,9 @@ def update_tickets(num_tickets: Optional[int] = None, num_open_tickets: Optional
         total_tickets = num_tickets if num_tickets is not None else num_open_tickets
         is_open_only = num_open_tickets is not None
 
+        # Metrics and plans of all projects, loaded once for all the tickets
+        metrics = ProjectMetricsIndex.load(cursor)
+
         # Create specified number of tickets
         for _ in range(total_tickets): # type: ignore
             # Randomly select a project
@@ -70,7 +74,8 @@ def update_tickets(num_tickets: Optional[int] = None, num_open_tickets: Optional
                         cp_conn,
                         project_id=project_id,
                         num_tickets=1,
-                        ticket_status='open'
+                        ticket_status='open',
+                        metrics=metrics
                     )  # Get the single ticket ID created
                     ticket_id = ticket_tuple[0][0]
                     ticket_type = ticket_tuple[1][0]
@@ -79,7 +84,8 @@ def update_tickets(num_tickets: Optional[int] = None, num_open_tickets: Optional
                         conn,
                         cp_conn,
                         project_id=project_id,
-                        num_tickets=1
+                        num_tickets=1,
+                        metrics=metrics
                     )  # Get the single ticket ID created
                     ticket_id = ticket_tuple[0][0]
                     ticket_type = ticket_tuple[1][0]
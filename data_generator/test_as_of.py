@@ -0,0 +1,54 @@
+"""The same seed and as_of date generate the same data, whatever the day they run on"""
+import random
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import plan_change_generator
+import support_ticket_generator
+from metrics_index import ProjectInfo, ProjectMetricsIndex
+
+AS_OF = datetime(2024, 6, 1, tzinfo=timezone.utc)
+PATTERNS = ['increasing', 'intermittent', 'steady', 'silent', 'decreasing']
+
+
+def frozen_datetime(today: datetime):
+    """datetime, with now() returning today"""
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return today.astimezone(tz) if tz else today.replace(tzinfo=None)
+    return FrozenDatetime
+
+
+def generate(today: datetime, seed: int = 0):
+    """Plan changes, deletions and random ticket dates of projects created over two years"""
+    with mock.patch.object(plan_change_generator, 'datetime', frozen_datetime(today)), \
+            mock.patch.object(support_ticket_generator, 'datetime', frozen_datetime(today)):
+        random.seed(seed)
+        plan_changes = plan_change_generator.PlanChangelogGenerator()
+        results = []
+        for i in range(300):
+            project_id = f'project-{i}'
+            created_at = datetime(2022, 6, 1, tzinfo=timezone.utc) + timedelta(days=2 * i)
+            project = {
+                'id': project_id,
+                'created_at': created_at,
+                'plan_name': ['free', 'base', 'advanced'][i % 3],
+                'deleted_at': None,
+            }
+            changes = plan_changes.determine_plan_changes(project, PATTERNS[i % len(PATTERNS)], as_of=AS_OF)
+            metrics = ProjectMetricsIndex({project_id: ProjectInfo(created_at, 'owner', 'owner@example.com')}, {}, [])
+            dates = support_ticket_generator.get_random_dates(metrics, project_id, created_at, 3, as_of=AS_OF)
+            results.append((changes, project['deleted_at'], [d.date for d in dates]))
+        return results
+
+
+def test_same_data_on_different_days():
+    assert generate(datetime(2024, 6, 2, tzinfo=timezone.utc)) == generate(datetime(2026, 10, 18, tzinfo=timezone.utc))
+
+
+def test_nothing_after_as_of():
+    for changes, deleted_at, dates in generate(datetime(2026, 10, 18, tzinfo=timezone.utc)):
+        assert all(change['date'] < AS_OF for change in changes)
+        assert deleted_at is None or deleted_at < AS_OF
+        assert all(date <= AS_OF for date in dates)
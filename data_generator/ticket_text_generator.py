@@ -0,0 +1,328 @@
+import os
+import json
+import random
+import asyncio
+import hashlib
+import tempfile
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+DESCRIPTION_MODEL = "o1-preview"
+COMMENTS_MODEL = "gpt-4o-mini"
+
+# (subject, description) of a ticket, None when it could not be generated
+Description = Optional[Tuple[str, str]]
+# (status, comments) of a ticket
+Comments = Tuple[str, List[Dict]]
+
+
+@dataclass(frozen=True)
+class CommentsRequest:
+    description: str
+    created_at: datetime
+    status: str
+    num_comments: int
+    response_pattern: str
+
+
+@lru_cache(maxsize=None)
+def sample_tickets() -> str:
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample_support_conversations.txt')) as file:
+        return file.read()
+
+
+def description_prompt(proto_description: str) -> str:
+    system_prompt = f"""
+
+Sample tickets with subject, description and comments for reference:
+
+{sample_tickets()}
+
+You are supposed to generate fake support tickets for an API SaaS company. You will be given some initial context. You need to create a realistic subject and description for this ticket as coming from a genuine user.
+
+Be straightforward in your description.
+
+IMPORTANT GUIDELINES:
+1. If dealing with bug, feature requests or how-to tickets, add names of database(s) that the customer might be using in the description, popular ones being Postgres, Snowflake, MySQL, MongoDB and SQL Server. Less popular ones being BigQuery, Oracle
+2. For bug or production issues, add a software version somewhere in the description like this "Version: v2.41.0". Versions are in the form "v2.x.x" where the max version is "v2.50.10"
+
+Generate a json like `{{"subject": string, "description": string}}` . Always return a valid JSON object, without any additional text or formatting.
+
+
+"""
+    return f"""
+
+{system_prompt}
+
+
+Generate subject and description based on:
+Context: {proto_description}
+"""
+
+
+def comments_system_prompt() -> str:
+    return f"""
+You are supposed to generate fake support tickets comments for an API SaaS company.
+
+You will be provided with `num_comments` to denote the expected length of the conversation.
+
+You will also be given `created_at` so the comments should be after this time (each comment could range from few hours to few days after the previous comment)
+
+You will also be given a `status` which can be one of `open`, `pending` or `closed`. It is very IMPORTANT to generate the comments based on the status.
+`open` status means that the last comment would mean that the support agent needs to follow up.
+`pending` status means that the user has to furnish more information or confirm some data. This usually means that the last comment is from an agent asking for more information
+`closed` status means that the ticket has been successfully resolved. This usually means that the last comment is from the user and has acknowledged the successful resolution.
+
+Note that you may be given a field called agent_response_pattern which would be one of smooth, average or struggling. You should use this to generate the general quality of response from an agent
+
+Generate a json which has the status and an array of comments following the shape: `{{ "status": <open or pending or closed>, "comments": [{{"body": string, "created_at": timestamptz, "role" : <user or agent>}}] }}` .
+Always return a valid JSON object, without any additional text or formatting.
+
+Sample tickets with subject, description and comments for reference:
+
+{sample_tickets()}
+"""
+
+
+def comments_prompt(request: CommentsRequest) -> str:
+    return f"""
+Generate comments with the following properties
+- created_at: {request.created_at}
+- status: {request.status}
+- num_comments: {request.num_comments}
+- agent_response_pattern: {request.response_pattern}
+- description: {request.description}
+"""
+
+
+class OpenAIBackend:
+    """Generates ticket texts with the OpenAI API, sharing one client"""
+    name = 'openai'
+
+    def __init__(self):
+        # Imported here so the offline backend works without the SDK
+        from openai import AsyncOpenAI
+
+        OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+        if not OPENAI_API_KEY:
+            print("Error: OPENAI_API_KEY not found in environment variables")
+            print("Please create a .env file with your OpenAI API key like this:")
+            print("OPENAI_API_KEY=your-api-key-here")
+            exit(1)
+        self.client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+
+    async def description(self, proto_description: str, variant: int) -> Description:
+        completion = await self.client.chat.completions.create(
+            model=DESCRIPTION_MODEL,
+            messages=[{"role": "user", "content": description_prompt(proto_description)}],
+        )
+        chat_message = json.loads(completion.choices[0].message.content)  # type: ignore
+        return (chat_message['subject'], chat_message['description'])
+
+    async def comments(self, request: CommentsRequest, variant: int) -> Comments:
+        completion = await self.client.chat.completions.create(
+            model=COMMENTS_MODEL,
+            messages=[
+                {"role": "system", "content": comments_system_prompt()},
+                {"role": "user", "content": comments_prompt(request)},
+            ],
+            temperature=0.7,
+            max_tokens=10000
+        )
+        chat_message = json.loads(completion.choices[0].message.content)  # type: ignore
+        return chat_message['status'], chat_message['comments']
+
+
+class TemplateBackend:
+    """
+    Offline backend filling templates instead of calling a model, to generate
+    tickets without network access (eg: to test schema or pipeline changes).
+    Texts are a deterministic function of the request and variant.
+    """
+    name = 'template'
+
+    DATABASES = ['Postgres', 'Snowflake', 'MySQL', 'MongoDB', 'SQL Server', 'BigQuery', 'Oracle']
+    USER_FOLLOW_UPS = [
+        "Any update on this?",
+        "We are still seeing the issue, can you take a look?",
+        "Here are the details you asked for. The project ID is in the description.",
+        "We tried that but it did not help.",
+    ]
+    AGENT_REPLIES = [
+        "Thanks for reaching out, we are looking into this.",
+        "Could you share the exact query and the response you get?",
+        "We have identified the cause and are working on a fix.",
+        "Can you confirm which version you are running?",
+    ]
+    USER_RESOLUTIONS = [
+        "That fixed it, thanks for the help!",
+        "Confirmed, everything works now. You can close this ticket.",
+    ]
+
+    @staticmethod
+    def _random(*parts) -> random.Random:
+        return random.Random(hashlib.sha256(repr(parts).encode()).hexdigest())
+
+    async def description(self, proto_description: str, variant: int) -> Description:
+        rng = self._random('description', proto_description, variant)
+        subject = proto_description.split('. ')[0].strip().rstrip('.!?')
+        description = (
+            f"Hi team, {proto_description}\n\n"
+            f"We are using {rng.choice(self.DATABASES)}.\n"
+            f"Version: v2.{rng.randint(0, 50)}.{rng.randint(0, 10)}"
+        )
+        return subject, description
+
+    async def comments(self, request: CommentsRequest, variant: int) -> Comments:
+        rng = self._random('comments', request, variant)
+        # The last comment follows the status: the user for open (agent to follow
+        # up) and closed (user acknowledged), an agent asking for pending
+        last_role, other_role = ('agent', 'user') if request.status == 'pending' else ('user', 'agent')
+        roles = [
+            last_role if (request.num_comments - 1 - i) % 2 == 0 else other_role
+            for i in range(request.num_comments)
+        ]
+        comments = []
+        created_at = request.created_at
+        for i, role in enumerate(roles):
+            created_at = created_at + timedelta(hours=rng.randint(2, 72))
+            if role == 'agent':
+                body = rng.choice(self.AGENT_REPLIES)
+            elif request.status == 'closed' and i == len(roles) - 1:
+                body = rng.choice(self.USER_RESOLUTIONS)
+            else:
+                body = rng.choice(self.USER_FOLLOW_UPS)
+            comments.append({'body': body, 'created_at': created_at.isoformat(), 'role': role})
+        return request.status, comments
+
+
+class TicketTextGenerator:
+    """
+    Generates ticket descriptions and comments in batches, with at most
+    `concurrency` requests to the backend at a time.
+
+    With a cache_dir, texts are cached on disk as `<cache_dir>/<key[:2]>/<key>.json`,
+    keyed by the backend, the scope, the request (the proto description of a
+    description) and its variant: the n-th request with the same inputs in a
+    scope is variant n. Identical prompts keep getting different texts within
+    a run, and regenerating the tickets reuses them instead of paying for them
+    again.
+    """
+    def __init__(self, backend=None, cache_dir: Optional[str] = None, concurrency: int = 8):
+        self.backend = backend if backend is not None else OpenAIBackend()
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.concurrency = concurrency
+        self.scope = ''
+        self.variants = Counter()
+        self.hits = 0
+        self.misses = 0
+        # One loop for all batches, the backend's client is bound to it
+        self.loop = asyncio.new_event_loop()
+
+    def start_scope(self, scope: str):
+        """
+        Number variants from 0 again, in their own cache keys. A generator
+        reused for independent batches (eg: the shards of the pipeline in a
+        worker process) starts a scope per batch, so a batch's variants don't
+        depend on the batches the process generated before.
+        """
+        self.scope = scope
+        self.variants = Counter()
+
+    def _key(self, kind: str, request: str) -> Tuple[str, int]:
+        variant = self.variants[(kind, request)]
+        self.variants[(kind, request)] += 1
+        key = hashlib.sha256(
+            f"{self.backend.name}\n{self.scope}\n{kind}\n{variant}\n{request}".encode()
+        ).hexdigest()
+        return key, variant
+
+    def _read_cache(self, key: str):
+        if self.cache_dir is None:
+            return None
+        path = self.cache_dir / key[:2] / f"{key}.json"
+        if not path.exists():
+            return None
+        with open(path) as f:
+            return json.load(f)['response']
+
+    def _write_cache(self, key: str, request: str, response):
+        if self.cache_dir is None:
+            return
+        path = self.cache_dir / key[:2] / f"{key}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename so an interrupted run never leaves a partial entry
+        with tempfile.NamedTemporaryFile('w', dir=path.parent, suffix='.tmp', delete=False) as tmp:
+            json.dump({'request': request, 'response': response}, tmp)
+        os.replace(tmp.name, path)
+
+    async def _generate(self, semaphore, kind: str, request: str, create, failed):
+        key, variant = self._key(kind, request)
+        cached = self._read_cache(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+        async with semaphore:
+            try:
+                response = await create(variant)
+            except Exception as e:
+                # Handle errors from the backend, failures are not cached
+                print(f"An error occurred: {e}")
+                return failed
+        self._write_cache(key, request, response)
+        return response
+
+    async def _descriptions(self, proto_descriptions: List[str]) -> List[Description]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        responses = await asyncio.gather(*[
+            self._generate(
+                semaphore, 'description', proto_description,
+                lambda variant, proto_description=proto_description: self.backend.description(proto_description, variant),
+                None,
+            )
+            for proto_description in proto_descriptions
+        ])
+        return [tuple(response) if response is not None else None for response in responses]
+
+    async def _comments(self, requests: List[CommentsRequest]) -> List[Comments]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        responses = await asyncio.gather(*[
+            self._generate(
+                semaphore, 'comments', comments_prompt(request),
+                lambda variant, request=request: self.backend.comments(request, variant),
+                ('open', []),
+            )
+            for request in requests
+        ])
+        return [(status, comments) for status, comments in responses]
+
+    def descriptions(self, proto_descriptions: List[str]) -> List[Description]:
+        """(subject, description) of each proto description, None for the failed ones"""
+        return self.loop.run_until_complete(self._descriptions(proto_descriptions))
+
+    def comments(self, requests: List[CommentsRequest]) -> List[Comments]:
+        """(status, comments) of each ticket, ('open', []) for the failed ones"""
+        return self.loop.run_until_complete(self._comments(requests))
+
+
+_default_generator: Optional[TicketTextGenerator] = None
+
+
+def configure(offline: bool = False, cache_dir: Optional[str] = None, concurrency: int = 8):
+    """Set the generator used by create_tickets when it isn't given one"""
+    global _default_generator
+    _default_generator = TicketTextGenerator(
+        TemplateBackend() if offline else None, cache_dir=cache_dir, concurrency=concurrency
+    )
+
+
+def default_generator() -> TicketTextGenerator:
+    if _default_generator is None:
+        configure()
+    assert _default_generator is not None
+    return _default_generator
@@ -9,224 +9,179 @@ import psycopg2
 from psycopg2.extras import execute_values
 
 class RequestPatternGenerator:
-    def __init__(self, start_date: datetime, end_date: datetime):
+    """
+    Daily request and error counts of a project, each series built at once
+    with NumPy. Pass a seed (or a shared np.random.Generator) for
+    reproducible data.
+    """
+    def __init__(self, start_date: datetime, end_date: datetime,
+                 seed: int | np.random.Generator | None = None, verbose: bool = False):
         self.start_date = start_date
         self.end_date = end_date
         self.total_days = (end_date - start_date).days
+        self.rng = np.random.default_rng(seed)
+        self.verbose = verbose
+
+    def _to_counts(self, values: np.ndarray) -> List[int]:
+        """Truncate to non negative ints (python ints, which the DB driver can adapt)"""
+        return np.maximum(values.astype(np.int64), 0).tolist()
 
     def generate_silent_pattern(self, base_volume: int) -> List[int]:
         """Generate pattern for silent projects - initial activity then dies off"""
-        active_days = random.randint(14, 30)   # Active for 2-4 weeks
-        daily_requests = []
-        
-        # Initial activity period
-        for day in range(active_days):
-            # Gradual decline in initial period
-            decay_factor = 1 - (day / active_days)
-            requests = int(base_volume * decay_factor * random.uniform(0.8, 1.2))
-            daily_requests.append(max(0, requests))
+        active_days = int(self.rng.integers(14, 31))   # Active for 2-4 weeks
         
-        # Remaining days with zero or near-zero activity
-        remaining_days = self.total_days - active_days
-        daily_requests.extend([0 for _ in range(remaining_days)])
+        # Initial activity period, with a gradual decline
+        decay_factor = 1 - np.arange(active_days) / active_days
+        initial = (base_volume * decay_factor * self.rng.uniform(0.8, 1.2, active_days)).astype(np.int64)
         
-        return daily_requests
+        # Remaining days with zero activity
+        remaining_days = max(0, self.total_days - active_days)
+        return self._to_counts(np.concatenate([initial, np.zeros(remaining_days, dtype=np.int64)]))
 
     def generate_increasing_pattern(self, base_volume: int) -> List[int]:
         """Generate pattern for steadily increasing projects"""
-        daily_requests = []
-        growth_factor = random.uniform(1.0001, 1.0003)  # Subtle daily growth
-        
-        current_volume = base_volume * random.uniform(0.3, 0.5)  # Start lower
-        for _ in range(self.total_days):
-            # Add some daily noise
-            noise = random.uniform(0.8, 1.2)
-            requests = int(current_volume * noise)
-            daily_requests.append(max(0, requests))
-            
-            # Grow base volume
-            current_volume *= growth_factor
-            
-            # Add occasional growth spikes (5% chance)
-            if random.random() < 0.05:
-                current_volume *= random.uniform(1.1, 1.3)
+        days = self.total_days
+        growth_factor = self.rng.uniform(1.0001, 1.0003)  # Subtle daily growth
+        start_volume = base_volume * self.rng.uniform(0.3, 0.5)  # Start lower
+        
+        # Each day grows the volume of the following days, with occasional
+        # growth spikes (5% chance)
+        spikes = np.where(self.rng.random(days) < 0.05, self.rng.uniform(1.1, 1.3, days), 1.0)
+        daily_growth = growth_factor * spikes
+        volume = start_volume * np.concatenate([[1.0], np.cumprod(daily_growth[:-1])])
         
-        return daily_requests
+        # Add some daily noise
+        noise = self.rng.uniform(0.8, 1.2, days)
+        return self._to_counts(volume[:days] * noise)
 
     def generate_intermittent_pattern(self, base_volume: int) -> List[int]:
         """Generate pattern for intermittent projects with sporadic activity"""
-        daily_requests = []
-        
-        # Define several active periods
-        active_periods = []
-        current_day = 0
-        while current_day < self.total_days:
-            # Random active period of 3-14 days
-            period_length = random.randint(3, 14)
-            # Random gap of 10-30 days
-            gap_length = random.randint(10, 30)
-            
-            active_periods.append((current_day, current_day + period_length))
-            current_day += period_length + gap_length
+        days = self.total_days
         
-        # Generate requests
-        for day in range(self.total_days):
-            # Check if day is in active period
-            is_active = any(start <= day <= end for start, end in active_periods)
-            
-            if is_active:
-                # Higher volume during active periods
-                requests = int(base_volume * random.uniform(0.8, 1.5))
-            else:
-                # Low volume during inactive periods
-                requests = int(base_volume * random.uniform(0, 0.1))
-            
-            daily_requests.append(max(0, requests))
+        # Active periods of 3-14 days separated by gaps of 10-30 days, enough
+        # of them to cover the timeline
+        max_periods = days // 13 + 1
+        period_lengths = self.rng.integers(3, 15, max_periods)
+        gap_lengths = self.rng.integers(10, 31, max_periods)
+        starts = np.concatenate([[0], np.cumsum(period_lengths + gap_lengths)[:-1]])
+        in_range = starts < days
+        starts, ends = starts[in_range], (starts + period_lengths)[in_range]
         
-        return daily_requests
+        # Days in [start, end] of any period are active
+        boundaries = np.zeros(days + 1, dtype=np.int64)
+        np.add.at(boundaries, starts, 1)
+        np.add.at(boundaries, np.minimum(ends + 1, days), -1)
+        is_active = np.cumsum(boundaries[:days]) > 0
+        
+        # Higher volume during active periods, low volume otherwise
+        low = np.where(is_active, 0.8, 0.0)
+        high = np.where(is_active, 1.5, 0.1)
+        return self._to_counts(base_volume * self.rng.uniform(low, high))
 
     def generate_decreasing_pattern(self, base_volume: int) -> List[int]:
         """Generate pattern for projects that increase then decrease"""
-        daily_requests = []
-        
         # Define peak point (somewhere between 1/3 and 2/3 of the timeline)
-        peak_day = random.randint(self.total_days // 3, (2 * self.total_days) // 3)
+        peak_day = int(self.rng.integers(self.total_days // 3, (2 * self.total_days) // 3 + 1))
+        start_volume = base_volume * self.rng.uniform(0.3, 0.5)
         
         # Growth phase
-        current_volume = base_volume * random.uniform(0.3, 0.5)
         growth_factor = np.exp(np.log(3) / peak_day)  # Triple volume by peak
-        
-        for day in range(peak_day):
-            noise = random.uniform(0.8, 1.2)
-            requests = int(current_volume * noise)
-            daily_requests.append(max(0, requests))
-            current_volume *= growth_factor
+        growth = start_volume * growth_factor ** np.arange(peak_day)
         
         # Decline phase
         decline_days = self.total_days - peak_day
-        decay_factor = np.exp(np.log(0.1) / decline_days)  # Decay to 20% of peak
+        decay_factor = np.exp(np.log(0.1) / decline_days)  # Decay to 10% of peak
+        decline = start_volume * growth_factor ** peak_day * decay_factor ** np.arange(decline_days)
         
-        for day in range(decline_days):
-            noise = random.uniform(0.8, 1.2)
-            requests = int(current_volume * noise)
-            daily_requests.append(max(0, requests))
-            current_volume *= decay_factor
-        
-        return daily_requests
+        noise = self.rng.uniform(0.8, 1.2, self.total_days)
+        return self._to_counts(np.concatenate([growth, decline]) * noise)
     
     def generate_steady_pattern(self, base_volume: int) -> List[int]:
         """Generate pattern for steadily active projects with consistent usage"""
-        daily_requests = []
+        days = np.arange(self.total_days)
         
         # Define base variation parameters
         daily_noise_factor = 0.2  # 20% daily variation
         weekly_cycle_amplitude = 0.3  # 30% weekly cycle variation
         monthly_cycle_amplitude = 0.15  # 15% monthly cycle variation
         
-        for day in range(self.total_days):
-            # Add daily random noise
-            noise = random.uniform(1 - daily_noise_factor, 1 + daily_noise_factor)
-            
-            # Add weekly cycle (lower on weekends)
-            week_day = day % 7
-            weekend_factor = 1.0 - (weekly_cycle_amplitude if week_day >= 5 else 0)
-            
-            # Add monthly cycle (slight increase during middle of month)
-            month_day = day % 30
-            monthly_factor = 1.0 + (monthly_cycle_amplitude * np.sin(2 * np.pi * month_day / 30))
-            
-            # Calculate requests for the day
-            requests = int(base_volume * noise * weekend_factor * monthly_factor)
-            
-            # Add occasional spikes (1% chance)
-            if random.random() < 0.01:
-                requests = int(requests * random.uniform(1.5, 2.0))
-            
-            # Add occasional dips (1% chance)
-            if random.random() < 0.01:
-                requests = int(requests * random.uniform(0.5, 0.8))
-            
-            daily_requests.append(max(0, requests))
+        # Add daily random noise
+        noise = self.rng.uniform(1 - daily_noise_factor, 1 + daily_noise_factor, self.total_days)
+        
+        # Add weekly cycle (lower on weekends)
+        weekend_factor = np.where(days % 7 >= 5, 1.0 - weekly_cycle_amplitude, 1.0)
+        
+        # Add monthly cycle (slight increase during middle of month)
+        monthly_factor = 1.0 + monthly_cycle_amplitude * np.sin(2 * np.pi * (days % 30) / 30)
+        
+        # Calculate requests for the day
+        requests = np.floor(base_volume * noise * weekend_factor * monthly_factor)
+        
+        # Add occasional spikes (1% chance)
+        spikes = self.rng.random(self.total_days) < 0.01
+        requests = np.where(spikes, np.floor(requests * self.rng.uniform(1.5, 2.0, self.total_days)), requests)
+        
+        # Add occasional dips (1% chance)
+        dips = self.rng.random(self.total_days) < 0.01
+        requests = np.where(dips, np.floor(requests * self.rng.uniform(0.5, 0.8, self.total_days)), requests)
         
-        return daily_requests
+        return self._to_counts(requests)
 
     def generate_error_rates(self, requests: List[int], base_error_rate: float) -> List[int]:
         """Generate realistic error counts based on request volume with mostly zero errors"""
-        error_counts = []
-    
-        # Select random days for catastrophic errors (0.5% of days)
-        # Calculate the sample size, ensuring at least 1 day if any requests exist
-        total_days = len(requests)
-        if total_days > 0:
-            sample_size = max(1, int(total_days * 0.005))
-            # Ensure we don't try to sample more days than available
-            sample_size = min(sample_size, total_days)
-            catastrophic_days = set(random.sample(range(total_days), k=sample_size))
-        else:
-            catastrophic_days = set()
-    
-        # Select random days for elevated errors (2% of days)
-        # Get available days (excluding catastrophic days)
-        available_days = [i for i in range(len(requests)) if i not in catastrophic_days]
-
-        # Calculate sample size for elevated errors
-        if available_days:
-            sample_size = max(1, int(len(available_days) * 0.02))
-            # Ensure we don't try to sample more than available
-            sample_size = min(sample_size, len(available_days))
-            elevated_error_days = set(random.sample(available_days, k=sample_size))
-        else:
-            elevated_error_days = set()
-
-        # Select random days for normal errors (10% of remaining days)
-        available_days = [i for i in range(len(requests)) 
-                 if i not in catastrophic_days and i not in elevated_error_days]        
-
-        print(f"Total days: {len(requests)}")
-        print(f"Catastrophic days: {len(catastrophic_days)}")
-        print(f"Elevated error days: {len(elevated_error_days)}")
-        print(f"Available days: {len(available_days)}")
-        print(f"Trying to sample: {max(1, int(len(available_days) * 0.10))} days")
-    
-
-        # Add a check to ensure we have days to sample from
-        if available_days:
-            normal_error_days = set(random.sample(available_days, 
-                                        k=max(1, int(len(available_days) * 0.10))))
-        else:
-            normal_error_days = set()  # or handle this case as needed
-    
-        for day, req_count in enumerate(requests):
-            if day in catastrophic_days:
-                # Catastrophic error day: 40-90% of requests fail
-                error_rate = random.uniform(0.4, 0.9)
-                errors = int(req_count * error_rate)
-            
-                # Add extra errors to simulate cascade failures
-                cascade_errors = int(req_count * random.uniform(0.1, 0.3))
-                errors += cascade_errors
-            
-            elif day in elevated_error_days:
-                # Elevated error day: 10-30% of requests fail
-                error_rate = random.uniform(0.1, 0.3)
-                errors = int(req_count * error_rate)
-            
-            elif day in normal_error_days:
-                # Normal error day: use base error rate with variation
-                base_errors = int(req_count * base_error_rate)
-                error_variation = np.random.normal(0, base_errors * 0.1)  # 10% standard deviation
-                errors = int(base_errors + error_variation)
-            
-            else:
-                # Most days (87.5% of days) have zero errors
-                errors = 0
+        request_counts = np.asarray(requests, dtype=np.float64)
+        total_days = len(request_counts)
+        if total_days == 0:
+            return []
         
-            error_counts.append(max(0, errors))
-    
-        return error_counts
+        # Catastrophic (0.5% of days, at least 1), elevated (2% of the rest)
+        # and normal (10% of the remaining) error days are disjoint samples
+        # of the days: consecutive slices of one random permutation
+        catastrophic_count = min(max(1, int(total_days * 0.005)), total_days)
+        available = total_days - catastrophic_count
+        elevated_count = min(max(1, int(available * 0.02)), available) if available else 0
+        available -= elevated_count
+        normal_count = min(max(1, int(available * 0.10)), available) if available else 0
+        
+        if self.verbose:
+            print(f"Total days: {total_days}")
+            print(f"Catastrophic days: {catastrophic_count}")
+            print(f"Elevated error days: {elevated_count}")
+            print(f"Available days: {available}")
+            print(f"Trying to sample: {max(1, int(available * 0.10))} days")
+        
+        order = self.rng.permutation(total_days)
+        catastrophic_days = order[:catastrophic_count]
+        elevated_error_days = order[catastrophic_count:catastrophic_count + elevated_count]
+        normal_error_days = order[catastrophic_count + elevated_count:
+                                  catastrophic_count + elevated_count + normal_count]
+        
+        # Most days (87.5% of days) have zero errors
+        errors = np.zeros(total_days, dtype=np.int64)
+        
+        # Catastrophic error day: 40-90% of requests fail, plus extra errors
+        # to simulate cascade failures
+        req_count = request_counts[catastrophic_days]
+        errors[catastrophic_days] = (
+            (req_count * self.rng.uniform(0.4, 0.9, catastrophic_count)).astype(np.int64)
+            + (req_count * self.rng.uniform(0.1, 0.3, catastrophic_count)).astype(np.int64)
+        )
+        
+        # Elevated error day: 10-30% of requests fail
+        req_count = request_counts[elevated_error_days]
+        errors[elevated_error_days] = (req_count * self.rng.uniform(0.1, 0.3, elevated_count)).astype(np.int64)
+        
+        # Normal error day: use base error rate with variation (10% standard deviation)
+        base_errors = np.trunc(request_counts[normal_error_days] * base_error_rate)
+        error_variation = self.rng.normal(0, np.abs(base_errors) * 0.1)
+        errors[normal_error_days] = (base_errors + error_variation).astype(np.int64)
+        
+        return self._to_counts(errors)
 
 def generate_project_requests(project_id: str, start_date: datetime, end_date: datetime, 
-                            plan_type: str, pattern_type: str, error_frequency: str | None = None) -> Tuple[List[Dict], str]:
+                            plan_type: str, pattern_type: str, error_frequency: str | None = None,
+                            seed: int | np.random.Generator | None = None,
+                            verbose: bool = False) -> Tuple[List[Dict], str]:
     """Generate daily requests for a project based on its behavior pattern"""
     
     # Base volumes per plan
@@ -244,7 +199,7 @@ def generate_project_requests(project_id: str, start_date: datetime, end_date: d
     }
     
 
-    generator = RequestPatternGenerator(start_date, end_date)
+    generator = RequestPatternGenerator(start_date, end_date, seed=seed, verbose=verbose)
     base_volume = plan_volumes[plan_type]
     
     # Generate requests based on pattern type
@@ -272,18 +227,20 @@ def generate_project_requests(project_id: str, start_date: datetime, end_date: d
     errors = generator.generate_error_rates(requests, error_rate)
     
     # Create daily records
-    daily_records = []
-    current_date = start_date
-    
-    for req_count, error_count in zip(requests, errors):
-        daily_records.append({
+    request_counts = np.asarray(requests, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        error_rates = np.where(request_counts > 0, np.round(np.asarray(errors) / request_counts * 100, 2), 0)
+    dates = np.arange(np.datetime64(start_date.date()), np.datetime64(start_date.date()) + len(requests))
+    daily_records = [
+        {
             'project_id': project_id,
-            'date': current_date.date(),
+            'date': day,
             'request_count': req_count,
             'error_count': error_count,
-            'error_rate': round(error_count / req_count * 100, 2) if req_count > 0 else 0
-        })
-        current_date += timedelta(days=1)
+            'error_rate': rate
+        }
+        for day, req_count, error_count, rate in zip(dates.tolist(), requests, errors, error_rates.tolist())
+    ]
     
     return daily_records, pattern_type
 
@@ -306,9 +263,11 @@ def generate_project_requests(project_id: str, start_date: datetime, end_date: d
     
     
 class ProjectRequestGenerator:
-    def __init__(self, connection_params: Dict):
+    def __init__(self, connection_params: Dict, seed: int | None = None):
         self.conn = psycopg2.connect(**connection_params)
         self.cursor = self.conn.cursor()
+        # Shared by all projects, so a seed makes the whole run reproducible
+        self.rng = np.random.default_rng(seed)
         
     def get_project_info(self, project_id: str) -> Dict:
         """Fetch project information including its current plan"""
@@ -340,7 +299,8 @@ class ProjectRequestGenerator:
             'plan_name': result[2]
         }
     
-    def generate_and_insert_request_data(self, project_id: str, pattern_type, error_frequency: str | None = None, end_date: datetime | None = None):
+    def generate_and_insert_request_data(self, project_id: str, pattern_type, error_frequency: str | None = None,
+                                         end_date: datetime | None = None, verbose: bool = False):
         """Generate and insert request and error data for a project"""
         try:
             # Get project info
@@ -361,12 +321,15 @@ class ProjectRequestGenerator:
                 end_date,
                 project['plan_name'],
                 pattern_type,
-                error_frequency
+                error_frequency,
+                seed=self.rng,
+                verbose=verbose
             )
-            print(pattern_type)
-            print()
-            for day in daily_records:
-                print(day)
+            if verbose:
+                print(pattern_type)
+                print()
+                for day in daily_records:
+                    print(day)
             
 
             # Prepare data for insertion
@@ -434,10 +397,10 @@ class ProjectRequestGenerator:
         self.cursor.close()
         self.conn.close()
 
-def generate_and_insert_usage(connection_params: dict, project_id, request_pattern_type):
+def generate_and_insert_usage(connection_params: dict, project_id, request_pattern_type, seed: int | None = None):
     try:
         # Initialize generator
-        generator = ProjectRequestGenerator(connection_params)
+        generator = ProjectRequestGenerator(connection_params, seed=seed)
         
         # Example: Generate data for a specific project
         result = generator.generate_and_insert_request_data(project_id, pattern_type=request_pattern_type)
@@ -465,7 +428,7 @@ def main():
         
         # Example: Generate data for a specific project
         project_id = "9e0f8d60-3af5-48b2-9868-b73584df07e4"  # Replace with actual project ID
-        result = generator.generate_and_insert_request_data(project_id, pattern_type="steady", error_frequency='high')
+        result = generator.generate_and_insert_request_data(project_id, pattern_type="steady", error_frequency='high', verbose=True)
         
         print("Successfully generated and inserted request data:")
         print(json.dumps(result, indent=2))
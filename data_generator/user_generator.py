@@ -11,6 +11,14 @@ from psycopg2.extras import execute_values
 fake = Faker()
 
 
+def new_uuid() -> uuid.UUID:
+    """A random UUID drawn from `random`, so seeding it makes ids reproducible"""
+    return uuid.UUID(int=random.getrandbits(128), version=4)
+
+def new_id() -> str:
+    return str(new_uuid())
+
+
 PLANS = [
     {
         "name": "free",
@@ -63,9 +71,9 @@ class UserProjectGenerator:
         created_at = fake.date_time_between(start_date=self.start_date, end_date=self.end_date)
         
         return {
-            'id': str(uuid.uuid4()),
+            'id': new_id(),
             'email': f"{first_name.lower()}.{last_name.lower()}@{company_domain}",
-            'customer_id': f"cus_{uuid.uuid4().hex[:16]}",
+            'customer_id': f"cus_{new_uuid().hex[:16]}",
             'created_at': created_at,
             'updated_at': created_at,
             'first_name': first_name,
@@ -100,7 +108,7 @@ class UserProjectGenerator:
                 )
             
             projects.append({
-                'id': str(uuid.uuid4()),
+                'id': new_id(),
                 'name': f"{fake.word()}-{fake.word()}-{random.randint(1000, 9999)}",
                 'owner_id': user_id,
                 'created_at': created_at,
@@ -120,7 +128,7 @@ class UserProjectGenerator:
         )[0]
         
         return {
-            'id': str(uuid.uuid4()),
+            'id': new_id(),
             'plan_id': initial_plan['id'],
             'project_id': project_id,
             'comment': 'Initial plan assignment',
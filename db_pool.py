@@ -0,0 +1,84 @@
+import asyncio
+from typing import Dict, List
+
+from psycopg import AsyncConnection
+from psycopg.types.string import TextLoader
+from psycopg_pool import AsyncConnectionPool
+
+import tracing
+
+POOL_MIN_SIZE = 1
+POOL_MAX_SIZE = 10
+
+
+async def configure_connection(conn: AsyncConnection):
+    """Make pooled connections behave like the tools expect"""
+    # Every transaction on a pooled connection is started as BEGIN READ ONLY
+    await conn.set_read_only(True)
+    # Return UUIDs as strings (as psycopg2 did) so results stay JSON serializable
+    conn.adapters.register_loader("uuid", TextLoader)
+
+
+class ReadOnlyDatabase:
+    """Async connection pool for running read-only queries against one database"""
+
+    def __init__(
+        self, url: str, min_size: int = POOL_MIN_SIZE, max_size: int = POOL_MAX_SIZE
+    ):
+        self.url = url
+        self.pool = AsyncConnectionPool(
+            url,
+            min_size=min_size,
+            max_size=max_size,
+            configure=configure_connection,
+            open=False,
+        )
+        self.open_lock = asyncio.Lock()
+        self.is_open = False
+
+    async def _get_pool(self) -> AsyncConnectionPool:
+        # The pool is opened lazily so it binds to the event loop running the queries
+        async with self.open_lock:
+            if not self.is_open:
+                await self.pool.open()
+                self.is_open = True
+        return self.pool
+
+    async def execute_query(self, sql: str) -> List[Dict]:
+        """Execute a query in a read-only transaction and return rows as dicts"""
+        with tracing.span(
+            "sql query", {"db.system": "postgresql", "db.statement": sql}
+        ) as span:
+            pool = await self._get_pool()
+            async with pool.connection() as conn:
+                try:
+                    cursor = await conn.execute(sql)  # type: ignore
+                    description = cursor.description
+                    assert description is not None
+                    columns = [desc.name for desc in description]
+                    rows = [dict(zip(columns, row)) for row in await cursor.fetchall()]
+                    span.set_attribute("db.response.returned_rows", len(rows))
+                    return rows
+                finally:
+                    await conn.rollback()
+
+    async def close(self):
+        if self.is_open:
+            await self.pool.close()
+            self.is_open = False
+
+
+_databases: Dict[str, ReadOnlyDatabase] = {}
+
+
+def get_database(url: str) -> ReadOnlyDatabase:
+    """Return the pool for a database URL, shared by every assistant in the process"""
+    if url not in _databases:
+        _databases[url] = ReadOnlyDatabase(url)
+    return _databases[url]
+
+
+async def close_databases():
+    """Close all pools opened by this process"""
+    for database in _databases.values():
+        await database.close()
@@ -2,16 +2,20 @@
 import os
 import json
 import argparse
+import hashlib
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional, NamedTuple
+from typing import Any, Dict, Iterator, List, Tuple, Optional, NamedTuple
 import importlib.util
-from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from functools import lru_cache
 import pandas as pd
 import yaml
 from pydantic import BaseModel
 import traceback
 
 from bench import InputConfig
+from run_store import RunStore, run_path
 
 
 def read_input_config(filepath: str) -> InputConfig:
@@ -32,6 +36,28 @@ class EvaluationResult:
     run: int
     score: float
     oracle: bool
+    # METRIC_COLUMNS of the run, empty for runs without a .metrics.json
+    metrics: Dict[str, Any] = field(default_factory=dict)
+
+
+# Columns joined from the .metrics.json written by bench next to each .result
+METRIC_COLUMNS = [
+    "elapsed_s",
+    "llm_calls",
+    "tool_calls",
+    "tool_errors",
+    "loop_count",
+    "input_tokens",
+    "output_tokens",
+    "cached_tokens",
+    "cache_write_tokens",
+    "reasoning_tokens",
+    "llm_latency_s",
+    "sql_latency_s",
+    "python_latency_s",
+    "promptql_latency_s",
+    "estimated_cost_usd",
+]
 
 
 class PathInfo(NamedTuple):
@@ -81,48 +107,208 @@ def parse_output_path(file_path: Path) -> PathInfo:
     )
 
 
+def load_evaluator(evaluator_module: str):
+    """Load a scoring module (a file with an evaluate_score function) by path"""
+    spec = importlib.util.spec_from_file_location("evaluator", evaluator_module)
+    if spec is None or spec.loader is None:
+        raise ImportError(f"Could not load module: {evaluator_module}")
+
+    evaluator = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(evaluator)
+
+    if not hasattr(evaluator, "evaluate_score"):
+        raise ImportError("Module does not contain evaluate_score function")
+    return evaluator
+
+
+@lru_cache(maxsize=None)
+def file_hash(file_path: str) -> str:
+    with open(file_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def result_fingerprint(file_path: Path) -> str:
+    """Cheap change detector for result files"""
+    stat = file_path.stat()
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def metrics_path(result_path: Path) -> Path:
+    return result_path.with_name(result_path.name.replace(".result", ".metrics.json"))
+
+
+def read_run_metrics(result_path: Path) -> Dict[str, Any]:
+    """METRIC_COLUMNS of the run of a result file"""
+    path = metrics_path(result_path)
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        data = json.load(f)
+    columns = {"elapsed_s": data.get("elapsed_s"), **data.get("summary", {})}
+    return {column: columns.get(column) for column in METRIC_COLUMNS}
+
+
+# Scoring runs in worker processes, which load the evaluator once at startup
+_evaluate_score = None
+
+
+def _init_scoring_worker(evaluator_module: str):
+    global _evaluate_score
+    _evaluate_score = load_evaluator(evaluator_module).evaluate_score
+
+
+@lru_cache(maxsize=None)
+def read_ground_truth(file_path: str) -> str:
+    """Ground truths are shared by many results, so each is read once per process"""
+    return read_file_content(file_path)
+
+
+def _score_result(task: Tuple[str, str]) -> Tuple[str, Optional[float], Optional[str]]:
+    result_path, ground_truth_path = task
+    assert _evaluate_score is not None
+    try:
+        ground_truth = read_ground_truth(ground_truth_path)
+        test_result = read_file_content(result_path)
+        return result_path, float(_evaluate_score(ground_truth, test_result)), None
+    except Exception as e:
+        return result_path, None, str(e)
+
+
+def _score_stored_result(task: Tuple[str, str, str]) -> Tuple[str, Optional[float], Optional[str]]:
+    run_key, ground_truth_path, test_result = task
+    assert _evaluate_score is not None
+    try:
+        ground_truth = read_ground_truth(ground_truth_path)
+        return run_key, float(_evaluate_score(ground_truth, test_result)), None
+    except Exception as e:
+        return run_key, None, str(e)
+
+
+def score_results(
+    tasks: List[Tuple[str, ...]],
+    evaluator_module: str,
+    max_workers: Optional[int],
+    score=_score_result,
+) -> Iterator[Tuple[str, Optional[float], Optional[str]]]:
+    """
+    Score tasks on a process pool, in order. Tasks are (result, ground truth)
+    path pairs, or what score takes.
+    """
+    # Loaded here first so a broken module fails early, forked workers then
+    # start with its imports in place
+    _init_scoring_worker(evaluator_module)
+
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers == 1 or len(tasks) == 1:
+        # Not worth starting processes for
+        yield from map(score, tasks)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=min(max_workers, len(tasks)),
+        initializer=_init_scoring_worker,
+        initargs=(evaluator_module,),
+    ) as executor:
+        chunksize = max(1, len(tasks) // (max_workers * 4))
+        yield from executor.map(score, tasks, chunksize=chunksize)
+
+
+def load_manifest(manifest_path: Path) -> Dict[str, Dict]:
+    if not manifest_path.exists():
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: Dict[str, Dict], manifest_path: Path):
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
 def evaluate_directory(
-    base_dir: Path, config: InputConfig, config_path: str, evaluator_func
+    base_dir: Path,
+    config: InputConfig,
+    config_path: str,
+    evaluator_module: str,
+    manifest: Optional[Dict[str, Dict]] = None,
+    max_workers: Optional[int] = None,
 ) -> List[EvaluationResult]:
-    """Evaluate all result files in the directory."""
-    results = []
-    result_files = find_result_files(base_dir)
+    """
+    Evaluate all result files in the directory.
 
-    # Create mapping of variation names to ground truth paths
-    ground_truth_paths = {}
-    if config.variations:
-        for variation in config.variations:
-            ground_truth_paths[variation.name] = variation.ground_truth_path
+    manifest maps each scored result file to the fingerprints it was scored
+    with (result mtime/size, ground truth hash, evaluator hash) and its result.
+    Results whose fingerprints are unchanged are reused instead of re-scored,
+    and the manifest is updated in place. The rest are scored on a process pool.
+    Run metrics are fingerprinted too, but only re-read when they change.
+    """
+    if manifest is None:
+        manifest = {}
+    results_by_file: Dict[str, EvaluationResult] = {}
+    result_files = find_result_files(base_dir)
+    evaluator_hash = file_hash(os.path.abspath(evaluator_module))
 
+    tasks = []
+    fingerprints = {}
     for file_path in result_files:
         try:
             # Parse path to get metadata
             path_info = parse_output_path(file_path)
 
             # Get ground truth path from config
-            if path_info.variation not in ground_truth_paths:
-                print(
-                    f"Warning: No ground truth path found for variation {path_info.variation}"
+            ground_truth_path = resolve_ground_truth_path(
+                config, config_path, path_info.variation
+            )
+            if ground_truth_path is None:
+                continue
+
+            run_metrics_path = metrics_path(file_path)
+            fingerprint = {
+                "result": result_fingerprint(file_path),
+                "ground_truth": file_hash(ground_truth_path),
+                "evaluator": evaluator_hash,
+                "metrics": (
+                    result_fingerprint(run_metrics_path)
+                    if run_metrics_path.exists()
+                    else None
+                ),
+            }
+            entry = manifest.get(str(file_path))
+            if entry is not None and entry["fingerprint"] == fingerprint:
+                results_by_file[str(file_path)] = EvaluationResult(**entry["result"])
+                continue
+            if entry is not None and all(
+                entry["fingerprint"].get(key) == fingerprint[key]
+                for key in ("result", "ground_truth", "evaluator")
+            ):
+                # Only the metrics changed, the score still holds
+                result = EvaluationResult(
+                    **{**entry["result"], "metrics": read_run_metrics(file_path)}
                 )
+                results_by_file[str(file_path)] = result
+                manifest[str(file_path)] = {
+                    "fingerprint": fingerprint,
+                    "result": asdict(result),
+                }
                 continue
 
-            ground_truth_path = ground_truth_paths[path_info.variation]
+            fingerprints[str(file_path)] = fingerprint
+            tasks.append((str(file_path), ground_truth_path))
 
-            # Handle relative paths - assume relative to config directory
-            if not os.path.isabs(ground_truth_path):
-                config_dir = os.path.dirname(os.path.abspath(config_path))
-                ground_truth_path = os.path.join(config_dir, ground_truth_path)
+        except Exception as e:
+            print(f"Error processing {file_path}: {str(e)}")
+            continue
 
-            if not os.path.exists(ground_truth_path):
-                print(f"Warning: Ground truth file not found: {ground_truth_path}")
+    if tasks:
+        print(f"Scoring {len(tasks)} result files ({len(results_by_file)} unchanged)")
+        scored = score_results(tasks, evaluator_module, max_workers)
+        for file_path, score, error in scored:
+            if error is not None:
+                print(f"Error processing {file_path}: {error}")
                 continue
-
-            # Evaluate
-            ground_truth = read_file_content(ground_truth_path)
-            test_result = read_file_content(str(file_path))
-            score = evaluator_func(ground_truth, test_result)
-            print(f"TEST FILE: {str(file_path)}, SCORE: {score}")
-            # Store result
+            assert score is not None
+            print(f"TEST FILE: {file_path}, SCORE: {score}")
+            path_info = parse_output_path(Path(file_path))
             result = EvaluationResult(
                 system=path_info.system,
                 model=path_info.model,
@@ -130,25 +316,140 @@ def evaluate_directory(
                 run=path_info.run,
                 score=score,
                 oracle=path_info.oracle,
+                metrics=read_run_metrics(Path(file_path)),
+            )
+            results_by_file[file_path] = result
+            manifest[file_path] = {
+                "fingerprint": fingerprints[file_path],
+                "result": asdict(result),
+            }
+
+    # Forget results which no longer exist
+    for file_path in list(manifest):
+        if file_path not in results_by_file:
+            del manifest[file_path]
+
+    # Keep the order of the result files
+    return [
+        results_by_file[str(file_path)]
+        for file_path in result_files
+        if str(file_path) in results_by_file
+    ]
+
+
+def resolve_ground_truth_path(
+    config: InputConfig, config_path: str, variation: str
+) -> Optional[str]:
+    """Ground truth file of a variation, None (with a warning) when there is none"""
+    ground_truth_paths = {v.name: v.ground_truth_path for v in config.variations}
+    if variation not in ground_truth_paths:
+        print(f"Warning: No ground truth path found for variation {variation}")
+        return None
+    ground_truth_path = ground_truth_paths[variation]
+    # Relative paths are relative to the config directory
+    if not os.path.isabs(ground_truth_path):
+        config_dir = os.path.dirname(os.path.abspath(config_path))
+        ground_truth_path = os.path.join(config_dir, ground_truth_path)
+    if not os.path.exists(ground_truth_path):
+        print(f"Warning: Ground truth file not found: {ground_truth_path}")
+        return None
+    return ground_truth_path
+
+
+def evaluate_store(
+    store: RunStore,
+    config: InputConfig,
+    config_path: str,
+    evaluator_module: str,
+    manifest: Optional[Dict[str, Dict]] = None,
+    max_workers: Optional[int] = None,
+) -> List[EvaluationResult]:
+    """
+    evaluate_directory for the runs of a run store, read with a query instead
+    of walking directories. Runs are keyed in the manifest by their path in the
+    file layout and fingerprinted by when they were saved.
+    """
+    if manifest is None:
+        manifest = {}
+    results_by_run: Dict[str, EvaluationResult] = {}
+    evaluator_hash = file_hash(os.path.abspath(evaluator_module))
+    ground_truth_paths: Dict[str, Optional[str]] = {}
+
+    runs = {}
+    tasks = []
+    fingerprints = {}
+    for run in store.runs(include_errors=False):
+        run_key = f"{run_path(run)}.result"
+        variation = run["variation"]
+        if variation not in ground_truth_paths:
+            ground_truth_paths[variation] = resolve_ground_truth_path(
+                config, config_path, variation
             )
-            results.append(result)
+        ground_truth_path = ground_truth_paths[variation]
+        if ground_truth_path is None:
+            continue
 
-        except Exception as e:
-            print(f"Error processing {file_path}: {str(e)}")
+        runs[run_key] = run
+        fingerprint = {
+            "result": run["saved_at"],
+            "ground_truth": file_hash(ground_truth_path),
+            "evaluator": evaluator_hash,
+        }
+        entry = manifest.get(run_key)
+        if entry is not None and entry["fingerprint"] == fingerprint:
+            results_by_run[run_key] = EvaluationResult(**entry["result"])
             continue
+        fingerprints[run_key] = fingerprint
+        tasks.append((run_key, ground_truth_path, run["result"]))
+
+    if tasks:
+        print(f"Scoring {len(tasks)} runs ({len(results_by_run)} unchanged)")
+        scored = score_results(
+            tasks, evaluator_module, max_workers, score=_score_stored_result
+        )
+        for run_key, score, error in scored:
+            if error is not None:
+                print(f"Error processing {run_key}: {error}")
+                continue
+            assert score is not None
+            print(f"TEST RUN: {run_key}, SCORE: {score}")
+            run = runs[run_key]
+            result = EvaluationResult(
+                system=run["system"],
+                model=run["model"],
+                variation=run["variation"],
+                run=run["run"],
+                score=score,
+                oracle=run["oracle"],
+                metrics={column: run.get(column) for column in METRIC_COLUMNS},
+            )
+            results_by_run[run_key] = result
+            manifest[run_key] = {
+                "fingerprint": fingerprints[run_key],
+                "result": asdict(result),
+            }
 
-    return results
+    # Forget runs which no longer exist
+    for run_key in list(manifest):
+        if run_key not in results_by_run:
+            del manifest[run_key]
 
+    return [results_by_run[run_key] for run_key in runs if run_key in results_by_run]
 
-def save_results(results: List[EvaluationResult], output_path: Path):
+
+def save_results(
+    results: List[EvaluationResult], output_path: Path, append: bool = False
+):
     import csv
 
     # Define the fieldnames based on the dataclass fields
     fieldnames = ["model", "system", "oracle", "variation", "run", "score"]
+    fieldnames += METRIC_COLUMNS
 
-    with open(output_path, "w", newline="") as f:
+    with open(output_path, "a" if append else "w", newline="") as f:
         writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
+        if not append:
+            writer.writeheader()
 
         # Write each result as a row
         for r in results:
@@ -160,6 +461,7 @@ def save_results(results: List[EvaluationResult], output_path: Path):
                     "variation": r.variation,
                     "run": r.run,
                     "score": r.score,
+                    **{column: r.metrics.get(column) for column in METRIC_COLUMNS},
                 }
             )
 
@@ -173,11 +475,16 @@ def main():
     parser.add_argument(
         "--input_filepath", type=str, help="Path to input config YAML file", required=True
     )
-    parser.add_argument(
+    runs = parser.add_mutually_exclusive_group(required=True)
+    runs.add_argument(
         "--output_dir",
         type=str,
         help="Base output directory containing results",
-        required=True,
+    )
+    runs.add_argument(
+        "--run_store",
+        type=str,
+        help="Run store (bench.py --run_store) containing results",
     )
     parser.add_argument(
         "--evaluator_module",
@@ -192,32 +499,75 @@ def main():
         help="Path to save summary statistics (default: evaluation_summary.csv)",
     )
 
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of scoring processes (default: number of CPUs)",
+    )
+
     args = parser.parse_args()
 
     try:
         # Load config
         input_config = read_input_config(args.input_filepath)
 
-        # Load evaluator module
-        spec = importlib.util.spec_from_file_location(
-            "evaluator", args.evaluator_module
-        )
-        if spec is None or spec.loader is None:
-            raise ImportError(f"Could not load module: {args.evaluator_module}")
-
-        evaluator = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(evaluator)
-
-        if not hasattr(evaluator, "evaluate_score"):
-            raise ImportError("Module does not contain evaluate_score function")
+        results_file = Path(args.results_file)
+        manifest_path = results_file.with_name(results_file.name + ".manifest.json")
+        # The manifest describes the rows of the results file, so it's only
+        # usable when that file is still there
+        manifest = load_manifest(manifest_path) if results_file.exists() else {}
+        previous_entries = {
+            file_path: entry["fingerprint"] for file_path, entry in manifest.items()
+        }
+
+        if args.run_store:
+            store = RunStore(args.run_store)
+            try:
+                results = evaluate_store(
+                    store,
+                    input_config,
+                    args.input_filepath,
+                    args.evaluator_module,
+                    manifest=manifest,
+                    max_workers=args.workers,
+                )
+            finally:
+                store.close()
+        else:
+            # Process directory
+            base_dir = Path(args.output_dir)
+            results = evaluate_directory(
+                base_dir,
+                input_config,
+                args.input_filepath,
+                args.evaluator_module,
+                manifest=manifest,
+                max_workers=args.workers,
+            )
 
-        # Process directory
-        base_dir = Path(args.output_dir)
-        results = evaluate_directory(
-            base_dir, input_config, args.input_filepath, evaluator.evaluate_score
+        current_entries = {
+            file_path: entry["fingerprint"] for file_path, entry in manifest.items()
+        }
+        new_files = current_entries.keys() - previous_entries.keys()
+        changed = any(
+            previous_entries[file_path] != current_entries.get(file_path)
+            for file_path in previous_entries
         )
-
-        save_results(results, Path(args.results_file))
+        if previous_entries and not changed:
+            # Only new results (or none): append their rows to the existing file
+            if new_files:
+                new_results = [
+                    EvaluationResult(**manifest[file_path]["result"])
+                    for file_path in manifest
+                    if file_path in new_files
+                ]
+                save_results(new_results, results_file, append=True)
+            else:
+                print(f"\nNo new or changed results, {results_file} is up to date")
+        else:
+            save_results(results, results_file)
+        save_manifest(manifest, manifest_path)
 
     except Exception as e:
         print(traceback.format_exc())
@@ -2,6 +2,7 @@
 import os
 import psycopg2
 from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletion
 from typing import List, Dict, Any
 import logging
 import json
@@ -10,6 +11,10 @@ from decimal import Decimal
 import tempfile
 import subprocess
 
+from llm_cache import ResponseCache
+from scheduler import Provider
+from schema_cache import get_schema_cache
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -36,41 +41,40 @@ class DatabaseTool:
 
     def get_database_schema(self, conn: psycopg2.extensions.connection, custom_where_clause: str) -> str:
         """Get database schema information"""
-        with conn.cursor() as cursor:
-            query = """
-                SELECT 
-                    table_name,
-                    column_name,
-                    data_type
-                FROM 
-                    information_schema.columns
-                WHERE 
-                    table_schema = 'public' AND {}
-                ORDER BY 
-                    table_name, ordinal_position;
-            """.format(custom_where_clause)
-            
-            cursor.execute(query)
-            results = cursor.fetchall()
-            
-            schema = {}
-            for row in results:
-                table_name, column_name, data_type = row
-                if table_name not in schema:
-                    schema[table_name] = {'columns': []}
-                schema[table_name]['columns'].append({
-                    'name': column_name,
-                    'type': data_type
-                })
+        query = """
+            SELECT 
+                table_name,
+                column_name,
+                data_type
+            FROM 
+                information_schema.columns
+            WHERE 
+                table_schema = 'public' AND {}
+            ORDER BY 
+                table_name, ordinal_position;
+        """.format(custom_where_clause)
+        
+        # Served from the schema cache while the database's schema is unchanged
+        results = get_schema_cache().fetch_sync(conn, query)
+        
+        schema = {}
+        for row in results:
+            table_name, column_name, data_type = row['table_name'], row['column_name'], row['data_type']
+            if table_name not in schema:
+                schema[table_name] = {'columns': []}
+            schema[table_name]['columns'].append({
+                'name': column_name,
+                'type': data_type
+            })
+        
+        schema_str = '\n'
+        for table, details in schema.items():
+            schema_str += f"table {table} columns ("
+            for col in details['columns']:
+                schema_str += f" {col['name']} {col['type']},"
+            schema_str += ')\n'
             
-            schema_str = '\n'
-            for table, details in schema.items():
-                schema_str += f"table {table} columns ("
-                for col in details['columns']:
-                    schema_str += f" {col['name']} {col['type']},"
-                schema_str += ')\n'
-                
-            return schema_str.strip()
+        return schema_str.strip()
 
     def execute_query(self, conn: psycopg2.extensions.connection, sql: str) -> List[Dict]:
         """Execute a read-only SQL query"""
@@ -155,11 +159,12 @@ class DatabaseTool:
         self.support_tickets_conn.close()
 
 class AIAssistant:
-    def __init__(self):
+    def __init__(self, cache: ResponseCache | None = None):
         self.db_tool = DatabaseTool()
         self.client = AsyncOpenAI(
             api_key=os.environ.get("OPENAI_API_KEY")
         )
+        self.cache = cache or ResponseCache()
         # Cache schemas on initialization
         self.control_plane_schema = self.db_tool.get_database_schema(
             self.db_tool.control_plane_conn,
@@ -193,6 +198,15 @@ Additional Instructions:
         self.messages = self.init_messages.copy()
         self.api_responses = []
 
+    async def create_completion(self, **request) -> ChatCompletion:
+        """Create a chat completion, served from the response cache when possible"""
+        return await self.cache.fetch(
+            Provider.OPENAI,
+            request,
+            ChatCompletion,
+            lambda: self.client.chat.completions.create(**request)
+        )
+
     async def process_query(self, query: str) -> str:
         """Process a query using available tools and GPT-4 while maintaining conversation history"""
         # Add the new user query to the conversation history
@@ -203,7 +217,7 @@ Additional Instructions:
 
         try:
             while tool_loop_count < MAX_TOOL_LOOPS:
-                completion = await self.client.chat.completions.create(
+                completion = await self.create_completion(
                     model="gpt-4o",
                     messages=self.messages,
                     tools=self.db_tool.tool_schemas,
@@ -278,7 +292,7 @@ Additional Instructions:
                         "content": "You have reached the maximum number of tool uses. Please provide a final response based on the information you have gathered so far."
                     })
 
-            final_completion = await self.client.chat.completions.create(
+            final_completion = await self.create_completion(
                 model="gpt-4o",
                 messages=self.messages
             )
@@ -358,7 +372,13 @@ def execute_python_code(python_code: str, data_values: str = "[]") -> Dict[str,
         
 
 async def main():
-    assistant = AIAssistant()
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cache_dir", help="Directory to cache LLM responses in")
+    args = parser.parse_args()
+
+    assistant = AIAssistant(cache=ResponseCache(args.cache_dir))
     
     try:
         while True:
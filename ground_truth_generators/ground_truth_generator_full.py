@@ -1,8 +1,13 @@
+import os
 import csv
+import asyncio
 import argparse
 from datetime import datetime
-from typing import List, Dict
-from ground_truth_generator import execute_program
+from typing import List, Dict, Set, Tuple
+
+import httpx
+
+from ground_truth_generator import build_payload, execute_program_async, read_program
 
 def extract_ticket_ids(result: Dict) -> List[int]:
     """Extract ticket IDs from the API response."""
@@ -16,63 +21,130 @@ def extract_ticket_ids(result: Dict) -> List[int]:
         return []
     return []
 
-def parameter_sweep(input_file: str, output_file: str) -> None:
+def read_results(output_file: str) -> Dict[Tuple[int, int], str]:
+    """Ticket ids by (top_k, n_last) combination of a results CSV file, the last row of a combination wins"""
+    if not os.path.exists(output_file):
+        return {}
+    with open(output_file, newline='') as f:
+        return {
+            (int(row['top_k_tickets']), int(row['n_last_tickets'])): row['ticket_ids']
+            for row in csv.DictReader(f)
+        }
+
+def completed_combinations(output_file: str) -> Set[Tuple[int, int]]:
+    """(top_k, n_last) combinations saved with ticket ids in a results CSV file"""
+    # Empty rows (eg: left by a failed attempt) are run again
+    return {combination for combination, ticket_ids in read_results(output_file).items() if ticket_ids}
+
+def sort_results(output_file: str) -> None:
+    """Rewrite a results CSV file with one row per combination, sorted by top_k then n_last"""
+    results = read_results(output_file)
+    tmp_file = f"{output_file}.tmp"
+    with open(tmp_file, 'w', newline='') as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_MINIMAL)
+        writer.writerow(['top_k_tickets', 'n_last_tickets', 'ticket_ids'])
+        for (top_k, n_last), ticket_ids in sorted(results.items()):
+            writer.writerow([top_k, n_last, ticket_ids])
+    os.replace(tmp_file, output_file)
+
+async def run_combination(
+    client: httpx.AsyncClient,
+    semaphore: asyncio.Semaphore,
+    code: str,
+    top_k: int,
+    n_last: int,
+    max_retries: int
+) -> Tuple[int, int, List[int]]:
+    """Execute the program for one combination, retrying with backoff on failure"""
+    for attempt in range(max_retries + 1):
+        try:
+            async with semaphore:
+                result = await execute_program_async(
+                    client,
+                    code,
+                    n_last_tickets=n_last,
+                    top_k_tickets=top_k
+                )
+            return top_k, n_last, extract_ticket_ids(result)
+        except Exception as e:
+            if attempt == max_retries:
+                raise Exception(f"top_k_tickets={top_k}, n_last_tickets={n_last}: {str(e)}")
+            delay = 2 ** attempt
+            print(f"Error in combination top_k_tickets={top_k}, n_last_tickets={n_last}: {str(e)}, retrying in {delay}s")
+            await asyncio.sleep(delay)
+    raise AssertionError("unreachable")
+
+async def parameter_sweep(
+    input_file: str,
+    output_file: str,
+    concurrency: int = 8,
+    max_retries: int = 3
+) -> None:
     """
     Perform parameter sweep and save results as CSV.
     
+    Combinations run concurrently (at most `concurrency` requests at a time) on
+    one HTTP client, and rows are appended to the CSV as they complete. The
+    file is then rewritten sorted, so its order doesn't depend on completion
+    order. Combinations already in the output file with ticket ids are
+    skipped, so an interrupted sweep can be resumed by running it again.
+    
     Args:
         input_file: Path to the input PromptQL code file
         output_file: Path to save the results CSV file
+        concurrency: Maximum number of programs executing at once
+        max_retries: Number of retries of a failing combination
     """
+    code = read_program(input_file)
+    combinations = [
+        (top_k, n_last)
+        for top_k in range(1, 6)  # 1 to 5 inclusive
+        for n_last in range(5, 31)  # 5 to 30 inclusive
+    ]
+    # Fail early on missing API keys instead of once per combination
+    build_payload(code, n_last_tickets=combinations[0][1], top_k_tickets=combinations[0][0])
+
+    done = completed_combinations(output_file)
+    pending = [c for c in combinations if c not in done]
+    if done:
+        print(f"Skipping {len(combinations) - len(pending)} combinations already in {output_file}")
+    
+    semaphore = asyncio.Semaphore(concurrency)
+    timeout = httpx.Timeout(30, read=600)
+    new_file = not os.path.exists(output_file)
     # Initialize CSV file with headers using proper quoting
-    with open(output_file, 'w', newline='') as f:
+    with open(output_file, 'a', newline='') as f:
         writer = csv.writer(f, quoting=csv.QUOTE_MINIMAL)
-        writer.writerow(['top_k_tickets', 'n_last_tickets', 'ticket_ids'])
-    
-    total_combinations = (30 - 5 + 1) * (5 - 1 + 1)
-    current_combination = 0
-    
-    try:
-        for top_k in range(1, 6):  # 1 to 5 inclusive
-            for n_last in range(5, 31):  # 5 to 30 inclusive
-                current_combination += 1
-                print(f"\nProcessing combination {current_combination}/{total_combinations}")
-                print(f"Parameters: top_k_tickets={top_k}, n_last_tickets={n_last}")
-                
-                try:
-                    # Execute the program with current parameters
-                    result = execute_program(
-                        filename=input_file,
-                        n_last_tickets=n_last,
-                        top_k_tickets=top_k
-                    )
-                    
-                    # Extract ticket IDs and join them with commas
-                    ticket_ids = extract_ticket_ids(result)
-                    ticket_ids_str = ','.join(map(str, ticket_ids))
+        if new_file:
+            writer.writerow(['top_k_tickets', 'n_last_tickets', 'ticket_ids'])
+        
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            tasks = [
+                asyncio.ensure_future(
+                    run_combination(client, semaphore, code, top_k, n_last, max_retries)
+                )
+                for top_k, n_last in pending
+            ]
+            try:
+                for current_combination, task in enumerate(asyncio.as_completed(tasks), start=1):
+                    try:
+                        top_k, n_last, ticket_ids = await task
+                        # Extract ticket IDs and join them with commas
+                        ticket_ids_str = ','.join(map(str, ticket_ids))
+                        print(f"Processed combination {current_combination}/{len(pending)}: "
+                              f"top_k_tickets={top_k}, n_last_tickets={n_last}, ticket IDs: {ticket_ids_str}")
+                    except Exception as e:
+                        # Not saved, so the combination is retried when the sweep is resumed
+                        print(f"Error in combination: {str(e)}")
+                        continue
                     
                     # Save to CSV with proper quoting
-                    with open(output_file, 'a', newline='') as f:
-                        writer = csv.writer(f, quoting=csv.QUOTE_MINIMAL)
-                        writer.writerow([
-                            top_k,
-                            n_last,
-                            ticket_ids_str  # This will be automatically quoted if it contains commas
-                        ])
-                    
-                    print(f"Ticket IDs: {ticket_ids_str}")
-                    
-                except Exception as e:
-                    # Log error and write empty result to CSV
-                    print(f"Error in combination: {str(e)}")
-                    with open(output_file, 'a', newline='') as f:
-                        writer = csv.writer(f, quoting=csv.QUOTE_MINIMAL)
-                        writer.writerow([top_k, n_last, ''])
-                
-                print(f"Results appended to {output_file}")
-                
-    except KeyboardInterrupt:
-        print("\nParameter sweep interrupted by user. Partial results saved.")
+                    writer.writerow([top_k, n_last, ticket_ids_str])
+                    f.flush()
+            finally:
+                for task in tasks:
+                    task.cancel()
+    sort_results(output_file)
     
     print(f"\nParameter sweep completed. Results saved to {output_file}")
 
@@ -80,10 +152,16 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Perform parameter sweep over PromptQL program')
     parser.add_argument('--input_file', type=str, help='Path to the input file containing the PromptQL code')
     parser.add_argument('--output_file', type=str, help='Path to save the results CSV file')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='Number of combinations executing at once (default: 8)')
+    parser.add_argument('--max_retries', type=int, default=3,
+                        help='Retries of a failing combination (default: 3)')
     
     args = parser.parse_args()
     
     try:
-        parameter_sweep(args.input_file, args.output_file)
+        asyncio.run(parameter_sweep(args.input_file, args.output_file, args.concurrency, args.max_retries))
+    except KeyboardInterrupt:
+        print("\nParameter sweep interrupted by user. Partial results saved, run again to resume.")
     except Exception as e:
         print(f"Error during parameter sweep: {str(e)}")
\ No newline at end of file
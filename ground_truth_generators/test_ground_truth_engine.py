@@ -0,0 +1,95 @@
+"""The engine ranks tickets like the complexity_N.py programs it replaces"""
+import re
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from ground_truth_engine import COMPLEXITY_RULES, Ticket, prioritize
+from ground_truth_generator import TICKET_CATEGORIES
+
+PROGRAMS_DIR = Path(__file__).parent
+NOW = datetime(2025, 2, 3, tzinfo=timezone.utc)
+
+# (ticket id, plan of its project), newest first. 139 and 143 are Downtime
+# tickets, 186 and 187 Reliability ones and 169 a Performance one
+TICKETS = [
+    (143, 'free'),
+    (186, 'trial'),
+    (169, 'advanced'),
+    (187, 'base'),
+    (144, None),
+    (139, 'trial'),
+]
+
+
+class FakeExecutor:
+    """The PromptQL executor of the programs, over TICKETS"""
+
+    def __init__(self):
+        self.artifacts = {'ticket_category': TICKET_CATEGORIES}
+
+    def run_sql(self, sql):
+        if 'support_ticket' in sql:
+            limit = int(re.search(r'LIMIT (\d+)', sql).group(1))
+            return [
+                {
+                    'ticket_id': ticket_id,
+                    'subject': f'Ticket {ticket_id}',
+                    'description': f'Project ID: {project_id(ticket_id)}',
+                    'created_at': created_at(i).isoformat(),
+                    'status': 'open',
+                }
+                for i, (ticket_id, _) in enumerate(TICKETS[:limit])
+            ]
+        plans = {project_id(ticket_id): plan for ticket_id, plan in TICKETS}
+        plan = plans[re.search(r"pc.project_id = '([^']+)'", sql).group(1)]
+        return [{'plan_name': plan.capitalize()}] if plan else []
+
+    def get_artifact(self, identifier):
+        return self.artifacts[identifier]
+
+    def store_artifact(self, identifier, title, artifact_type, data):
+        self.artifacts[identifier] = data
+
+    def print(self, *args):
+        pass
+
+
+def project_id(ticket_id: int) -> str:
+    return f'00000000-0000-0000-0000-{ticket_id:012d}'
+
+
+def created_at(i: int) -> datetime:
+    return NOW - timedelta(hours=i + 1)
+
+
+def program_ranking(complexity: int, n_last_tickets: int, top_k_tickets: int):
+    """Ticket ids ranked by complexity_N.py"""
+    code = (PROGRAMS_DIR / f'complexity_{complexity}.py').read_text()
+    executor = FakeExecutor()
+    namespace = {'executor': executor}
+    exec(code, namespace)
+    namespace['prioritize_tickets'](n_last_tickets=n_last_tickets, top_k_tickets=top_k_tickets)
+    return [t['ticket_id'] for t in executor.artifacts['prioritized_tickets']]
+
+
+def engine_ranking(complexity: int, n_last_tickets: int, top_k_tickets: int):
+    tickets = [
+        Ticket(
+            ticket_id=ticket_id,
+            created_at=created_at(i),
+            project_id=project_id(ticket_id),
+            plan=plan,
+            mentions_known_project=True,
+            category={t['id']: t['category'] for t in TICKET_CATEGORIES}[str(ticket_id)],
+        )
+        for i, (ticket_id, plan) in enumerate(TICKETS)
+    ]
+    return prioritize(tickets, COMPLEXITY_RULES[complexity], n_last_tickets)[:top_k_tickets]
+
+
+def test_complexity_5_downtime_on_other_plans():
+    # The Downtime tickets of the trial, free and unknown plans come right
+    # after the advanced and base critical tickets
+    assert engine_ranking(5, len(TICKETS), len(TICKETS)) == [187, 139, 144, 143, 186, 169]
+    for n_last_tickets in range(1, len(TICKETS) + 1):
+        assert engine_ranking(5, n_last_tickets, 3) == program_ranking(5, n_last_tickets, 3)
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import tempfile
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Optional, Type, TypeVar
+
+from pydantic import BaseModel
+
+from scheduler import Provider
+
+M = TypeVar("M", bound=BaseModel)
+
+# Repeats of a run are meant to resample the model, so each repeat gets its own
+# cache entries. bench sets this to the run index for the duration of a run.
+cache_sample: ContextVar[int] = ContextVar("cache_sample", default=0)
+
+
+def _to_json(o: Any) -> Any:
+    # Conversation histories hold SDK objects (tool calls, content blocks)
+    if isinstance(o, BaseModel):
+        return o.model_dump(mode="json")
+    return str(o)
+
+
+def canonical_json(value: Any) -> str:
+    return json.dumps(
+        value,
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+        default=_to_json,
+    )
+
+
+class ResponseCache:
+    """
+    Content-addressed cache of LLM API responses.
+
+    Requests are keyed by a hash of the provider, the repeat index and the full
+    request (model, system prompt, messages, tools), so a response is only
+    reused when the conversation up to that point is byte-identical. Entries are
+    stored as `<cache_dir>/<key[:2]>/<key>.json` holding both the request and
+    the response. Without a cache_dir every request goes to the API.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, provider: Provider, request_json: str) -> str:
+        sample = cache_sample.get()
+        return hashlib.sha256(
+            f"{provider.value}\n{sample}\n{request_json}".encode()
+        ).hexdigest()
+
+    async def fetch(
+        self,
+        provider: Provider,
+        request: dict,
+        response_type: Type[M],
+        create: Callable[[], Awaitable[M]],
+    ) -> M:
+        """Return the cached response to request, or create and cache it"""
+        if self.cache_dir is None:
+            return await create()
+
+        request_json = canonical_json(request)
+        key = self.key(provider, request_json)
+        path = self.cache_dir / key[:2] / f"{key}.json"
+        if path.exists():
+            with open(path) as f:
+                entry = json.load(f)
+            self.hits += 1
+            return response_type.model_validate(entry["response"])
+
+        self.misses += 1
+        response = await create()
+        entry = {
+            "provider": provider.value,
+            "sample": cache_sample.get(),
+            "request": json.loads(request_json),
+            "response": response.model_dump(mode="json"),
+        }
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename so an interrupted run never leaves a partial entry
+        with tempfile.NamedTemporaryFile(
+            "w", dir=path.parent, suffix=".tmp", delete=False
+        ) as tmp:
+            json.dump(entry, tmp)
+        os.replace(tmp.name, path)
+        return response
+
+
+# Anthropic prompt caching: a cache_control breakpoint caches the prompt prefix
+# up to and including the block it is on (tools, then system, then messages),
+# with at most 4 breakpoints per request. Prefixes shorter than the model's
+# minimum (1024 tokens for Sonnet) are just not cached.
+EPHEMERAL_CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def cached_system_prompt(text: str) -> list[dict]:
+    """System prompt as a text block ending a cached prefix (tools and system)"""
+    return [{"type": "text", "text": text, "cache_control": EPHEMERAL_CACHE_CONTROL}]
+
+
+def cached_tools(tools: list) -> list:
+    """Tool definitions ending a cached prefix, which holds when the system prompt changes"""
+    if not tools:
+        return tools
+    return [*tools[:-1], {**tools[-1], "cache_control": EPHEMERAL_CACHE_CONTROL}]
+
+
+def with_cache_breakpoint(messages: list) -> list:
+    """
+    Copy of messages with a breakpoint on the last block of the last message,
+    so each tool loop reads the conversation so far from the cache and only
+    pays for its new turn. The history itself keeps no cache_control.
+    """
+    if not messages:
+        return messages
+    last = messages[-1]
+    content = last["content"]
+    if isinstance(content, str):
+        if not content:
+            return messages
+        content = [{"type": "text", "text": content}]
+    if not content or not isinstance(content[-1], dict):
+        return messages
+    content = [*content[:-1], {**content[-1], "cache_control": EPHEMERAL_CACHE_CONTROL}]
+    return [*messages[:-1], {**last, "content": content}]
@@ -0,0 +1,403 @@
+"""
+Local stand-in for the services the harness calls, to run bench.py (and the
+ground truth generators) offline: to measure the harness's own overhead at
+thousands of runs per minute and to reproduce concurrency bugs
+deterministically.
+
+Serves
+- POST /query: PromptQL, replaying the interactions of recorded `.history` files
+  (streamed as chunks when the request asks for it)
+- POST /execute_program: PromptQL program execution, returning a
+  prioritized_tickets artifact (or a given response)
+- POST /v1/chat/completions and /v1/messages: OpenAI and Anthropic, replaying
+  the responses of recorded `.api` files turn by turn
+- GET /stats: request counts per route
+
+with latencies sampled from configurable distributions and injected failures.
+Responses, latencies and failures are a function of the seed, the request and
+how many identical requests came before it, not of the arrival order of
+different requests.
+
+Point the harness at it with
+
+    PROMPTQL_URL=http://localhost:5558/query
+    EXECUTE_PROGRAM_URL=http://localhost:5558/execute_program
+    OPENAI_BASE_URL=http://localhost:5558/v1
+    ANTHROPIC_BASE_URL=http://localhost:5558
+
+(and any values for the API keys).
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+from run_payloads import read_payload
+
+ROUTES = ("query", "execute_program", "chat_completions", "messages")
+
+# Request fields which don't change the response
+IGNORED_FIELDS = ("promptql_api_key", "ai_primitives_llm")
+
+
+@dataclass
+class Latency:
+    """Latency distribution, parsed from `fixed:S`, `uniform:A,B`, `exp:MEAN` or `lognormal:MU,SIGMA` (seconds)"""
+
+    kind: str
+    params: List[float]
+
+    @classmethod
+    def parse(cls, spec: str) -> "Latency":
+        kind, _, params = spec.partition(":")
+        latency = cls(kind, [float(p) for p in params.split(",") if p])
+        expected = {"fixed": 1, "uniform": 2, "exp": 1, "lognormal": 2}
+        if expected.get(kind) != len(latency.params):
+            raise argparse.ArgumentTypeError(f"Invalid latency: {spec}")
+        return latency
+
+    def sample(self, rng: random.Random) -> float:
+        match self.kind:
+            case "fixed":
+                return self.params[0]
+            case "uniform":
+                return rng.uniform(*self.params)
+            case "exp":
+                return rng.expovariate(1 / self.params[0]) if self.params[0] else 0.0
+            case _:
+                return rng.lognormvariate(*self.params)
+
+
+def request_key(route: str, body: Any) -> str:
+    if isinstance(body, dict):
+        body = {k: v for k, v in body.items() if k not in IGNORED_FIELDS}
+    return hashlib.sha256(
+        f"{route}\n{json.dumps(body, sort_keys=True, default=str)}".encode()
+    ).hexdigest()
+
+
+class Recordings:
+    """Responses of recorded runs (a bench --output_dir), grouped by their first user message"""
+
+    def __init__(self):
+        # first user message -> recorded runs, each a list of PromptQL interactions
+        self.promptql: Dict[str, List[List[Dict]]] = {}
+        # first user message -> recorded runs, each a list of API response dumps
+        self.openai: Dict[str, List[List[Dict]]] = {}
+        self.anthropic: Dict[str, List[List[Dict]]] = {}
+
+    @classmethod
+    def load(cls, directories: List[str]) -> "Recordings":
+        recordings = cls()
+        for directory in directories:
+            for history_path in sorted(Path(directory).rglob("*.history")):
+                try:
+                    recordings.add(history_path)
+                except (OSError, ValueError, KeyError, IndexError) as e:
+                    print(f"Skipping {history_path}: {e}")
+        return recordings
+
+    def add(self, history_path: Path):
+        history = read_payload(history_path)
+        if not history:
+            return
+        if "assistant_actions" in history[0]:
+            query = history[0]["user_message"]["text"]
+            self.promptql.setdefault(query, []).append(history)
+            return
+
+        api_path = history_path.with_suffix(".api")
+        responses = [entry["response"] for entry in read_payload(api_path)]
+        if not responses:
+            return
+        query = first_user_message(history)
+        if responses[0].get("object") == "chat.completion":
+            self.openai.setdefault(query, []).append(responses)
+        elif responses[0].get("type") == "message":
+            self.anthropic.setdefault(query, []).append(responses)
+
+    def __len__(self) -> int:
+        return sum(
+            len(runs)
+            for recorded in (self.promptql, self.openai, self.anthropic)
+            for runs in recorded.values()
+        )
+
+
+def first_user_message(messages: List[Dict]) -> str:
+    for message in messages:
+        if message.get("role") == "user":
+            content = message["content"]
+            if isinstance(content, list):
+                return " ".join(
+                    block.get("text", "")
+                    for block in content
+                    if isinstance(block, dict)
+                )
+            return content
+    return ""
+
+
+def choose(runs_by_query: Dict[str, List], query: str, rng: random.Random):
+    """A recorded run of the query, of any query when it has none"""
+    runs = runs_by_query.get(query) or [
+        run for runs in runs_by_query.values() for run in runs
+    ]
+    return rng.choice(runs) if runs else None
+
+
+class MockServer:
+    def __init__(
+        self,
+        recordings: Recordings,
+        latencies: Dict[str, Latency],
+        failure_rate: float = 0.0,
+        failure_status: int = 429,
+        retry_after: float = 0.1,
+        seed: int = 0,
+        execute_program_response: Optional[Any] = None,
+    ):
+        self.recordings = recordings
+        self.latencies = latencies
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.retry_after = retry_after
+        self.seed = seed
+        self.execute_program_response = execute_program_response
+        self.attempts: Counter = Counter()
+        self.stats: Counter = Counter()
+        self.started_at = time.monotonic()
+
+    def rng(self, *parts) -> random.Random:
+        return random.Random(
+            hashlib.sha256(repr((self.seed, *parts)).encode()).hexdigest()
+        )
+
+    async def handle(self, route: str, request: web.Request, respond):
+        body = await request.json()
+        key = request_key(route, body)
+        attempt = self.attempts[key]
+        self.attempts[key] += 1
+        self.stats[route] += 1
+
+        rng = self.rng("request", key, attempt)
+        await asyncio.sleep(self.latencies[route].sample(rng))
+        if rng.random() < self.failure_rate:
+            self.stats[f"{route}_failures"] += 1
+            return web.json_response(
+                {"error": {"type": "mock_failure", "message": "Injected failure"}},
+                status=self.failure_status,
+                headers={"retry-after": str(self.retry_after)},
+            )
+        return await respond(request, body)
+
+    async def promptql_query(self, request: web.Request, body: Dict):
+        interactions = body.get("interactions", [])
+        query = interactions[0]["user_message"]["text"] if interactions else ""
+        recorded = choose(self.recordings.promptql, query, self.rng("run", query))
+        turn = len(interactions) - 1
+        if recorded:
+            interaction = recorded[min(turn, len(recorded) - 1)]
+            result = {
+                "assistant_actions": interaction.get("assistant_actions") or [],
+                "modified_artifacts": interaction.get("modified_artifacts") or [],
+            }
+        else:
+            result = {
+                "assistant_actions": [
+                    {"message": "Mock plan", "plan": None, "code": None},
+                    {"message": "Mock response", "plan": None, "code": None},
+                ],
+                "modified_artifacts": [],
+            }
+
+        if not body.get("stream"):
+            return web.json_response(result)
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for index, action in enumerate(result["assistant_actions"]):
+            chunk = {"type": "assistant_action_chunk", "index": index, **action}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        for artifact in result["modified_artifacts"]:
+            chunk = {"type": "artifact_update_chunk", "artifact": artifact}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await response.write_eof()
+        return response
+
+    async def execute_program(self, request: web.Request, body: Dict):
+        if self.execute_program_response is not None:
+            return web.json_response(self.execute_program_response)
+        code = body.get("code", "")
+        top_k = re.search(r"top_k_tickets=(\d+)", code)
+        n_last = re.search(r"n_last_tickets=(\d+)", code)
+        rng = self.rng("program", code)
+        ticket_ids = rng.sample(range(1, 1000), int(n_last.group(1)) if n_last else 10)
+        data = [
+            {"ticket_id": ticket_id}
+            for ticket_id in ticket_ids[: int(top_k.group(1)) if top_k else 3]
+        ]
+        return web.json_response(
+            {
+                "output": "",
+                "modified_artifacts": [
+                    {
+                        "identifier": "prioritized_tickets",
+                        "title": "Prioritized tickets",
+                        "artifact_type": "table",
+                        "data": data,
+                    }
+                ],
+            }
+        )
+
+    async def chat_completions(self, request: web.Request, body: Dict):
+        messages = body.get("messages", [])
+        query = first_user_message(messages)
+        recorded = choose(self.recordings.openai, query, self.rng("run", query))
+        turn = sum(message.get("role") == "assistant" for message in messages)
+        if recorded:
+            completion = dict(recorded[min(turn, len(recorded) - 1)])
+        else:
+            completion = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": 0,
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": "Mock response"},
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "total_tokens": 0,
+                },
+            }
+        completion["model"] = body.get("model", completion.get("model"))
+        return web.json_response(completion)
+
+    async def messages(self, request: web.Request, body: Dict):
+        messages = body.get("messages", [])
+        query = first_user_message(messages)
+        recorded = choose(self.recordings.anthropic, query, self.rng("run", query))
+        turn = sum(message.get("role") == "assistant" for message in messages)
+        if recorded:
+            message = dict(recorded[min(turn, len(recorded) - 1)])
+        else:
+            message = {
+                "id": "msg_mock",
+                "type": "message",
+                "role": "assistant",
+                "content": [{"type": "text", "text": "Mock response"}],
+                "stop_reason": "end_turn",
+                "stop_sequence": None,
+                "usage": {"input_tokens": 0, "output_tokens": 0},
+            }
+        message["model"] = body.get("model", message.get("model"))
+        return web.json_response(message)
+
+    async def stats_handler(self, request: web.Request):
+        elapsed = time.monotonic() - self.started_at
+        return web.json_response({"elapsed_s": elapsed, "requests": dict(self.stats)})
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=256 * 1024**2)
+
+        def route(name, respond):
+            return lambda request: self.handle(name, request, respond)
+
+        app.router.add_post("/query", route("query", self.promptql_query))
+        app.router.add_post(
+            "/execute_program", route("execute_program", self.execute_program)
+        )
+        app.router.add_post(
+            "/v1/chat/completions", route("chat_completions", self.chat_completions)
+        )
+        app.router.add_post("/v1/messages", route("messages", self.messages))
+        app.router.add_get("/stats", self.stats_handler)
+        return app
+
+
+def parse_latencies(specs: List[str]) -> Dict[str, Latency]:
+    """`SPEC` sets the latency of every route, `ROUTE=SPEC` of one route"""
+    latencies = {route: Latency("fixed", [0.0]) for route in ROUTES}
+    for spec in specs:
+        route, _, distribution = spec.rpartition("=")
+        if route and route not in ROUTES:
+            raise argparse.ArgumentTypeError(f"Unknown route {route}, one of {ROUTES}")
+        for name in [route] if route else ROUTES:
+            latencies[name] = Latency.parse(distribution)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5558)
+    parser.add_argument(
+        "--recordings",
+        nargs="*",
+        default=[],
+        help="bench output directories whose .history/.api files are replayed",
+    )
+    parser.add_argument(
+        "--latency",
+        action="append",
+        default=[],
+        help="Latency distribution: fixed:S, uniform:A,B, exp:MEAN or lognormal:MU,SIGMA (seconds), "
+        f"for all routes or one with ROUTE=SPEC, routes: {', '.join(ROUTES)}",
+    )
+    parser.add_argument(
+        "--failure_rate",
+        type=float,
+        default=0.0,
+        help="Fraction of requests failing with --failure_status",
+    )
+    parser.add_argument("--failure_status", type=int, default=429)
+    parser.add_argument(
+        "--retry_after",
+        type=float,
+        default=0.1,
+        help="Seconds of the retry-after header of failures",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--execute_program_response",
+        help="JSON file served as the response of every /execute_program request",
+    )
+    args = parser.parse_args()
+
+    execute_program_response = None
+    if args.execute_program_response:
+        with open(args.execute_program_response) as f:
+            execute_program_response = json.load(f)
+
+    recordings = Recordings.load(args.recordings)
+    print(f"Loaded {len(recordings)} recorded runs")
+    server = MockServer(
+        recordings,
+        parse_latencies(args.latency),
+        failure_rate=args.failure_rate,
+        failure_status=args.failure_status,
+        retry_after=args.retry_after,
+        seed=args.seed,
+        execute_program_response=execute_program_response,
+    )
+    web.run_app(server.app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
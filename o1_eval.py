@@ -1,8 +1,11 @@
+import asyncio
 import os
-import psycopg2
 from openai import AsyncOpenAI
 from openai.types.chat import (
+    ChatCompletion,
     ChatCompletionMessageParam,
+    ChatCompletionMessageToolCall,
+    ChatCompletionToolMessageParam,
     ChatCompletionToolParam,
 )
 from typing import List, Dict, Any
@@ -10,12 +13,18 @@ import logging
 import json
 from datetime import datetime, date, timedelta
 from decimal import Decimal
-import tempfile
-import subprocess
 import argparse
+import time
 import re
 
 from ai_assistant import AIAssistantResponse, ToolCallingAIAssistant
+from db_pool import ReadOnlyDatabase, close_databases, get_database
+from llm_cache import ResponseCache
+from python_sandbox import close_sandbox_pool, get_sandbox_pool
+from run_metrics import RunMetrics
+from schema_cache import get_schema_cache
+from scheduler import Provider, RateLimitScheduler
+import tracing
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -42,79 +51,56 @@ class DateTimeEncoder(json.JSONEncoder):
 
 
 class DatabaseTool:
-    _control_plane_conn = None
-    _support_tickets_conn = None
     def __init__(self, has_python_tool: bool = False):
-        # Initialize database connections
-        if DatabaseTool._control_plane_conn is None:
-            DatabaseTool._control_plane_conn = psycopg2.connect(CONTROL_PLANE_URL)
-        if DatabaseTool._support_tickets_conn is None:
-            DatabaseTool._support_tickets_conn = psycopg2.connect(SUPPORT_TICKETS_URL)
-        self.control_plane_conn = DatabaseTool._control_plane_conn
-        self.support_tickets_conn = DatabaseTool._support_tickets_conn
+        # Pools are shared by every assistant in the process
+        self.control_plane_db = get_database(CONTROL_PLANE_URL)
+        self.support_tickets_db = get_database(SUPPORT_TICKETS_URL)
         self.has_python_tool = has_python_tool
         self.schema_cache = {}
 
-    def get_database_schema(
-        self, conn: psycopg2.extensions.connection, custom_where_clause: str
+    async def get_database_schema(
+        self, db: ReadOnlyDatabase, custom_where_clause: str
     ) -> str:
         """Get database schema information"""
-        with conn.cursor() as cursor:
-            query = """
-                SELECT 
-                    table_name,
-                    column_name,
-                    data_type
-                FROM 
-                    information_schema.columns
-                WHERE 
-                    table_schema = 'public' AND {}
-                ORDER BY 
-                    table_name, ordinal_position;
-            """.format(
-                custom_where_clause
+        query = """
+            SELECT 
+                table_name,
+                column_name,
+                data_type
+            FROM 
+                information_schema.columns
+            WHERE 
+                table_schema = 'public' AND {}
+            ORDER BY 
+                table_name, ordinal_position;
+        """.format(custom_where_clause)
+
+        # Served from the schema cache while the database's schema is unchanged
+        results = await get_schema_cache().fetch(db, query)
+
+        schema = {}
+        for row in results:
+            table_name = row["table_name"]
+            if table_name not in schema:
+                schema[table_name] = {"columns": []}
+            schema[table_name]["columns"].append(
+                {"name": row["column_name"], "type": row["data_type"]}
             )
 
-            cursor.execute(query)
-            results = cursor.fetchall()
+        schema_str = "\n"
+        for table, details in schema.items():
+            schema_str += f"table {table} columns ("
+            for col in details["columns"]:
+                schema_str += f" {col['name']} {col['type']},"
+            schema_str += ")\n"
 
-            schema = {}
-            for row in results:
-                table_name, column_name, data_type = row
-                if table_name not in schema:
-                    schema[table_name] = {"columns": []}
-                schema[table_name]["columns"].append(
-                    {"name": column_name, "type": data_type}
-                )
-
-            schema_str = "\n"
-            for table, details in schema.items():
-                schema_str += f"table {table} columns ("
-                for col in details["columns"]:
-                    schema_str += f" {col['name']} {col['type']},"
-                schema_str += ")\n"
+        return schema_str.strip()
 
-            return schema_str.strip()
-
-    def execute_query(
-        self, conn: psycopg2.extensions.connection, sql: str
-    ) -> List[Dict]:
+    async def execute_query(self, db: ReadOnlyDatabase, sql: str) -> List[Dict]:
         """Execute a read-only SQL query"""
 
         logger.info("Executing SQL: \n %s", sql)
-        with conn.cursor() as cursor:
-            try:
-                cursor.execute("BEGIN TRANSACTION READ ONLY")
-                cursor.execute(sql)
-                description = cursor.description
-                assert description is not None
-                columns = [desc[0] for desc in description]
-                results = [dict(zip(columns, row)) for row in cursor.fetchall()]
-                conn.rollback()
-                return results
-            except Exception as e:
-                conn.rollback()
-                raise e
+        return await db.execute_query(sql)
 
     @property
     def tool_schemas(self) -> list[ChatCompletionToolParam]:
@@ -178,56 +164,52 @@ class DatabaseTool:
 
         return tools
 
-    def execute_python_code(self, python_code: str) -> Dict[str, str]:
-        """Execute Python code and return the results"""
+    async def execute_python_code(self, python_code: str) -> Dict[str, str]:
+        """Execute Python code in the sandbox pool and return the results"""
 
         logger.info("Executing Python: \n %s", python_code)
 
-        with tempfile.NamedTemporaryFile(mode="w", suffix=".py", delete=False) as tmp:
-            tmp.write(python_code)
-            tmp_path = tmp.name
-
-        try:
-            process = subprocess.Popen(
-                ["python3", tmp_path],
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-            )
-            stdout, stderr = process.communicate()
-            return {
-                "stdout": stdout,
-                "stderr": stderr,
-                "exitCode": str(process.returncode),
-            }
-        finally:
-            os.unlink(tmp_path)
+        result = await get_sandbox_pool().run(python_code)
+        return {
+            "stdout": result.stdout,
+            "stderr": result.stderr,
+            "exitCode": str(result.exit_code),
+        }
 
     def close(self):
-        """Close database connections"""
+        """Connection pools are shared, they are closed with db_pool.close_databases()"""
         pass
-        # self.control_plane_conn.close()
-        # self.support_tickets_conn.close()
 
 
 class AIAssistant(ToolCallingAIAssistant):
-    def __init__(self, model: str = "o1", has_python_tool: bool = False):
+    def __init__(
+        self,
+        model: str = "o1",
+        has_python_tool: bool = False,
+        scheduler: RateLimitScheduler | None = None,
+        cache: ResponseCache | None = None,
+    ):
         self.model = model
         self.tools = DatabaseTool(has_python_tool)
         self.client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-        # Cache schemas on initialization
-        self.control_plane_schema = self.tools.get_database_schema(
-            self.tools.control_plane_conn, "table_name NOT LIKE 'support%'"
-        )
-        self.support_tickets_schema = self.tools.get_database_schema(
-            self.tools.support_tickets_conn, "table_name LIKE 'support%'"
-        )
-        # Initialize conversation history with system message
-        self.init_messages: list[ChatCompletionMessageParam] = [
-            {
-                "role": "system",
-                "content": f"""You are an assistant with access to two databases with the following schemas:
+        self.scheduler = scheduler or RateLimitScheduler()
+        self.cache = cache or ResponseCache()
+        # Schemas are fetched on the first query since they need the event loop
+        self.init_messages: list[ChatCompletionMessageParam] | None = None
+
+    async def get_init_messages(self) -> list[ChatCompletionMessageParam]:
+        """Build the system message (with database schemas) once and cache it"""
+        if self.init_messages is None:
+            self.control_plane_schema = await self.tools.get_database_schema(
+                self.tools.control_plane_db, "table_name NOT LIKE 'support%'"
+            )
+            self.support_tickets_schema = await self.tools.get_database_schema(
+                self.tools.support_tickets_db, "table_name LIKE 'support%'"
+            )
+            self.init_messages = [
+                {
+                    "role": "system",
+                    "content": f"""You are an assistant with access to two databases with the following schemas:
 
 1. Control Plane Database Schema:
 {self.control_plane_schema}
@@ -238,21 +220,79 @@ class AIAssistant(ToolCallingAIAssistant):
 Additional Instructions:
 
 - Always write queries that are compatible with PostgreSQL
-- Current timestamp is: {datetime.now()}
+- Current timestamp is: {datetime.now().date()}
 - Use tools provided to get the actual answer and don't stop with the theoretical plan
 """,
-            }
-        ]
+                }
+            ]
+        return self.init_messages
+
+    async def create_completion(self, metrics: RunMetrics, **request) -> ChatCompletion:
+        """Create a chat completion (from the response cache when possible) and record it"""
+        with tracing.span(
+            f"chat {request['model']}",
+            {"gen_ai.system": "openai", "gen_ai.request.model": request["model"]},
+        ):
+            start = time.monotonic()
+            completion = await self.cache.fetch(
+                Provider.OPENAI,
+                request,
+                ChatCompletion,
+                lambda: self.scheduler.call(
+                    Provider.OPENAI,
+                    lambda: self.client.chat.completions.create(**request),
+                ),
+            )
+            metrics.record_openai(completion, time.monotonic() - start)
+        return completion
+
+    async def call_tool(
+        self,
+        metrics: RunMetrics,
+        tool_call: ChatCompletionMessageToolCall,
+        function_args: Dict[str, Any],
+    ) -> ChatCompletionToolMessageParam:
+        """Run a tool call, the tool message answering it has its result or error"""
+        function_name = tool_call.function.name
+        result = None
+        try:
+            with metrics.tool_call(function_name):
+                if function_name == "query_control_plane_data":
+                    result = await self.tools.execute_query(
+                        self.tools.control_plane_db,
+                        function_args.get("sql", ""),
+                    )
+                elif function_name == "query_support_tickets":
+                    result = await self.tools.execute_query(
+                        self.tools.support_tickets_db,
+                        function_args.get("sql", ""),
+                    )
+                elif function_name == "execute_python_program":
+                    result = await self.tools.execute_python_code(
+                        function_args.get("pythonCode", "")
+                    )
+        except Exception as e:
+            error_message = f"Error executing {function_name}: {str(e)}"
+            logger.error(error_message)
+            result = {"error": error_message}
+
+        return {
+            "role": "tool",
+            "tool_call_id": tool_call.id,
+            "name": function_name,
+            "content": json.dumps(result, indent=2, cls=DateTimeEncoder),
+        }  # type: ignore
 
     async def process_query(self, query: str, artifacts: list) -> AIAssistantResponse:
         """Process a query using available tools and GPT-4 while maintaining conversation history"""
 
         assert len(artifacts) == 0, "Don't support artifacts"
 
-        messages = self.init_messages.copy()
+        messages = (await self.get_init_messages()).copy()
         api_responses = []
         response_text = None
         is_error = False
+        metrics = RunMetrics()
 
         # Add the new user query to the conversation history
         messages.append({"role": "user", "content": query})
@@ -262,7 +302,8 @@ Additional Instructions:
         try:
             while tool_loop_count < MAX_TOOL_LOOPS:
                 print(f"\n[{datetime.now()}] waiting for OpenAI response...")
-                completion = await self.client.chat.completions.create(
+                completion = await self.create_completion(
+                    metrics,
                     model=self.model,
                     messages=messages,
                     tools=self.tools.tool_schemas,
@@ -307,44 +348,19 @@ Additional Instructions:
                 )
                 if len(tool_calls) > 0:
                     tool_loop_count += 1
-                for tool_call in tool_calls:
-                    function_name = tool_call.function.name
-                    function_args = json.loads(tool_call.function.arguments)
-
-                    result = None
-                    error_message = None
-
-                    try:
-                        if function_name == "query_control_plane_data":
-                            result = self.tools.execute_query(
-                                self.tools.control_plane_conn,
-                                function_args.get("sql", ""),
-                            )
-                        elif function_name == "query_support_tickets":
-                            result = self.tools.execute_query(
-                                self.tools.support_tickets_conn,
-                                function_args.get("sql", ""),
-                            )
-                        elif function_name == "execute_python_program":
-                            result = self.tools.execute_python_code(
-                                function_args.get("pythonCode", "")
-                            )
-                    except Exception as e:
-                        error_message = f"Error executing {function_name}: {str(e)}"
-                        logger.error(error_message)
-                        result = {"error": error_message}
-
-                    # Add tool response to conversation history
-                    messages.append(
-                        {
-                            "role": "tool",
-                            "tool_call_id": tool_call.id,
-                            "name": function_name,
-                            "content": json.dumps(
-                                result, indent=2, cls=DateTimeEncoder
-                            ),
-                        }  # type: ignore
+                # Independent calls (eg: to both databases) run concurrently, their
+                # responses are added in the order of the calls
+                function_args = [
+                    json.loads(tool_call.function.arguments) for tool_call in tool_calls
+                ]
+                tool_messages = await asyncio.gather(
+                    *(
+                        self.call_tool(metrics, tool_call, args)
+                        for tool_call, args in zip(tool_calls, function_args)
                     )
+                )
+                # Add tool responses to conversation history
+                messages.extend(tool_messages)
 
                 if tool_loop_count >= MAX_TOOL_LOOPS:
                     # Add max tool use warning to conversation history
@@ -355,8 +371,8 @@ Additional Instructions:
                         }
                     )
 
-            final_completion = await self.client.chat.completions.create(
-                model=self.model, messages=messages
+            final_completion = await self.create_completion(
+                metrics, model=self.model, messages=messages
             )
 
             # Store the final API response
@@ -380,11 +396,13 @@ Additional Instructions:
             response_text = error_message
             is_error = True
 
+        metrics.loop_count = tool_loop_count
         return AIAssistantResponse(
             response=response_text,
             is_error=is_error,
             api_responses=api_responses,
             history=messages,
+            metrics=metrics,
         )
 
     def process_response(self, response: AIAssistantResponse, tag_name: str) -> str:
@@ -448,9 +466,9 @@ async def main():
         print("\nExiting...")
     finally:
         await assistant.close()
+        await close_databases()
+        await close_sandbox_pool()
 
 
 if __name__ == "__main__":
-    import asyncio
-
     asyncio.run(main())
@@ -1,7 +1,11 @@
+import asyncio
 import os
 from openai import AsyncOpenAI
 from openai.types.chat import (
+    ChatCompletion,
     ChatCompletionMessageParam,
+    ChatCompletionMessageToolCall,
+    ChatCompletionToolMessageParam,
     ChatCompletionToolParam,
 )
 import re
@@ -10,11 +14,15 @@ import logging
 import json
 from datetime import datetime, date, timedelta
 from decimal import Decimal
-import tempfile
-import subprocess
 import argparse
+import time
 
 from ai_assistant import AIAssistantResponse, ToolCallingAIAssistant
+from llm_cache import ResponseCache
+from python_sandbox import close_sandbox_pool, get_sandbox_pool
+from run_metrics import RunMetrics
+from scheduler import Provider, RateLimitScheduler
+import tracing
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -26,31 +34,17 @@ class DatabaseTool:
     def __init__(self, has_python_tool: bool = False):
         self.has_python_tool = has_python_tool
 
-    def execute_python_code(self, python_code: str) -> Dict[str, str]:
-        """Execute Python code and return the results"""
+    async def execute_python_code(self, python_code: str) -> Dict[str, str]:
+        """Execute Python code in the sandbox pool and return the results"""
 
         logger.info("Executing Python: \n %s", python_code)
 
-        with tempfile.NamedTemporaryFile(mode="w", suffix=".py", delete=False) as tmp:
-            tmp.write(python_code)
-            tmp_path = tmp.name
-
-        try:
-            process = subprocess.Popen(
-                ["python3", tmp_path],
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-            )
-            stdout, stderr = process.communicate()
-            return {
-                "stdout": stdout,
-                "stderr": stderr,
-                "exitCode": str(process.returncode),
-            }
-        finally:
-            os.unlink(tmp_path)
+        result = await get_sandbox_pool().run(python_code)
+        return {
+            "stdout": result.stdout,
+            "stderr": result.stderr,
+            "exitCode": str(result.exit_code),
+        }
 
     @property
     def tool_schemas(self) -> list[ChatCompletionToolParam]:
@@ -81,24 +75,79 @@ class DatabaseTool:
 
 
 class AIAssistant(ToolCallingAIAssistant):
-    def __init__(self, model, has_python_tool):
+    def __init__(
+        self,
+        model,
+        has_python_tool,
+        scheduler: RateLimitScheduler | None = None,
+        cache: ResponseCache | None = None,
+    ):
         self.model = model
         self.has_python_tool = has_python_tool
         self.python_tool = DatabaseTool(has_python_tool=has_python_tool)
         self.client = AsyncOpenAI(
             api_key=os.environ.get("OPENAI_API_KEY"), timeout=3600
         )
+        self.scheduler = scheduler or RateLimitScheduler()
+        self.cache = cache or ResponseCache()
         # Initialize conversation history with system message
         self.init_messages: list[ChatCompletionMessageParam] = [
             {"role": "system", "content": "TODO"}
         ]
 
+    async def create_completion(self, metrics: RunMetrics, **request) -> ChatCompletion:
+        """Create a chat completion (from the response cache when possible) and record it"""
+        with tracing.span(
+            f"chat {request['model']}",
+            {"gen_ai.system": "openai", "gen_ai.request.model": request["model"]},
+        ):
+            start = time.monotonic()
+            completion = await self.cache.fetch(
+                Provider.OPENAI,
+                request,
+                ChatCompletion,
+                lambda: self.scheduler.call(
+                    Provider.OPENAI,
+                    lambda: self.client.chat.completions.create(**request),
+                ),
+            )
+            metrics.record_openai(completion, time.monotonic() - start)
+        return completion
+
+    async def call_tool(
+        self,
+        metrics: RunMetrics,
+        tool_call: ChatCompletionMessageToolCall,
+        function_args: Dict[str, Any],
+    ) -> ChatCompletionToolMessageParam:
+        """Run a tool call, the tool message answering it has its result or error"""
+        function_name = tool_call.function.name
+        result = None
+        try:
+            with metrics.tool_call(function_name):
+                if function_name == "execute_python_program":
+                    result = await self.python_tool.execute_python_code(
+                        function_args.get("pythonCode", ""),
+                    )
+        except Exception as e:
+            error_message = f"Error executing {function_name}: {str(e)}"
+            logger.error(error_message)
+            result = {"error": error_message}
+
+        return {
+            "role": "tool",
+            "tool_call_id": tool_call.id,
+            "name": function_name,
+            "content": json.dumps(result, indent=2),
+        }  # type: ignore
+
     async def process_query(self, query: str, artifacts: list) -> AIAssistantResponse:
         """Process a query using available tools and GPT-4 while maintaining conversation history"""
         messages = self.init_messages.copy()
         api_responses = []
         response_text = None
         is_error = False
+        metrics = RunMetrics()
         # Add the new user query to the conversation history
         messages.append({"role": "user", "content": query})
         tool_loop_count = 0
@@ -108,15 +157,16 @@ class AIAssistant(ToolCallingAIAssistant):
             while tool_loop_count < MAX_TOOL_LOOPS:
                 print(f"\n[{datetime.now()}] waiting for OpenAI response...")
                 if self.has_python_tool:
-                    completion = await self.client.chat.completions.create(
+                    completion = await self.create_completion(
+                        metrics,
                         model=self.model,
                         messages=messages,
                         tools=self.python_tool.tool_schemas,
                         tool_choice="auto",
                     )
                 else:
-                    completion = await self.client.chat.completions.create(
-                        model=self.model, messages=messages
+                    completion = await self.create_completion(
+                        metrics, model=self.model, messages=messages
                     )
 
                 print(f"[{datetime.now()}] received OpenAI response...\n")
@@ -158,33 +208,19 @@ class AIAssistant(ToolCallingAIAssistant):
                 )
                 if len(tool_calls) > 0:
                     tool_loop_count += 1
-                for tool_call in tool_calls:
-
-                    function_name = tool_call.function.name
-                    function_args = json.loads(tool_call.function.arguments)
-
-                    result = None
-                    error_message = None
-
-                    try:
-                        if function_name == "execute_python_program":
-                            result = self.python_tool.execute_python_code(
-                                function_args.get("pythonCode", ""),
-                            )
-                    except Exception as e:
-                        error_message = f"Error executing {function_name}: {str(e)}"
-                        logger.error(error_message)
-                        result = {"error": error_message}
-
-                    # Add tool response to conversation history
-                    messages.append(
-                        {
-                            "role": "tool",
-                            "tool_call_id": tool_call.id,
-                            "name": function_name,
-                            "content": json.dumps(result, indent=2),
-                        }  # type: ignore
+                # Independent calls (eg: to both databases) run concurrently, their
+                # responses are added in the order of the calls
+                function_args = [
+                    json.loads(tool_call.function.arguments) for tool_call in tool_calls
+                ]
+                tool_messages = await asyncio.gather(
+                    *(
+                        self.call_tool(metrics, tool_call, args)
+                        for tool_call, args in zip(tool_calls, function_args)
                     )
+                )
+                # Add tool responses to conversation history
+                messages.extend(tool_messages)
 
                 if tool_loop_count >= MAX_TOOL_LOOPS:
                     # Add max tool use warning to conversation history
@@ -195,8 +231,8 @@ class AIAssistant(ToolCallingAIAssistant):
                         }
                     )
 
-            final_completion = await self.client.chat.completions.create(
-                model=self.model, messages=messages
+            final_completion = await self.create_completion(
+                metrics, model=self.model, messages=messages
             )
 
             # Store the final API response
@@ -220,11 +256,13 @@ class AIAssistant(ToolCallingAIAssistant):
             response_text = error_message
             is_error = True
 
+        metrics.loop_count = tool_loop_count
         return AIAssistantResponse(
             response=response_text,
             is_error=is_error,
             api_responses=api_responses,
             history=messages,
+            metrics=metrics,
         )
 
     def process_response(self, response: AIAssistantResponse, tag_name: str) -> str:
@@ -308,9 +346,9 @@ async def main():
 
     except KeyboardInterrupt:
         print("\nExiting...")
+    finally:
+        await close_sandbox_pool()
 
 
 if __name__ == "__main__":
-    import asyncio
-
     asyncio.run(main())
@@ -8,8 +8,12 @@ from decimal import Decimal
 import tempfile
 import subprocess
 import argparse
+import time
 import httpx
 from ai_assistant import AIAssistantResponse, AIAssistantBase
+from run_metrics import RunMetrics
+from scheduler import Provider, RateLimitScheduler, RETRYABLE_STATUS_CODES
+import tracing
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -17,11 +21,49 @@ logger = logging.getLogger(__name__)
 
 # Database Configuration
 DDN_SQL_URL = "https://destined-buck-3238.ddn.hasura.app/v1/sql"
+# PROMPTQL_URL = "https://api.promptql.pro.hasura.io/query"
+PROMPTQL_URL = os.environ.get("PROMPTQL_URL", "http://localhost:5558/query")
+
+# Fields of an assistant action, streamed as string deltas
+ASSISTANT_ACTION_FIELDS = ("message", "plan", "code", "code_output", "code_error")
+
+
+def apply_stream_chunk(result: Dict[str, Any], chunk: Dict[str, Any]):
+    """Merge a streamed chunk into result, which has the shape of a non-streaming response"""
+    match chunk.get("type"):
+        case "assistant_action_chunk":
+            actions = result["assistant_actions"]
+            index = chunk.get("index", 0)
+            while len(actions) <= index:
+                actions.append({field: None for field in ASSISTANT_ACTION_FIELDS})
+            action = actions[index]
+            for field in ASSISTANT_ACTION_FIELDS:
+                if chunk.get(field) is not None:
+                    action[field] = (action[field] or "") + chunk[field]
+        case "artifact_update_chunk":
+            artifact = chunk["artifact"]
+            artifacts = result["modified_artifacts"]
+            for i, existing in enumerate(artifacts):
+                if existing.get("identifier") == artifact.get("identifier"):
+                    artifacts[i] = artifact
+                    break
+            else:
+                artifacts.append(artifact)
+        case "error_chunk":
+            raise Exception(f"PromptQL error: {chunk.get('error')}")
 
 
 class AIAssistant(AIAssistantBase):
     def __init__(
-        self, provider: str, model: Optional[str], initial_artifacts: List[Dict] = []
+        self,
+        provider: str,
+        model: Optional[str],
+        initial_artifacts: List[Dict] = [],
+        scheduler: Optional[RateLimitScheduler] = None,
+        stream: bool = False,
+        http2: bool = False,
+        max_connections: int = 10,
+        max_keepalive_connections: int = 5,
     ):
         self.provider = provider
         self.model = model
@@ -34,6 +76,18 @@ class AIAssistant(AIAssistantBase):
                 self.ai_primitives_model = "gpt-4o"
 
         self.initial_artifacts = initial_artifacts
+        self.scheduler = scheduler or RateLimitScheduler()
+        self.stream = stream
+        # One client for the lifetime of the assistant so connections are reused.
+        # http2 needs the h2 package (pip install 'httpx[http2]')
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(5, read=600),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+            ),
+            http2=http2,
+        )
 
     def _prepare_payload(self) -> Dict[str, Any]:
         """Prepare the API payload from the conversation history"""
@@ -57,9 +111,71 @@ class AIAssistant(AIAssistantBase):
             "system_instructions": "- use cmp_to_key if writing a sorting algorithm focused on pairwise comparison",
             "timezone": "America/Los_Angeles",
             "interactions": [],
-            "stream": False,
+            "stream": self.stream,
         }
 
+    async def _post(self, payload: Dict[str, Any]) -> httpx.Response:
+        response = await self.client.post(
+            PROMPTQL_URL,
+            json=payload,
+            # Links the engine's spans to the current run
+            headers=tracing.inject_headers(
+                {
+                    "Content-Type": "application/json",
+                }
+            ),
+        )
+        if response.status_code in RETRYABLE_STATUS_CODES:
+            # Let the scheduler back off and retry throttled requests
+            response.raise_for_status()
+        return response
+
+    async def _open_stream(self, payload: Dict[str, Any]) -> httpx.Response:
+        request = self.client.build_request(
+            "POST", PROMPTQL_URL, json=payload, headers=tracing.inject_headers({})
+        )
+        response = await self.client.send(request, stream=True)
+        if response.is_error:
+            await response.aread()
+            await response.aclose()
+            response.raise_for_status()
+        return response
+
+    async def _stream_query(
+        self, payload: Dict[str, Any], result: Dict[str, Any]
+    ) -> Optional[float]:
+        """
+        Run a streaming query, merging the chunks into result as they arrive.
+        Returns the seconds until the first assistant action started streaming.
+        """
+        start_time = time.monotonic()
+        time_to_first_action = None
+
+        async def open_stream() -> httpx.Response:
+            # Time from sending the request, not from waiting on the scheduler
+            nonlocal start_time
+            start_time = time.monotonic()
+            return await self._open_stream(payload)
+
+        response = await self.scheduler.call(Provider.PROMPTQL, open_stream)
+        try:
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                chunk = json.loads(line[len("data:") :])
+                if (
+                    time_to_first_action is None
+                    and chunk.get("type") == "assistant_action_chunk"
+                ):
+                    time_to_first_action = time.monotonic() - start_time
+                    print(
+                        f"[{datetime.now()}] first PromptQL action after {time_to_first_action:.1f}s"
+                    )
+                apply_stream_chunk(result, chunk)
+        finally:
+            await response.aclose()
+        return time_to_first_action
+
     async def process_query(
         self, query: str, artifacts: list = []
     ) -> AIAssistantResponse:
@@ -68,6 +184,8 @@ class AIAssistant(AIAssistantBase):
         response_text = ""
         api_responses = []
         is_error = False
+        # PromptQL runs the LLM and tools server side, each request is timed as a whole
+        metrics = RunMetrics()
         try:
             interaction = {}
 
@@ -82,55 +200,75 @@ class AIAssistant(AIAssistantBase):
             good_response = False
             while len(payload["interactions"]) <= 2 and not good_response:
 
-                # Make the API call
-                async with httpx.AsyncClient(
-                    timeout=httpx.Timeout(5, read=600)
-                ) as client:
-                    try:
-                        print(f"\n[{datetime.now()}] waiting for PromptQL response...")
-                        response = await client.post(
-                            # "https://api.promptql.pro.hasura.io/query",
-                            "http://localhost:5558/query",
-                            json=payload,
-                            headers={
-                                "Content-Type": "application/json",
-                            },
-                        )
-                        print(f"\n[{datetime.now()}] received PromptQL response...")
-                        api_responses.append(response.text)
-                        response.raise_for_status()
+                try:
+                    print(f"\n[{datetime.now()}] waiting for PromptQL response...")
+                    metrics.loop_count += 1
+                    with metrics.tool_call("promptql_query", "promptql") as span:
+                        if self.stream:
+                            # Partial actions and artifacts stay recorded if the stream fails
+                            result = {"assistant_actions": [], "modified_artifacts": []}
+                            api_responses.append(result)
+                            time_to_first_action = await self._stream_query(
+                                payload, result
+                            )
+                            api_responses[-1] = {
+                                **result,
+                                "time_to_first_action": time_to_first_action,
+                            }
+                        else:
+                            response = await self.scheduler.call(
+                                Provider.PROMPTQL, lambda: self._post(payload)
+                            )
+                            api_responses.append(response.text)
+                            response.raise_for_status()
 
-                        result = response.json()
-                        api_responses[0] = (
-                            result  # Replace API response with deserialized JSON
+                            result = response.json()
+                            api_responses[-1] = (
+                                result  # Replace API response with deserialized JSON
+                            )
+                        span.set_attributes(
+                            {
+                                "promptql.stream": self.stream,
+                                "promptql.assistant_actions": len(
+                                    result.get("assistant_actions") or []
+                                ),
+                                "promptql.modified_artifacts": len(
+                                    result.get("modified_artifacts") or []
+                                ),
+                            }
                         )
-                        interaction.update(result)
-
-                        # Extract the assistant's response
-                        assistant_actions = result.get("assistant_actions")
-                        assistant_message = assistant_actions[-1]["message"]
-
-                        # Add the assistant's response to conversation history
-                        history.append(interaction)
-
-                        response_text = assistant_message
-                        if len(assistant_actions) > 1:
-                            good_response = True
-                        else:
-                            # In case PromptQL only proposes a plan but doesn't execute it
-                            payload["interactions"].append(
-                                {"user_message": {"text": "okay, do it"}}
+                        if self.stream and time_to_first_action is not None:
+                            span.set_attribute(
+                                "promptql.time_to_first_action_s", time_to_first_action
                             )
+                    print(f"\n[{datetime.now()}] received PromptQL response...")
+                    interaction.update(result)
+
+                    # Extract the assistant's response
+                    assistant_actions = result.get("assistant_actions")
+                    assistant_message = assistant_actions[-1]["message"]
+
+                    # Add the assistant's response to conversation history
+                    history.append(interaction)
+
+                    response_text = assistant_message
+                    if len(assistant_actions) > 1:
+                        good_response = True
+                    else:
+                        # In case PromptQL only proposes a plan but doesn't execute it
+                        payload["interactions"].append(
+                            {"user_message": {"text": "okay, do it"}}
+                        )
 
-                    except httpx.HTTPStatusError as e:
-                        error_msg = f"API request failed with status {e.response.status_code} body {e.response.text}"
-                        logger.error(error_msg)
-                        logger.error(f"Response: {e.response.text}")
-                        raise Exception(error_msg)
-                    except httpx.RequestError as e:
-                        error_msg = f"API request failed: {repr(e)}"
-                        logger.error(error_msg)
-                        raise Exception(error_msg)
+                except httpx.HTTPStatusError as e:
+                    error_msg = f"API request failed with status {e.response.status_code} body {e.response.text}"
+                    logger.error(error_msg)
+                    logger.error(f"Response: {e.response.text}")
+                    raise Exception(error_msg)
+                except httpx.RequestError as e:
+                    error_msg = f"API request failed: {repr(e)}"
+                    logger.error(error_msg)
+                    raise Exception(error_msg)
 
         except Exception as e:
             error_message = f"Error processing query: {str(e)}"
@@ -143,8 +281,12 @@ class AIAssistant(AIAssistantBase):
             is_error=is_error,
             api_responses=api_responses,
             history=history,
+            metrics=metrics,
         )
 
+    async def close(self):
+        await self.client.aclose()
+
     def process_response(
         self, response: AIAssistantResponse, artifact_name: str, key: str | None = None
     ):
@@ -182,9 +324,16 @@ async def main():
         default=None,
         help="Model name (eg: o1, o3-mini)",
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Use the streaming API",
+    )
     args = parser.parse_args()
 
-    assistant = AIAssistant(provider=args.provider, model=args.model)
+    assistant = AIAssistant(
+        provider=args.provider, model=args.model, stream=args.stream
+    )
 
     try:
         while True:
@@ -220,6 +369,8 @@ async def main():
 
     except KeyboardInterrupt:
         print("\nExiting...")
+    finally:
+        await assistant.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,312 @@
+"""
+Pool of warm Python worker processes for the execute_python_program tool.
+
+Each worker is this file run as a script. It imports the common data libraries
+once and then, for every program it receives over stdin, forks a fresh child
+which runs the program with its own memory limit, timeout and output cap. The
+child starts from the worker's already-initialized interpreter, so tool calls
+skip interpreter startup and the pandas/numpy imports, and no state leaks from
+one program to the next.
+"""
+
+import asyncio
+import json
+import os
+import sys
+from dataclasses import dataclass
+from typing import List, Optional
+
+import tracing
+
+PRELOAD_MODULES = ("numpy", "pandas")
+
+DEFAULT_POOL_SIZE = min(4, os.cpu_count() or 1)
+DEFAULT_TIMEOUT = 120.0  # Seconds
+DEFAULT_MAX_OUTPUT_BYTES = 1024 * 1024  # Per stream
+DEFAULT_MEMORY_LIMIT_BYTES = 4 * 1024**3
+
+# Extra time the pool gives a worker to report back before it is considered hung
+WORKER_GRACE_PERIOD = 10.0
+
+
+@dataclass
+class SandboxResult:
+    stdout: str
+    stderr: str
+    exit_code: int
+    timed_out: bool = False
+    truncated: bool = False
+
+
+class SandboxWorker:
+    """Parent-side handle to one warm worker process"""
+
+    def __init__(self, process: asyncio.subprocess.Process):
+        self.process = process
+
+    @classmethod
+    async def start(cls, max_output_bytes: int) -> "SandboxWorker":
+        env = {
+            **os.environ,
+            # Keep BLAS from spawning a thread pool per worker before fork
+            "OMP_NUM_THREADS": "1",
+            "OPENBLAS_NUM_THREADS": "1",
+            "MKL_NUM_THREADS": "1",
+        }
+        process = await asyncio.create_subprocess_exec(
+            sys.executable,
+            os.path.abspath(__file__),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            env=env,
+            # Results carry up to two capped streams, JSON escaped
+            limit=16 * max_output_bytes + 1024 * 1024,
+        )
+        return cls(process)
+
+    @property
+    def is_alive(self) -> bool:
+        return self.process.returncode is None
+
+    async def run(self, job: dict, timeout: float) -> SandboxResult:
+        assert self.process.stdin is not None and self.process.stdout is not None
+        self.process.stdin.write((json.dumps(job) + "\n").encode())
+        await self.process.stdin.drain()
+        line = await asyncio.wait_for(self.process.stdout.readline(), timeout)
+        if not line:
+            raise RuntimeError("Python sandbox worker exited unexpectedly")
+        return SandboxResult(**json.loads(line))
+
+    async def kill(self):
+        if self.is_alive:
+            self.process.kill()
+        await self.process.wait()
+
+
+class PythonSandboxPool:
+    """Runs Python programs on a bounded pool of warm worker processes"""
+
+    def __init__(
+        self,
+        size: int = DEFAULT_POOL_SIZE,
+        timeout: float = DEFAULT_TIMEOUT,
+        max_output_bytes: int = DEFAULT_MAX_OUTPUT_BYTES,
+        memory_limit_bytes: int = DEFAULT_MEMORY_LIMIT_BYTES,
+    ):
+        self.size = size
+        self.timeout = timeout
+        self.max_output_bytes = max_output_bytes
+        self.memory_limit_bytes = memory_limit_bytes
+        self.slots = asyncio.Semaphore(size)
+        self.idle_workers: List[SandboxWorker] = []
+
+    async def _acquire_worker(self) -> SandboxWorker:
+        while self.idle_workers:
+            worker = self.idle_workers.pop()
+            if worker.is_alive:
+                return worker
+        return await SandboxWorker.start(self.max_output_bytes)
+
+    async def run(self, code: str, timeout: Optional[float] = None) -> SandboxResult:
+        """Run a program in a fresh sandboxed process and capture its output"""
+        timeout = timeout or self.timeout
+        job = {
+            "code": code,
+            "timeout": timeout,
+            "max_output_bytes": self.max_output_bytes,
+            "memory_limit_bytes": self.memory_limit_bytes,
+        }
+        with tracing.span("python sandbox run", {"code.length": len(code)}) as span:
+            async with self.slots:
+                worker = await self._acquire_worker()
+                try:
+                    result = await worker.run(job, timeout + WORKER_GRACE_PERIOD)
+                except BaseException:
+                    # The worker may be mid-job or hung; replace it on the next run
+                    await worker.kill()
+                    raise
+                self.idle_workers.append(worker)
+            span.set_attributes(
+                {
+                    "process.exit_code": result.exit_code,
+                    "sandbox.timed_out": result.timed_out,
+                    "sandbox.truncated": result.truncated,
+                }
+            )
+            return result
+
+    async def close(self):
+        workers, self.idle_workers = self.idle_workers, []
+        for worker in workers:
+            await worker.kill()
+
+
+_pool: Optional[PythonSandboxPool] = None
+
+
+def get_sandbox_pool() -> PythonSandboxPool:
+    """Return the sandbox pool shared by every assistant in the process"""
+    global _pool
+    if _pool is None:
+        _pool = PythonSandboxPool()
+    return _pool
+
+
+async def close_sandbox_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+# Worker side, runs in the sandbox worker process
+
+
+def _run_program(code: str, memory_limit_bytes: int) -> int:
+    """Run code as the __main__ script and return its exit code, like `python3 file.py`"""
+    import linecache
+    import resource
+    import traceback
+
+    try:
+        resource.setrlimit(
+            resource.RLIMIT_AS, (memory_limit_bytes, memory_limit_bytes)
+        )
+    except (ValueError, OSError):
+        pass  # Not enforceable on this platform
+
+    filename = "program.py"
+    # Lets tracebacks show the offending source lines
+    linecache.cache[filename] = (len(code), None, code.splitlines(True), filename)
+    sys.argv = [filename]
+    program_globals = {"__name__": "__main__", "__file__": filename}
+    try:
+        exec(compile(code, filename, "exec"), program_globals)
+        return 0
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        if isinstance(e.code, int):
+            return e.code
+        print(e.code, file=sys.stderr)
+        return 1
+    except BaseException as e:
+        # Drop this function's frame so the traceback starts in the program
+        traceback.print_exception(type(e), e, e.__traceback__.tb_next)  # type: ignore
+        return 1
+
+
+def _collect_output(
+    pid: int, out_fd: int, err_fd: int, timeout: float, max_output_bytes: int
+) -> dict:
+    import selectors
+    import signal
+    import time
+
+    deadline = time.monotonic() + timeout
+    buffers = {out_fd: bytearray(), err_fd: bytearray()}
+    truncated = False
+    timed_out = False
+
+    selector = selectors.DefaultSelector()
+    for fd in buffers:
+        selector.register(fd, selectors.EVENT_READ)
+    while selector.get_map():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            timed_out = True
+            break
+        for key, _ in selector.select(remaining):
+            chunk = os.read(key.fd, 65536)
+            if not chunk:
+                selector.unregister(key.fd)
+                continue
+            buffer = buffers[key.fd]
+            space = max_output_bytes - len(buffer)
+            if len(chunk) > space:
+                truncated = True
+            # Keep draining past the cap so the program doesn't block on a full pipe
+            buffer += chunk[: max(space, 0)]
+    selector.close()
+
+    if timed_out:
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    _, status = os.waitpid(pid, 0)
+    for fd in buffers:
+        os.close(fd)
+
+    stdout = buffers[out_fd].decode("utf-8", errors="replace")
+    stderr = buffers[err_fd].decode("utf-8", errors="replace")
+    notes = []
+    if truncated:
+        notes.append(f"Output truncated to {max_output_bytes} bytes per stream")
+    if timed_out:
+        notes.append(f"Execution timed out after {timeout:g} seconds")
+    stderr = "\n".join([stderr.rstrip("\n")] + notes if stderr else notes)
+    return {
+        "stdout": stdout,
+        "stderr": stderr,
+        "exit_code": os.waitstatus_to_exitcode(status),
+        "timed_out": timed_out,
+        "truncated": truncated,
+    }
+
+
+def _run_job(job: dict, protocol_fd: int) -> dict:
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        exit_code = 1
+        try:
+            os.setpgid(0, 0)  # So a timeout also kills anything the program spawned
+            os.close(protocol_fd)
+            os.close(out_r)
+            os.close(err_r)
+            devnull = os.open(os.devnull, os.O_RDONLY)
+            os.dup2(devnull, 0)
+            os.dup2(out_w, 1)
+            os.dup2(err_w, 2)
+            sys.stdin = open(os.devnull)
+            exit_code = _run_program(job["code"], job["memory_limit_bytes"])
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(exit_code)
+    os.close(out_w)
+    os.close(err_w)
+    return _collect_output(
+        pid, out_r, err_r, job["timeout"], job["max_output_bytes"]
+    )
+
+
+def worker_main():
+    import importlib
+
+    for module in PRELOAD_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+
+    # stdout is the channel back to the pool, keep stray prints off it
+    protocol_fd = os.dup(1)
+    protocol = os.fdopen(protocol_fd, "w", encoding="utf-8")
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+
+    for line in sys.stdin:
+        result = _run_job(json.loads(line), protocol_fd)
+        protocol.write(json.dumps(result) + "\n")
+        protocol.flush()
+
+
+if __name__ == "__main__":
+    worker_main()
@@ -1,22 +1,18 @@
 import requests
+import numpy as np
 from datetime import datetime, date, timedelta
-from collections import defaultdict
-import itertools
-
-# [GraphQL templates remain the same...]
-GRAPHQL_REQUEST_TEMPLATE = """
-query FindUsersWithEqualErrorRates($_gte: date = "{start_date}", $_lte: date = "{end_date}") {{
-  projects(
-    where: {{error_rate_dailies: {{_and: [{{error_rate: {{_is_null: false}}}}, {{date: {{_gte: $_gte, _lte: $_lte}}}}]}}}}
+
+ERROR_RATES_TEMPLATE = """
+query AllErrorRates {{
+  error_rate_daily(
+    where: {{_and: [{{error_rate: {{_is_null: false}}}}, {{date: {{_gte: "{start_date}", _lte: "{end_date}"}}}}]}}
   ) {{
+    project_id
+    date
+    error_rate
+  }}
+  projects {{
     id
-    error_rate_dailies_aggregate(
-      filter_input: {{where: {{date: {{_gte: $_gte, _lte: $_lte}}}}}}
-    ) {{
-      error_rate {{
-        avg
-      }}
-    }}
     user {{
       email
     }}
@@ -24,157 +20,224 @@ query FindUsersWithEqualErrorRates($_gte: date = "{start_date}", $_lte: date = "
 }}
 """
 
-SUPPORT_TICKETS_TEMPLATE = """
-query GetUserTickets {{
+BATCH_SUPPORT_TICKETS_TEMPLATE = """
+query GetUsersTickets($emails: [String!]!) {
   support_ticket(
-    where: {{support_user_by_requester_id: {{email: {{_eq: "{email}"}}}}}}
-  ) {{
+    where: {support_user_by_requester_id: {email: {_in: $emails}}}
+  ) {
     id
-  }}
-}}
+    support_user_by_requester_id {
+      email
+    }
+  }
+}
 """
 
 GRAPHQL_URL = "http://localhost:3280/graphql"
 
-def get_support_tickets(email):
-    query = SUPPORT_TICKETS_TEMPLATE.format(email=email)
+WINDOW_SIZES = [1, 2, 3, 4, 5, 7, 10, 14, 21, 30]
+
+def get_support_tickets_batch(emails):
+    """Ticket ids of several users (by email) in one request"""
+    tickets = {email: {'count': 0, 'ticket_ids': []} for email in emails}
+    if not tickets:
+        return tickets
     response = requests.post(
         GRAPHQL_URL,
-        json={'query': query}
+        json={'query': BATCH_SUPPORT_TICKETS_TEMPLATE, 'variables': {'emails': sorted(tickets)}}
     )
     if response.status_code == 200:
         data = response.json()
-        tickets = data.get('data', {}).get('support_ticket', [])
-        return {
-            'count': len(tickets),
-            'ticket_ids': [ticket['id'] for ticket in tickets]
-        }
-    return {'count': 0, 'ticket_ids': []}
-
-def find_highest_equal_error_rates(start_date, end_date, min_projects=2, verbose=False):
+        for ticket in data.get('data', {}).get('support_ticket', []):
+            email = ticket['support_user_by_requester_id']['email']
+            tickets[email]['count'] += 1
+            tickets[email]['ticket_ids'].append(ticket['id'])
+    return tickets
+
+class ErrorRateMatrix:
     """
-    Find projects with equal error rates that are also the highest error rates
-    within the given date range.
+    Daily error rates of every project as a (projects x days) matrix, with
+    cumulative sums over days so the average of any date range of every
+    project is two subtractions.
+
+    Rates are summed as integers (x100) when they all have two decimals, so
+    windows with the same rates get exactly the same averages.
     """
-    current_query = GRAPHQL_REQUEST_TEMPLATE.format(
-        start_date=start_date,
-        end_date=end_date
-    )
-    
-    response = requests.post(
-        GRAPHQL_URL,
-        json={'query': current_query}
-    )
-    
-    if response.status_code != 200:
-        print(f"Request failed with status code: {response.status_code}")
-        print(f"Error message: {response.text}")
-        return None
-
-    projects = response.json()
-    all_projects = projects["data"]["projects"]
-    
-    if verbose:
-        print(f"Found {len(all_projects)} projects in this period")
-    
-    if not all_projects:
-        return {}
-
-    # Group projects by their error rates
-    error_rates = defaultdict(list)
-    highest_rate = 0
-    for project in all_projects:
-        error_rate = project["error_rate_dailies_aggregate"]["error_rate"]["avg"]
-        if error_rate is not None and error_rate > 0:  # Exclude zero error rates
-            # Round to 6 decimal places to handle floating point comparison
-            rounded_rate = round(error_rate, 6)
-            error_rates[rounded_rate].append({
-                "id": project["id"],
-                "email": project["user"]["email"],
-                "error_rate": error_rate
-            })
-            highest_rate = max(highest_rate, rounded_rate)
-    
-    if verbose:
-        # print(f"Found {len(error_rates)} unique non-zero error rates")
-        if error_rates:
-            # Print top 3 error rates and their project counts
-            sorted_rates = sorted(error_rates.items(), key=lambda x: x[0], reverse=True)[:3]
-            for rate, projects in sorted_rates:
-                print(f"  Rate {rate}: {len(projects)} projects")
+    def __init__(self, first_day, num_days, project_ids, emails, rows):
+        self.first_day = first_day
+        self.project_ids = project_ids
+        self.emails = emails
+        index = {project_id: i for i, project_id in enumerate(project_ids)}
+
+        rates = np.array([rate for _, _, rate in rows], dtype=np.float64)
+        projects = np.array([index[project_id] for project_id, _, _ in rows], dtype=np.int64)
+        days = np.array([(day - first_day).days for _, day, _ in rows], dtype=np.int64)
+
+        scaled = np.round(rates * 100)
+        self.scale = 100.0 if np.array_equal(scaled / 100, rates) else 1.0
+        values = scaled if self.scale == 100.0 else rates
+
+        sums = np.zeros((len(project_ids), num_days))
+        counts = np.zeros((len(project_ids), num_days), dtype=np.int64)
+        np.add.at(sums, (projects, days), values)
+        np.add.at(counts, (projects, days), 1)
+        # Column d holds the totals of the days before d
+        self.sum_prefix = np.concatenate([np.zeros((len(project_ids), 1)), np.cumsum(sums, axis=1)], axis=1)
+        self.count_prefix = np.concatenate(
+            [np.zeros((len(project_ids), 1), dtype=np.int64), np.cumsum(counts, axis=1)], axis=1
+        )
+
+    @classmethod
+    def load(cls, start_date, end_date):
+        """Fetch the error rates between two dates (inclusive) in one request"""
+        query = ERROR_RATES_TEMPLATE.format(
+            start_date=start_date.strftime("%Y-%m-%d"),
+            end_date=end_date.strftime("%Y-%m-%d")
+        )
+        response = requests.post(GRAPHQL_URL, json={'query': query})
+        response.raise_for_status()
+        data = response.json()["data"]
+
+        emails = {project["id"]: project["user"]["email"] for project in data["projects"]}
+        rows = [
+            (row["project_id"], date.fromisoformat(row["date"]), row["error_rate"])
+            for row in data["error_rate_daily"]
+        ]
+        project_ids = sorted({project_id for project_id, _, _ in rows})
+        first_day = start_date.date() if isinstance(start_date, datetime) else start_date
+        last_day = end_date.date() if isinstance(end_date, datetime) else end_date
+        return cls(
+            first_day,
+            (last_day - first_day).days + 1,
+            project_ids,
+            [emails.get(project_id) for project_id in project_ids],
+            rows,
+        )
+
+    def window_averages(self, starts, ends):
+        """
+        Average error rate of every project over each [start, end] day range
+        (day offsets, inclusive), as a (projects x windows) matrix with NaN for
+        projects without rates in the range.
+        """
+        sums = self.sum_prefix[:, ends + 1] - self.sum_prefix[:, starts]
+        counts = self.count_prefix[:, ends + 1] - self.count_prefix[:, starts]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(counts > 0, sums / counts / self.scale, np.nan)
+
+def highest_equal_error_rate_windows(averages, min_projects=2):
+    """
+    Of the windows (columns of rounded window averages), those where at least
+    min_projects projects share the highest (non-zero) average error rate, as
+    (window index, rate, project indices) in window order
+    """
+    # Zero error rates don't count, like missing ones
+    averages = np.where(averages > 0, averages, np.nan)
+    has_rates = ~np.all(np.isnan(averages), axis=0)
+    highest = np.full(averages.shape[1], np.nan)
+    highest[has_rates] = np.nanmax(averages[:, has_rates], axis=0)
+    tied = averages == highest
+    matches = np.flatnonzero(tied.sum(axis=0) >= min_projects)
+    return [
+        (int(w), float(highest[w]), np.flatnonzero(tied[:, w]).tolist())
+        for w in matches
+    ]
+
+def print_window_summary(averages):
+    """Number of projects with error rates in a window, and the project counts of its top 3 non-zero rates"""
+    print(f"Found {np.count_nonzero(~np.isnan(averages))} projects in this period")
+    if np.all(np.isnan(averages)):
+        return
+    rates, counts = np.unique(averages[averages > 0], return_counts=True)
+    if len(rates):
+        for rate, num_projects in list(zip(rates, counts))[::-1][:3]:
+            print(f"  Rate {float(rate)}: {num_projects} projects")
+    else:
+        print("  No non-zero error rates found in this period")
+
+def window_bounds(window_size, start_date, end_year, search_backwards):
+    """(start, end) dates of the windows of a size, in the order they are searched"""
+    bounds = []
+    current_start = start_date
+    while (current_start <= end_year) if not search_backwards else (current_start >= end_year):
+        current_end = current_start + timedelta(days=window_size) if not search_backwards else current_start
+        current_start_actual = current_start if not search_backwards else current_start - timedelta(days=window_size)
+
+        # Ensure dates are within year bounds
+        if not search_backwards:
+            current_end = min(current_end, end_year)
         else:
-            print("  No non-zero error rates found in this period")
+            current_start_actual = max(current_start_actual, end_year)
+        bounds.append((current_start_actual, current_end))
 
-    # Only return groups with the highest error rate AND at least min_projects
-    if highest_rate in error_rates and len(error_rates[highest_rate]) >= min_projects:
-        return {highest_rate: error_rates[highest_rate]}
-    return {}
+        # Move to next period
+        if not search_backwards:
+            current_start += timedelta(days=1)
+        else:
+            current_start -= timedelta(days=1)
+    return bounds
 
 def search_until_match(start_year=2024, search_backwards=False, verbose=False, count=0):
     """
     Search through different date ranges until finding matching highest error rates.
+
+    The error rates of the year are fetched once and every window of every size
+    is averaged locally. The tickets of the users matching in windows of a size
+    are fetched in one request.
     """
-    window_sizes = [1, 2, 3, 4, 5, 7, 10, 14, 21, 30]
-    
     if search_backwards:
         start_date = datetime(start_year, 12, 31)
         end_year = datetime(start_year, 1, 1)
     else:
         start_date = datetime(start_year, 1, 1)
         end_year = datetime(start_year, 12, 31)
-    
-    for window_size in window_sizes:
+
+    matrix = ErrorRateMatrix.load(min(start_date, end_year), max(start_date, end_year))
+
+    for window_size in WINDOW_SIZES:
         print(f"\nTrying {window_size}-day windows...")
-        
-        step_size = 1  # Move just one day at a time
-        current_start = start_date
-        
-        while (current_start <= end_year) if not search_backwards else (current_start >= end_year):
-            current_end = current_start + timedelta(days=window_size) if not search_backwards else current_start
-            current_start_actual = current_start if not search_backwards else current_start - timedelta(days=window_size)
-            
-            # Ensure dates are within year bounds
-            if not search_backwards:
-                current_end = min(current_end, end_year)
-            else:
-                current_start_actual = max(current_start_actual, end_year)
-            
-            start_str = current_start_actual.strftime("%Y-%m-%d")
-            end_str = current_end.strftime("%Y-%m-%d")
-            
+        bounds = window_bounds(window_size, start_date, end_year, search_backwards)
+        starts = np.array([(s - start_date if not search_backwards else s - end_year).days for s, _ in bounds])
+        ends = np.array([(e - start_date if not search_backwards else e - end_year).days for _, e in bounds])
+        averages = np.round(matrix.window_averages(starts, ends), 6)
+
+        # The search stops at the third match
+        matches = highest_equal_error_rate_windows(averages, min_projects=2)[:max(3 - count, 1)]
+        ticket_info = get_support_tickets_batch(
+            {matrix.emails[p] for _, _, projects in matches for p in projects}
+        )
+        matched = {w: (error_rate, projects) for w, error_rate, projects in matches}
+
+        for w, (window_start, window_end) in enumerate(bounds):
+            start_str = window_start.strftime("%Y-%m-%d")
+            end_str = window_end.strftime("%Y-%m-%d")
+
             if verbose:
                 print(f"\nAnalyzing period: {start_str} to {end_str}")
-            
-            matching_groups = find_highest_equal_error_rates(start_str, end_str, min_projects=2, verbose=verbose)
-            
-            if matching_groups:
+                print_window_summary(averages[:, w])
+
+            if w in matched:
                 count += 1
+                error_rate, projects = matched[w]
                 print("\n=== FOUND MATCHING HIGHEST ERROR RATES ===")
                 print(f"Time window: {window_size} days")
                 print(f"Period: {start_str} to {end_str}")
-                
-                for error_rate, projects in matching_groups.items():
-                    print(f"\nHighest error rate: {error_rate}")
-                    print(f"Number of projects with this rate: {len(projects)}")
-                    print("\nProjects:")
-                    for project in projects:
-                        print(f"\nProject ID: {project['id']}")
-                        print(f"User email: {project['email']}")
-                        
-                        ticket_info = get_support_tickets(project['email'])
-                        print(f"Support tickets:")
-                        print(f"  Count: {ticket_info['count']}")
-                        print(f"  Ticket IDs: {ticket_info['ticket_ids']}")
-                    print("=" * 50)
+
+                print(f"\nHighest error rate: {error_rate}")
+                print(f"Number of projects with this rate: {len(projects)}")
+                print("\nProjects:")
+                for p in projects:
+                    email = matrix.emails[p]
+                    print(f"\nProject ID: {matrix.project_ids[p]}")
+                    print(f"User email: {email}")
+
+                    print(f"Support tickets:")
+                    print(f"  Count: {ticket_info[email]['count']}")
+                    print(f"  Ticket IDs: {ticket_info[email]['ticket_ids']}")
+                print("=" * 50)
                 if count > 2:
                     return True
-            
-            # Move to next period
-            if not search_backwards:
-                current_start += timedelta(days=step_size)
-            else:
-                current_start -= timedelta(days=step_size)
-    
+
     print("\nNo matching highest error rates found after trying all date ranges.")
     return False
 
@@ -4,6 +4,8 @@ from typing import List, Dict
 from colorama import init, Fore, Style
 import argparse
 
+from run_payloads import read_payload
+
 # Initialize colorama for cross-platform colored output
 init()
 
@@ -104,8 +106,7 @@ def main():
     args = parser.parse_args()
 
     try:
-        with open(args.file, 'r') as f:
-            data = json.load(f)
+        data = read_payload(args.file)
         
         renderer = ChatRenderer(args.width)
         print(renderer.render_conversation(data))
@@ -0,0 +1,189 @@
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterator, Optional
+
+import tracing
+
+# Kind of each tool the assistants offer, PromptQL requests are recorded as "promptql"
+TOOL_KINDS = {
+    "query_control_plane_data": "sql",
+    "query_support_tickets": "sql",
+    "execute_python_program": "python",
+}
+
+# USD per million tokens: (input, cached input, cache write, output), matched
+# by the longest model name prefix. Reasoning tokens are billed as output.
+PRICES = {
+    "claude-3-5-sonnet": (3.00, 0.30, 3.75, 15.00),
+    "claude-3-7-sonnet": (3.00, 0.30, 3.75, 15.00),
+    "o1": (15.00, 7.50, 15.00, 60.00),
+    "o3-mini": (1.10, 0.55, 1.10, 4.40),
+    "gpt-4o": (2.50, 1.25, 2.50, 10.00),
+}
+
+
+def model_prices(model: str) -> Optional[tuple[float, float, float, float]]:
+    matches = [prefix for prefix in PRICES if model.startswith(prefix)]
+    return PRICES[max(matches, key=len)] if matches else None
+
+
+@dataclass
+class LLMCall:
+    model: str
+    latency_s: float
+    # All prompt tokens, including the cached and cache write ones
+    input_tokens: int
+    output_tokens: int
+    cached_tokens: int = 0
+    cache_write_tokens: int = 0
+    reasoning_tokens: int = 0
+
+    def span_attributes(self) -> Dict[str, Any]:
+        return {
+            "gen_ai.response.model": self.model,
+            "gen_ai.usage.input_tokens": self.input_tokens,
+            "gen_ai.usage.output_tokens": self.output_tokens,
+            "gen_ai.usage.cached_tokens": self.cached_tokens,
+            "gen_ai.usage.cache_write_tokens": self.cache_write_tokens,
+            "gen_ai.usage.reasoning_tokens": self.reasoning_tokens,
+        }
+
+    def cost(self) -> Optional[float]:
+        prices = model_prices(self.model)
+        if prices is None:
+            return None
+        input_price, cached_price, cache_write_price, output_price = prices
+        uncached_tokens = (
+            self.input_tokens - self.cached_tokens - self.cache_write_tokens
+        )
+        return (
+            uncached_tokens * input_price
+            + self.cached_tokens * cached_price
+            + self.cache_write_tokens * cache_write_price
+            + self.output_tokens * output_price
+        ) / 1_000_000
+
+
+@dataclass
+class ToolCall:
+    name: str
+    kind: str
+    latency_s: float
+    is_error: bool = False
+
+
+@dataclass
+class RunMetrics:
+    """
+    Token usage and latencies of the API calls and tool calls of one run.
+    Latencies are wall-clock seconds as seen by the assistant, so LLM calls
+    include waiting on the rate limit scheduler and are ~0 for responses served
+    from the response cache.
+
+    Tool calls are traced as spans, and recorded LLM calls add their token
+    usage to the current span.
+    """
+
+    llm_calls: list[LLMCall] = field(default_factory=list)
+    tool_calls: list[ToolCall] = field(default_factory=list)
+    loop_count: int = 0
+
+    def _record_llm_call(self, call: LLMCall):
+        self.llm_calls.append(call)
+        tracing.set_attributes(call.span_attributes())
+
+    def record_anthropic(self, message: Any, latency_s: float):
+        """Record an Anthropic Message"""
+        usage = message.usage
+        cached_tokens = getattr(usage, "cache_read_input_tokens", None) or 0
+        cache_write_tokens = getattr(usage, "cache_creation_input_tokens", None) or 0
+        self._record_llm_call(
+            LLMCall(
+                model=message.model,
+                latency_s=latency_s,
+                # input_tokens excludes the tokens read from or written to the cache
+                input_tokens=usage.input_tokens + cached_tokens + cache_write_tokens,
+                output_tokens=usage.output_tokens,
+                cached_tokens=cached_tokens,
+                cache_write_tokens=cache_write_tokens,
+            )
+        )
+
+    def record_openai(self, completion: Any, latency_s: float):
+        """Record an OpenAI ChatCompletion"""
+        usage = completion.usage
+        prompt_details = getattr(usage, "prompt_tokens_details", None)
+        completion_details = getattr(usage, "completion_tokens_details", None)
+        self._record_llm_call(
+            LLMCall(
+                model=completion.model,
+                latency_s=latency_s,
+                input_tokens=usage.prompt_tokens if usage else 0,
+                output_tokens=usage.completion_tokens if usage else 0,
+                cached_tokens=getattr(prompt_details, "cached_tokens", None) or 0,
+                reasoning_tokens=getattr(completion_details, "reasoning_tokens", None)
+                or 0,
+            )
+        )
+
+    @contextmanager
+    def tool_call(self, name: str, kind: Optional[str] = None) -> Iterator[Any]:
+        """Time and trace the body as a call of a tool, which failed if the body raises"""
+        kind = kind or TOOL_KINDS.get(name, "other")
+        start = time.monotonic()
+        is_error = True
+        try:
+            with tracing.span(
+                f"tool {name}", {"tool.name": name, "tool.kind": kind}
+            ) as span:
+                yield span
+            is_error = False
+        finally:
+            self.tool_calls.append(
+                ToolCall(
+                    name=name,
+                    kind=kind,
+                    latency_s=time.monotonic() - start,
+                    is_error=is_error,
+                )
+            )
+
+    def summary(self) -> Dict[str, Any]:
+        """Totals of the run, the columns evaluation.py adds to its CSV"""
+        costs = [call.cost() for call in self.llm_calls]
+        return {
+            "llm_calls": len(self.llm_calls),
+            "tool_calls": len(self.tool_calls),
+            "tool_errors": sum(call.is_error for call in self.tool_calls),
+            "loop_count": self.loop_count,
+            "input_tokens": sum(call.input_tokens for call in self.llm_calls),
+            "output_tokens": sum(call.output_tokens for call in self.llm_calls),
+            "cached_tokens": sum(call.cached_tokens for call in self.llm_calls),
+            "cache_write_tokens": sum(
+                call.cache_write_tokens for call in self.llm_calls
+            ),
+            "reasoning_tokens": sum(call.reasoning_tokens for call in self.llm_calls),
+            "llm_latency_s": sum(call.latency_s for call in self.llm_calls),
+            "sql_latency_s": self.tool_latency("sql"),
+            "python_latency_s": self.tool_latency("python"),
+            "promptql_latency_s": self.tool_latency("promptql"),
+            # Unknown when a model has no price
+            "estimated_cost_usd": (
+                sum(costs) if all(cost is not None for cost in costs) else None  # type: ignore
+            ),
+        }
+
+    def tool_latency(self, kind: str) -> float:
+        return sum(call.latency_s for call in self.tool_calls if call.kind == kind)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"summary": self.summary(), **asdict(self)}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RunMetrics":
+        return cls(
+            llm_calls=[LLMCall(**call) for call in data.get("llm_calls", [])],
+            tool_calls=[ToolCall(**call) for call in data.get("tool_calls", [])],
+            loop_count=data.get("loop_count", 0),
+        )
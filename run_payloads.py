@@ -0,0 +1,193 @@
+"""
+Compact storage of the .history and .api payloads of runs.
+
+Runs of a configuration repeat the same large values: system prompts with
+database schemas, prompts, tool schemas and artifacts. A payload is written
+with those values (strings of at least MIN_SHARED_SIZE characters, and the
+SHARED_FIELDS lists) replaced by references to content-addressed blobs,
+stored once in a `.blobs` directory next to the run files, and the rest
+compressed with zstd (`pip install zstandard`, or Python 3.14+) or zlib.
+
+read_payload rehydrates the original structure, and also reads the plain
+JSON payloads written before (or with bench.py --pretty_runs), telling the
+formats apart by their magic bytes.
+
+    python run_payloads.py cat output/claude-3-7-sonnet/tool_calling/retrieval/last_10_run_1.history
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import zlib
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Optional, Union
+
+try:
+    from compression import zstd  # Python 3.14+
+
+    def zstd_compress(data: bytes) -> bytes:
+        return zstd.compress(data)
+
+    def zstd_decompress(data: bytes) -> bytes:
+        return zstd.decompress(data)
+
+except ImportError:
+    try:
+        import zstandard
+
+        def zstd_compress(data: bytes) -> bytes:
+            return zstandard.ZstdCompressor().compress(data)
+
+        def zstd_decompress(data: bytes) -> bytes:
+            return zstandard.ZstdDecompressor().decompress(data)
+
+    except ImportError:
+        zstd_compress = None  # type: ignore
+        zstd_decompress = None  # type: ignore
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# zlib streams start with 0x78 (deflate with a 32K window), which no JSON does
+ZLIB_MAGIC = b"\x78"
+
+BLOBS_DIR = ".blobs"
+# Strings this long are stored as blobs
+MIN_SHARED_SIZE = 1024
+# Values stored as blobs whatever their size
+SHARED_FIELDS = ("tools", "artifacts", "modified_artifacts")
+BLOB_REF = "$blob"
+
+
+def compress(data: bytes) -> bytes:
+    """zstd when available, zlib otherwise"""
+    if zstd_compress is not None:
+        return zstd_compress(data)
+    return zlib.compress(data)
+
+
+def decompress(data: bytes) -> bytes:
+    """Decompress zstd or zlib data, return anything else unchanged"""
+    if data.startswith(ZSTD_MAGIC):
+        if zstd_decompress is None:
+            raise RuntimeError(
+                "Reading zstd compressed runs needs `pip install zstandard` (or Python 3.14+)"
+            )
+        return zstd_decompress(data)
+    if data.startswith(ZLIB_MAGIC):
+        return zlib.decompress(data)
+    return data
+
+
+class BlobStore:
+    """Content-addressed values, as compressed JSON in `<directory>/<key>`"""
+
+    def __init__(self, directory: Union[str, Path]):
+        self.directory = Path(directory)
+        # Keys known to be stored, to skip writing (and checking) them again
+        self.stored: set[str] = set()
+
+    def path(self, key: str) -> Path:
+        # Flat: a directory of runs only has a few dozen distinct blobs
+        return self.directory / key
+
+    def put(self, data: bytes) -> str:
+        key = hashlib.sha256(data).hexdigest()
+        if key in self.stored:
+            return key
+        path = self.path(key)
+        if not path.exists():
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # Write then rename so concurrent writers and interrupted runs never
+            # leave a partial blob
+            with tempfile.NamedTemporaryFile(
+                "wb", dir=path.parent, suffix=".tmp", delete=False
+            ) as tmp:
+                tmp.write(compress(data))
+            os.replace(tmp.name, path)
+        self.stored.add(key)
+        return key
+
+    def get(self, key: str) -> Any:
+        # Parsed for each run so runs don't share (mutable) values
+        return json.loads(_read_blob(str(self.path(key))))
+
+
+@lru_cache(maxsize=1024)
+def _read_blob(path: str) -> bytes:
+    # Blobs are immutable and shared by many runs
+    with open(path, "rb") as f:
+        return decompress(f.read())
+
+
+@lru_cache(maxsize=None)
+def blob_store(directory: Path) -> BlobStore:
+    """The blob store of a directory, shared by the payloads written in this process"""
+    return BlobStore(directory)
+
+
+def dehydrate(value: Any, blobs: BlobStore, field: Optional[str] = None) -> Any:
+    """value with its shared values replaced by references to blobs"""
+    if isinstance(value, str):
+        if len(value) < MIN_SHARED_SIZE:
+            return value
+    elif isinstance(value, dict):
+        if field not in SHARED_FIELDS:
+            return {key: dehydrate(item, blobs, key) for key, item in value.items()}
+    elif isinstance(value, list):
+        if field not in SHARED_FIELDS:
+            return [dehydrate(item, blobs) for item in value]
+    else:
+        return value
+    data = json.dumps(value, default=str, separators=(",", ":")).encode()
+    return {BLOB_REF: blobs.put(data)}
+
+
+def rehydrate(value: Any, blobs: BlobStore) -> Any:
+    """Inverse of dehydrate"""
+    if isinstance(value, dict):
+        if len(value) == 1 and BLOB_REF in value:
+            return blobs.get(value[BLOB_REF])
+        return {key: rehydrate(item, blobs) for key, item in value.items()}
+    if isinstance(value, list):
+        return [rehydrate(item, blobs) for item in value]
+    return value
+
+
+def write_payload(path: Union[str, Path], value: Any):
+    """Write a run payload (eg: .history or .api), sharing blobs with the runs of its directory"""
+    path = Path(path)
+    blobs = blob_store(path.parent / BLOBS_DIR)
+    data = json.dumps(dehydrate(value, blobs), default=str, separators=(",", ":"))
+    with open(path, "wb") as f:
+        f.write(compress(data.encode()))
+
+
+def read_payload(path: Union[str, Path]) -> Any:
+    """Read a run payload written by write_payload, or as plain JSON"""
+    path = Path(path)
+    with open(path, "rb") as f:
+        data = f.read()
+    if data.startswith(ZSTD_MAGIC) or data.startswith(ZLIB_MAGIC):
+        return rehydrate(
+            json.loads(decompress(data)), blob_store(path.parent / BLOBS_DIR)
+        )
+    return json.loads(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read run payloads")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    cat = subparsers.add_parser("cat", help="Print payloads as JSON")
+    cat.add_argument("files", nargs="+", help=".history or .api files")
+    args = parser.parse_args()
+
+    for file in args.files:
+        json.dump(read_payload(file), sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""
+Single-file store of benchmark runs, an alternative to the per-run
+.result/.err/.history/.api/.time/.metrics.json files under --output_dir.
+
+Runs live in one SQLite table: what identifies them (model, system, oracle,
+variation, run), timestamps and the summary of their metrics in typed
+columns, the processed result as text, and the history, API responses and
+full metrics as compressed JSON. Scoring queries the table instead of
+walking directories; export writes the runs back to the file layout for the
+tools reading it.
+
+    python run_store.py export --run_store runs.sqlite --output_dir output
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+from ai_assistant import AIAssistantResponse
+from run_payloads import compress, decompress
+
+SCHEMA_VERSION = 1
+
+# Columns of RunMetrics.summary with their SQLite types
+SUMMARY_COLUMNS = {
+    "llm_calls": "INTEGER",
+    "tool_calls": "INTEGER",
+    "tool_errors": "INTEGER",
+    "loop_count": "INTEGER",
+    "input_tokens": "INTEGER",
+    "output_tokens": "INTEGER",
+    "cached_tokens": "INTEGER",
+    "cache_write_tokens": "INTEGER",
+    "reasoning_tokens": "INTEGER",
+    "llm_latency_s": "REAL",
+    "sql_latency_s": "REAL",
+    "python_latency_s": "REAL",
+    "promptql_latency_s": "REAL",
+    "estimated_cost_usd": "REAL",
+}
+
+KEY_COLUMNS = ["model", "system", "oracle", "variation", "run"]
+BLOB_COLUMNS = ["history", "api_responses", "metrics"]
+
+CREATE_TABLE = f"""
+    CREATE TABLE IF NOT EXISTS runs (
+        model TEXT NOT NULL,
+        system TEXT NOT NULL,
+        oracle INTEGER NOT NULL,
+        variation TEXT NOT NULL,
+        run INTEGER NOT NULL,
+        started_at TEXT NOT NULL,
+        saved_at TEXT NOT NULL,
+        elapsed_s REAL NOT NULL,
+        is_error INTEGER NOT NULL,
+        -- The processed response, or the error of failed runs
+        result TEXT NOT NULL,
+        {"".join(f"{column} {type}, " for column, type in SUMMARY_COLUMNS.items())}
+        -- zstd (or zlib) compressed JSON
+        history BLOB NOT NULL,
+        api_responses BLOB NOT NULL,
+        metrics BLOB,
+        PRIMARY KEY (model, system, oracle, variation, run)
+    )
+"""
+
+
+@dataclass(frozen=True)
+class RunConfiguration:
+    """The benchmark configuration a run belongs to"""
+
+    model: str
+    system: str
+    oracle: bool
+
+    @property
+    def run_dir(self) -> str:
+        """Directory of the configuration's runs in the file layout, relative to --output_dir"""
+        return f"{self.model}/{self.system}/{'oracle' if self.oracle else 'retrieval'}"
+
+
+def compress_json(value: Any) -> bytes:
+    return compress(json.dumps(value, default=str).encode())
+
+
+def decompress_json(data: Optional[bytes]) -> Any:
+    return None if data is None else json.loads(decompress(data))
+
+
+def run_path(row: Dict[str, Any]) -> str:
+    """Path of a run in the file layout, without extension, relative to --output_dir"""
+    configuration = RunConfiguration(row["model"], row["system"], bool(row["oracle"]))
+    return f"{configuration.run_dir}/{row['variation']}_run_{row['run']}"
+
+
+class RunStore:
+    """Runs of any number of configurations in a SQLite file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        # Readers (eg: evaluation.py) don't block a running benchmark
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, SCHEMA_VERSION):
+            raise ValueError(
+                f"{path} has version {version} of the run store schema, expected {SCHEMA_VERSION}"
+            )
+        with self.conn:
+            self.conn.execute(CREATE_TABLE)
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def save_run(
+        self,
+        configuration: RunConfiguration,
+        variation: str,
+        run: int,
+        response: AIAssistantResponse,
+        result: str,
+        elapsed_time: timedelta,
+        started_at: Optional[datetime] = None,
+    ):
+        """Save a run, replacing any previous run with the same key"""
+        saved_at = datetime.now()
+        metrics = response.metrics.to_dict() if response.metrics is not None else None
+        summary = metrics["summary"] if metrics is not None else {}
+        row = {
+            "model": configuration.model,
+            "system": configuration.system,
+            "oracle": configuration.oracle,
+            "variation": variation,
+            "run": run,
+            "started_at": (started_at or saved_at - elapsed_time).isoformat(),
+            "saved_at": saved_at.isoformat(),
+            "elapsed_s": elapsed_time.total_seconds(),
+            "is_error": response.is_error,
+            "result": result,
+            **{column: summary.get(column) for column in SUMMARY_COLUMNS},
+            "history": compress_json(response.history),
+            "api_responses": compress_json(response.api_responses),
+            "metrics": compress_json(metrics) if metrics is not None else None,
+        }
+        with self.conn:
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO runs ({', '.join(row)}) "
+                f"VALUES ({', '.join('?' * len(row))})",
+                list(row.values()),
+            )
+
+    def has_result(
+        self, configuration: RunConfiguration, variation: str, run: int
+    ) -> bool:
+        """Whether the run completed without error, like an existing .result file"""
+        return (
+            self.conn.execute(
+                "SELECT 1 FROM runs WHERE model = ? AND system = ? AND oracle = ?"
+                " AND variation = ? AND run = ? AND NOT is_error",
+                (
+                    configuration.model,
+                    configuration.system,
+                    configuration.oracle,
+                    variation,
+                    run,
+                ),
+            ).fetchone()
+            is not None
+        )
+
+    def runs(
+        self, with_blobs: bool = False, include_errors: bool = True
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Rows of the stored runs, ordered by key. Blobs are only read (and
+        decompressed) with_blobs.
+        """
+        columns = (
+            "*"
+            if with_blobs
+            else ", ".join(
+                column for column in self.columns() if column not in BLOB_COLUMNS
+            )
+        )
+        where = "" if include_errors else " WHERE NOT is_error"
+        cursor = self.conn.execute(
+            f"SELECT {columns} FROM runs{where} ORDER BY {', '.join(KEY_COLUMNS)}"
+        )
+        for row in cursor:
+            run = dict(row)
+            run["oracle"] = bool(run["oracle"])
+            run["is_error"] = bool(run["is_error"])
+            if with_blobs:
+                for column in BLOB_COLUMNS:
+                    run[column] = decompress_json(run[column])
+            yield run
+
+    def columns(self) -> List[str]:
+        return [row["name"] for row in self.conn.execute("PRAGMA table_info(runs)")]
+
+    def export(self, output_dir: str) -> int:
+        """Write every run to output_dir in the layout bench.py writes without a store"""
+        count = 0
+        for row in self.runs(with_blobs=True):
+            base_filename = os.path.join(output_dir, run_path(row))
+            os.makedirs(os.path.dirname(base_filename), exist_ok=True)
+            with open(
+                (
+                    f"{base_filename}.err"
+                    if row["is_error"]
+                    else f"{base_filename}.result"
+                ),
+                "w",
+            ) as f:
+                f.write(row["result"])
+            with open(f"{base_filename}.history", "w") as f:
+                json.dump(row["history"], f, indent=2, default=str)
+            with open(f"{base_filename}.api", "w") as f:
+                json.dump(row["api_responses"], f, indent=2, default=str)
+            with open(f"{base_filename}.time", "w") as f:
+                f.write(f"{timedelta(seconds=row['elapsed_s'])}")
+            with open(f"{base_filename}.metrics.json", "w") as f:
+                json.dump(
+                    {"elapsed_s": row["elapsed_s"], **(row["metrics"] or {})},
+                    f,
+                    indent=2,
+                )
+            count += 1
+        return count
+
+    def close(self):
+        self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage a run store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export = subparsers.add_parser(
+        "export", help="Write the stored runs as .result/.history/... files"
+    )
+    export.add_argument("--run_store", help="Run store file", required=True)
+    export.add_argument("--output_dir", help="Output directory path", required=True)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.run_store):
+        parser.error(f"{args.run_store} does not exist")
+    store = RunStore(args.run_store)
+    try:
+        count = store.export(args.output_dir)
+        print(f"Exported {count} runs to {args.output_dir}")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
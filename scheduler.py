@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from enum import Enum
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 429 = rate limited, 529 = Anthropic "overloaded", 503 = upstream unavailable
+RETRYABLE_STATUS_CODES = {429, 503, 529}
+
+
+class Provider(str, Enum):
+    ANTHROPIC = "anthropic"
+    OPENAI = "openai"
+    PROMPTQL = "promptql"
+
+
+@dataclass
+class ProviderLimits:
+    max_concurrency: int  # Runs in flight against the provider
+    requests_per_minute: float  # Sustained request rate
+    burst: int = 1  # Requests that may be sent back to back
+    max_retries: int = 6
+    initial_backoff: float = 5.0  # Seconds
+    max_backoff: float = 120.0  # Seconds
+
+
+DEFAULT_LIMITS: Dict[Provider, ProviderLimits] = {
+    Provider.ANTHROPIC: ProviderLimits(max_concurrency=4, requests_per_minute=40),
+    Provider.OPENAI: ProviderLimits(max_concurrency=4, requests_per_minute=40),
+    Provider.PROMPTQL: ProviderLimits(max_concurrency=3, requests_per_minute=20),
+}
+
+
+class TokenBucket:
+    """Async token bucket which can also be paused after the provider pushes back"""
+
+    def __init__(self, rate_per_second: float, capacity: int):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens for the given duration and drain the bucket"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+        self.updated_at = self.paused_until
+
+
+def get_status_code(e: BaseException) -> Optional[int]:
+    """Status code of an SDK (openai/anthropic) or httpx error, if it has one"""
+    status_code = getattr(e, "status_code", None)
+    if status_code is None:
+        response = getattr(e, "response", None)
+        status_code = getattr(response, "status_code", None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def get_retry_after(e: BaseException) -> Optional[float]:
+    """Seconds the provider asked us to wait, taken from the retry-after header"""
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimitScheduler:
+    """
+    Per-provider scheduler for benchmark runs.
+
+    Runs hold a concurrency slot for their provider while they execute, and every
+    request they make draws from the provider's token bucket. When a provider
+    answers with 429/overloaded, the whole provider is paused for the backoff
+    period so that sibling runs don't pile onto the throttled API.
+    """
+
+    def __init__(self, limits: Optional[Dict[Provider, ProviderLimits]] = None):
+        self.limits = {**DEFAULT_LIMITS, **(limits or {})}
+        self.semaphores = {
+            provider: asyncio.Semaphore(limit.max_concurrency)
+            for provider, limit in self.limits.items()
+        }
+        self.buckets = {
+            provider: TokenBucket(limit.requests_per_minute / 60, limit.burst)
+            for provider, limit in self.limits.items()
+        }
+
+    @asynccontextmanager
+    async def run_slot(self, provider: Provider):
+        """Hold one of the provider's concurrency slots for the duration of a run"""
+        async with self.semaphores[provider]:
+            yield
+
+    async def call(self, provider: Provider, request: Callable[[], Awaitable[T]]) -> T:
+        """Send a request once the provider has capacity, backing off on throttling"""
+        limits = self.limits[provider]
+        bucket = self.buckets[provider]
+        attempt = 0
+        while True:
+            await bucket.acquire()
+            try:
+                return await request()
+            except Exception as e:
+                status_code = get_status_code(e)
+                if status_code not in RETRYABLE_STATUS_CODES:
+                    raise
+                if attempt >= limits.max_retries:
+                    raise
+                backoff = get_retry_after(e) or min(
+                    limits.max_backoff, limits.initial_backoff * 2**attempt
+                )
+                backoff *= random.uniform(1, 1.25)  # Jitter so runs don't retry in lockstep
+                attempt += 1
+                logger.warning(
+                    "%s returned %s, backing off %.1fs (attempt %d/%d)",
+                    provider.value,
+                    status_code,
+                    backoff,
+                    attempt,
+                    limits.max_retries,
+                )
+                bucket.pause(backoff)
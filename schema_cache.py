@@ -0,0 +1,136 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from db_pool import ReadOnlyDatabase
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "promptql-cs-benchmark",
+    "schemas",
+)
+
+# Hash of the catalog state the information_schema queries depend on: the
+# tables, views and columns of the public schema with their types. Reading
+# pg_catalog directly is much cheaper than the information_schema views.
+FINGERPRINT_QUERY = """
+    SELECT md5(coalesce(string_agg(
+        c.relname || '.' || a.attnum || '.' || a.attname || ':' || a.atttypid || ':' || a.atttypmod,
+        ',' ORDER BY c.relname, a.attnum
+    ), '')) AS fingerprint
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_attribute a ON a.attrelid = c.oid
+    WHERE n.nspname = 'public'
+        AND c.relkind IN ('r', 'v', 'm', 'f', 'p')
+        AND a.attnum > 0
+        AND NOT a.attisdropped
+"""
+
+
+class SchemaCache:
+    """
+    Cache of the results of schema introspection queries, to build the system
+    prompts of assistants without querying information_schema each time.
+
+    Results are kept in memory for the lifetime of the process (assistants
+    sharing a database only query it once) and on disk as
+    `<cache_dir>/<key[:2]>/<key>.json`, keyed by the database URL, the query and
+    a fingerprint of the database's catalog, so a changed schema is a cache
+    miss. Without a cache_dir results are only kept in memory.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = DEFAULT_CACHE_DIR):
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.results: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        self.locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, url: str, fingerprint: str, query: str) -> str:
+        return hashlib.sha256(f"{url}\n{fingerprint}\n{query}".encode()).hexdigest()
+
+    def _read(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        if self.cache_dir is None:
+            return None
+        path = self.cache_dir / key[:2] / f"{key}.json"
+        if not path.exists():
+            return None
+        with open(path) as f:
+            return json.load(f)["rows"]
+
+    def _write(self, key: str, query: str, rows: List[Dict[str, Any]]):
+        if self.cache_dir is None:
+            return
+        path = self.cache_dir / key[:2] / f"{key}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename so an interrupted run never leaves a partial entry
+        with tempfile.NamedTemporaryFile(
+            "w", dir=path.parent, suffix=".tmp", delete=False
+        ) as tmp:
+            json.dump({"query": query, "rows": rows}, tmp, default=str)
+        os.replace(tmp.name, path)
+
+    async def fetch(self, db: ReadOnlyDatabase, query: str) -> List[Dict[str, Any]]:
+        """Rows of an introspection query, from the cache while the schema is unchanged"""
+        memory_key = (db.url, query)
+        if memory_key in self.results:
+            return self.results[memory_key]
+        # Assistants starting together wait for the first one's query
+        async with self.locks.setdefault(memory_key, asyncio.Lock()):
+            if memory_key not in self.results:
+                fingerprint = (await db.execute_query(FINGERPRINT_QUERY))[0][
+                    "fingerprint"
+                ]
+                key = self.key(db.url, fingerprint, query)
+                rows = self._read(key)
+                if rows is None:
+                    self.misses += 1
+                    rows = await db.execute_query(query)
+                    self._write(key, query, rows)
+                else:
+                    self.hits += 1
+                self.results[memory_key] = rows
+        return self.results[memory_key]
+
+    def fetch_sync(self, conn, query: str) -> List[Dict[str, Any]]:
+        """fetch for a psycopg2 connection"""
+        memory_key = (conn.dsn, query)
+        if memory_key not in self.results:
+            with conn.cursor() as cursor:
+                cursor.execute(FINGERPRINT_QUERY)
+                fingerprint = cursor.fetchone()[0]
+                key = self.key(conn.dsn, fingerprint, query)
+                rows = self._read(key)
+                if rows is None:
+                    self.misses += 1
+                    cursor.execute(query)
+                    columns = [desc[0] for desc in cursor.description]
+                    rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+                    self._write(key, query, rows)
+                else:
+                    self.hits += 1
+            conn.rollback()
+            self.results[memory_key] = rows
+        return self.results[memory_key]
+
+
+_schema_cache: Optional[SchemaCache] = None
+
+
+def configure_schema_cache(cache_dir: Optional[str] = DEFAULT_CACHE_DIR):
+    """Set the directory of the schema cache shared by every assistant in the process"""
+    global _schema_cache
+    _schema_cache = SchemaCache(cache_dir)
+
+
+def get_schema_cache() -> SchemaCache:
+    """Return the schema cache shared by every assistant in the process"""
+    if _schema_cache is None:
+        configure_schema_cache()
+    assert _schema_cache is not None
+    return _schema_cache
@@ -84,6 +84,141 @@ def evaluate_ticket_prioritization(
     return final_score
 
 
+def _encode_rankings(rankings, codes):
+    """
+    Flatten a list of rankings into (segment, position, code) arrays, where
+    codes maps every ticket id seen so far to a dense integer.
+    """
+    lengths = np.fromiter(
+        (len(r) for r in rankings), dtype=np.int64, count=len(rankings)
+    )
+    code = np.fromiter(
+        (codes.setdefault(ticket_id, len(codes)) for r in rankings for ticket_id in r),
+        dtype=np.int64,
+        count=int(lengths.sum()),
+    )
+    segment = np.repeat(np.arange(len(rankings)), lengths)
+    position = np.arange(len(code)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return segment, position, code
+
+
+def _last_occurrences(segment, position, code, vocabulary_size):
+    """
+    Unique (segment, ticket) keys with the position of their last occurrence,
+    which is the rank the per-pair function's dict comprehensions keep.
+    """
+    keys = segment * vocabulary_size + code
+    # np.unique returns first occurrences, so search the reversed keys
+    unique_keys, reversed_index = np.unique(keys[::-1], return_index=True)
+    return unique_keys, position[len(keys) - 1 - reversed_index]
+
+
+def _count_inversions(segment, values, n_segments):
+    """
+    Count inversions of values within each segment with a bottom-up merge sort
+    run on all segments at once. segment must be sorted and values distinct
+    within a segment. At every level the right half of each block is located
+    in the (already sorted) left half with a single searchsorted, then the
+    blocks are merged by a stable sort on (block, value).
+    """
+    inversions = np.zeros(n_segments, dtype=np.int64)
+    if len(values) == 0:
+        return inversions
+
+    lengths = np.bincount(segment, minlength=n_segments)
+    position = np.arange(len(values)) - (np.cumsum(lengths) - lengths)[segment]
+    span = int(values.max()) + 1
+    width = 1
+    while width < lengths.max():
+        block = position // (2 * width)
+        block_id = np.cumsum(
+            np.r_[True, (segment[1:] != segment[:-1]) | (block[1:] != block[:-1])]
+        )
+        keys = block_id * span + values
+        is_right = (position // width) % 2 == 1
+        left_keys = keys[~is_right]
+        right_keys = keys[is_right]
+
+        # Left elements of the same block that are greater than a right element
+        left_end = np.searchsorted(left_keys, (block_id[is_right] + 1) * span)
+        not_greater = np.searchsorted(left_keys, right_keys, side="right")
+        inversions += np.bincount(
+            segment[is_right], weights=left_end - not_greater, minlength=n_segments
+        ).astype(np.int64)
+
+        values = values[np.argsort(keys, kind="stable")]
+        width *= 2
+
+    return inversions
+
+
+def evaluate_ticket_prioritization_batch(pairs, missing_penalty=0.2, extra_penalty=0.2):
+    """
+    Vectorized evaluate_ticket_prioritization over many rankings at once.
+
+    Parameters:
+    -----------
+    pairs : iterable of (list, list)
+        (expected_list, actual_list) ticket id rankings
+    missing_penalty : float, optional (default=0.2)
+        Penalty per missing ticket (as a fraction of total score)
+    extra_penalty : float, optional (default=0.2)
+        Penalty per extra/unknown ticket (as a fraction of total score)
+
+    Returns:
+    --------
+    numpy.ndarray
+        Accuracy score between 0 and 1 for every pair, equal to what
+        evaluate_ticket_prioritization returns for it
+    """
+    pairs = list(pairs)
+    n_pairs = len(pairs)
+    if n_pairs == 0:
+        return np.zeros(0)
+
+    # Ticket ids are encoded once, shared by the expected and actual rankings
+    codes = {}
+    expected = _encode_rankings([expected for expected, _ in pairs], codes)
+    actual = _encode_rankings([actual for _, actual in pairs], codes)
+    vocabulary_size = max(len(codes), 1)
+
+    expected_keys, expected_rank = _last_occurrences(*expected, vocabulary_size)
+    actual_keys, actual_rank = _last_occurrences(*actual, vocabulary_size)
+    common_keys, expected_index, actual_index = np.intersect1d(
+        expected_keys, actual_keys, assume_unique=True, return_indices=True
+    )
+    common_segment = common_keys // vocabulary_size
+
+    n_expected = np.bincount(expected_keys // vocabulary_size, minlength=n_pairs)
+    n_actual = np.bincount(actual_keys // vocabulary_size, minlength=n_pairs)
+    n_common = np.bincount(common_segment, minlength=n_pairs)
+    missing = n_expected - n_common
+    extra = n_actual - n_common
+
+    # Actual ranks of the common tickets, in expected order within each pair
+    order = np.lexsort((expected_rank[expected_index], common_segment))
+    discordant = _count_inversions(
+        common_segment[order], actual_rank[actual_index][order], n_pairs
+    )
+
+    # Same arithmetic as scipy's kendalltau (tau-b, ranks have no ties)
+    total = n_common * (n_common - 1) // 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tau = (total - 2 * discordant) / np.sqrt(total) / np.sqrt(total)
+    tau = np.clip(tau, -1.0, 1.0)
+    # kendalltau is NaN for a single common ticket, which max(0, tau) turns into 0
+    tau = np.where(n_common >= 2, tau, 0.0)
+
+    tau_normalized = np.maximum(tau, 0)
+    final_score = np.clip(
+        tau_normalized - missing * missing_penalty - extra * extra_penalty, 0.0, 1.0
+    )
+    final_score[final_score > 0.999] = 1.0
+    final_score[n_common == 0] = 0.0
+
+    return final_score
+
+
 def evaluate_score(ground_truth: str, test_result: str) -> float:
     """
     Dummy evaluation function that always returns 0.5
@@ -96,19 +231,46 @@ def evaluate_score(ground_truth: str, test_result: str) -> float:
         float: Always returns 0.5
     """
     try:
-        ground_truth_json = json.loads(ground_truth)
-        try:
-            test_result_json = json.loads(test_result)
-            if not isinstance(test_result_json, list):
-                return 0
-        except json.JSONDecodeError:
+        rankings = parse_rankings(ground_truth, test_result)
+        if rankings is None:
             return 0
 
-        ground_truth_values = [next(iter(item.values())) for item in ground_truth_json]
-        test_values = [next(iter(item.values())) for item in test_result_json]
-
-        return evaluate_ticket_prioritization(ground_truth_values, test_values)
+        return evaluate_ticket_prioritization(*rankings)
     except Exception as e:
         print(traceback.format_exc())
         print(f"Error during processing: {e}")
         raise e
+
+
+def parse_rankings(ground_truth: str, test_result: str):
+    """
+    Ticket id rankings (expected, actual) of a ground truth and a test result,
+    or None when the test result is not a JSON list (which scores 0)
+    """
+    ground_truth_json = json.loads(ground_truth)
+    try:
+        test_result_json = json.loads(test_result)
+        if not isinstance(test_result_json, list):
+            return None
+    except json.JSONDecodeError:
+        return None
+
+    ground_truth_values = [next(iter(item.values())) for item in ground_truth_json]
+    test_values = [next(iter(item.values())) for item in test_result_json]
+    return ground_truth_values, test_values
+
+
+def evaluate_score_batch(pairs) -> np.ndarray:
+    """
+    evaluate_score over many (ground_truth, test_result) pairs, scored with
+    evaluate_ticket_prioritization_batch
+    """
+    pairs = list(pairs)
+    rankings = [
+        parse_rankings(ground_truth, test_result) for ground_truth, test_result in pairs
+    ]
+    valid = [i for i, r in enumerate(rankings) if r is not None]
+
+    scores = np.zeros(len(pairs))
+    scores[valid] = evaluate_ticket_prioritization_batch([rankings[i] for i in valid])
+    return scores
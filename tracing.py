@@ -0,0 +1,96 @@
+import os
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+try:
+    from opentelemetry import propagate, trace
+except ImportError:  # Tracing is optional, spans are no-ops without it
+    propagate = None
+    trace = None
+
+SERVICE_NAME = "promptql-cs-benchmark"
+
+_provider = None
+
+
+class _NoopSpan:
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def set_attributes(self, attributes: Dict[str, Any]):
+        pass
+
+
+def configure(endpoint: str, service_name: str = SERVICE_NAME) -> bool:
+    """
+    Export spans to an OTLP endpoint (eg: the otel-collector of my-assistant,
+    http://localhost:4317). The protocol follows OTEL_EXPORTER_OTLP_PROTOCOL:
+    grpc (default) or http/protobuf. Needs opentelemetry-sdk and the exporter
+    (pip install opentelemetry-sdk opentelemetry-exporter-otlp), returns False
+    and leaves tracing off when they are missing.
+    """
+    global _provider
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+        if os.environ.get("OTEL_EXPORTER_OTLP_PROTOCOL", "grpc") == "grpc":
+            from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import (
+                OTLPSpanExporter,
+            )
+
+            exporter = OTLPSpanExporter(endpoint=endpoint)
+        else:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+                OTLPSpanExporter,
+            )
+
+            exporter = OTLPSpanExporter(endpoint=f"{endpoint.rstrip('/')}/v1/traces")
+    except ImportError as e:
+        print(f"Tracing disabled, OpenTelemetry is not installed: {e}")
+        return False
+
+    assert trace is not None
+    _provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    _provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(_provider)
+    print(f"Exporting traces to {endpoint}")
+    return True
+
+
+def shutdown():
+    """Flush the spans not exported yet"""
+    if _provider is not None:
+        _provider.shutdown()
+
+
+@contextmanager
+def span(name: str, attributes: Optional[Dict[str, Any]] = None) -> Iterator[Any]:
+    """Span around the body, a child of the current span"""
+    if trace is None:
+        yield _NoopSpan()
+        return
+    tracer = trace.get_tracer(SERVICE_NAME)
+    with tracer.start_as_current_span(
+        name, attributes=_clean(attributes or {})
+    ) as current:
+        yield current
+
+
+def set_attributes(attributes: Dict[str, Any]):
+    """Set attributes of the current span"""
+    if trace is not None:
+        trace.get_current_span().set_attributes(_clean(attributes))
+
+
+def inject_headers(headers: Dict[str, str]) -> Dict[str, str]:
+    """Add the trace context of the current span to the headers of a request"""
+    if propagate is not None:
+        propagate.inject(headers)
+    return headers
+
+
+def _clean(attributes: Dict[str, Any]) -> Dict[str, Any]:
+    # Attribute values can't be None
+    return {key: value for key, value in attributes.items() if value is not None}
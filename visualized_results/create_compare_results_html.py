@@ -1,9 +1,20 @@
 import json
 import os
+import re
+import shutil
+import sys
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 from datetime import datetime
-import re
+
+# Run payloads may be compressed and deduplicated by bench.py
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from run_payloads import read_payload
+
+SYSTEMS = ['promptql', 'tool_calling', 'tool_calling_python']
 
 def extract_messages(history_data: List) -> List[Dict]:
     """Extract relevant messages from history data"""
@@ -122,48 +133,44 @@ def extract_messages(history_data: List) -> List[Dict]:
 
     return messages
 
-def read_system_data(base_dir: str, model: str, system: str) -> Dict:
-    """Read data for a specific system configuration"""
+def find_runs(base_dir: str, model: str, system: str) -> Dict[int, Path]:
+    """History files of a system configuration by run number"""
     path = Path(f"{base_dir}/{model}/{system}/retrieval")
-    data = {}
-
     if not path.exists():
-        return data
-
-    # Read all files first
-    for file in path.glob("last_*_run_*.history"):
-        try:
-            with open(file, 'r') as f:
-                history = json.load(f)
-                run_number = int(file.stem.split('_')[-1])  # Convert to int for proper sorting
-                
-                # Read the corresponding .time file
-                time_file = file.with_suffix('.time')
-                execution_time = ''
-                if time_file.exists():
-                    with open(time_file, 'r') as tf:
-                        execution_time = tf.read().strip()
-
-                # Read the corresponding .result file
-                result_file = file.with_suffix('.result')
-                result_content = 'No result file found'
-                if result_file.exists():
-                    with open(result_file, 'r') as rf:
-                        result_content = rf.read().strip()
-
-                if history:  # Only process non-empty history files
-                    data[run_number] = {
-                        'messages': extract_messages(history),
-                        'type': system,
-                        'execution_time': execution_time,
-                        'result': result_content
-                    }
-        except json.JSONDecodeError:
-            print(f"Error reading file: {file}")
-            continue
+        return {}
+    # Convert to int for proper sorting
+    return dict(sorted((int(file.stem.split('_')[-1]), file) for file in path.glob("last_*_run_*.history")))
 
-    # Convert to sorted dictionary
-    return dict(sorted(data.items()))
+def read_run(file: Path, system: str) -> Optional[Dict]:
+    """Read one run of a system configuration, None when its history is empty or invalid"""
+    try:
+        history = read_payload(file)
+    except json.JSONDecodeError:
+        print(f"Error reading file: {file}")
+        return None
+    if not history:  # Only process non-empty history files
+        return None
+
+    # Read the corresponding .time file
+    time_file = file.with_suffix('.time')
+    execution_time = ''
+    if time_file.exists():
+        with open(time_file, 'r') as tf:
+            execution_time = tf.read().strip()
+
+    # Read the corresponding .result file
+    result_file = file.with_suffix('.result')
+    result_content = 'No result file found'
+    if result_file.exists():
+        with open(result_file, 'r') as rf:
+            result_content = rf.read().strip()
+
+    return {
+        'messages': extract_messages(history),
+        'type': system,
+        'execution_time': execution_time,
+        'result': result_content
+    }
 
 def format_execution_time(time_str: str) -> str:
     """Convert execution time to human readable format with 2 decimal precision"""
@@ -198,67 +205,7 @@ def format_execution_time(time_str: str) -> str:
     except (ValueError, IndexError):
         return time_str
 
-def generate_html_content(data: Dict, model: str) -> str:
-    """Generate HTML content for comparison"""
-    if not data:
-        html = """
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Model Comparison</title>
-            <style>
-                body { 
-                    font-family: Arial, sans-serif;
-                    margin: 20px;
-                    background-color: #f5f5f5;
-                }
-                .message {
-                    text-align: center;
-                    padding: 50px;
-                    background-color: white;
-                    border-radius: 8px;
-                    box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-                    margin-top: 20px;
-                }
-                .title-container {
-                    display: flex;
-                    justify-content: space-between;
-                    align-items: center;
-                    margin-bottom: 20px;
-                }
-                .back-link {
-                    text-decoration: none;
-                    color: #0066cc;
-                }
-                .timestamp {
-                    color: #666;
-                    font-style: italic;
-                    margin-bottom: 20px;
-                }
-            </style>
-        </head>
-        <body>
-        """
-        
-        html += f"""<div class="title-container">
-            <h1>With {model.upper()}</h1>
-            <a href="index.html" class="back-link">&larr;Back</a>
-        </div>"""
-        html += f"<div class='timestamp'>Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</div>"
-        html += """
-            <div class="message">
-                <h2>No data found for this model</h2>
-            </div>
-        </body>
-        </html>
-        """
-        return html
-
-    html = """
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Model Comparison</title>
+STYLE = """
         <style>
             body { 
                 font-family: Arial, sans-serif; 
@@ -432,21 +379,161 @@ def generate_html_content(data: Dict, model: str) -> str:
                 display: block;
             }
         </style>
+"""
+
+def generate_empty_html(model: str) -> str:
+    """Page of a model without any run"""
+    html = """
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <title>Model Comparison</title>
+        <style>
+            body { 
+                font-family: Arial, sans-serif;
+                margin: 20px;
+                background-color: #f5f5f5;
+            }
+            .message {
+                text-align: center;
+                padding: 50px;
+                background-color: white;
+                border-radius: 8px;
+                box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+                margin-top: 20px;
+            }
+            .title-container {
+                display: flex;
+                justify-content: space-between;
+                align-items: center;
+                margin-bottom: 20px;
+            }
+            .back-link {
+                text-decoration: none;
+                color: #0066cc;
+            }
+            .timestamp {
+                color: #666;
+                font-style: italic;
+                margin-bottom: 20px;
+            }
+        </style>
+    </head>
+    <body>
+    """
+    
+    html += f"""<div class="title-container">
+        <h1>With {model.upper()}</h1>
+        <a href="index.html" class="back-link">&larr;Back</a>
+    </div>"""
+    html += f"<div class='timestamp'>Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</div>"
+    html += """
+        <div class="message">
+            <h2>No data found for this model</h2>
+        </div>
+    </body>
+    </html>
+    """
+    return html
+
+def generate_system_html(system_data: Dict, system_type: str) -> str:
+    """Conversation and result of one run of a system"""
+    html = ""
+    for message in system_data['messages']:
+        html += f"<div class='message {message['role']}'>"
+        html += f"<strong>{message['role'].title()}:</strong>"
+
+        if message["role"] == "assistant" and isinstance(message["content"], str):
+            if system_type == 'promptql':
+                sections = message["content"].split("\n")
+                current_section = None
+                current_content = []
+
+                for line in sections:
+                    if line.strip() in ["Message:", "Plan:", "Code:", "Code Output:", "Code Error:"]:
+                        # Process previous section
+                        if current_section and current_content:
+                            if current_section in ["Code:", "Code Output:"]:
+                                html += f'<div class="section-title">{current_section}</div>'
+                                html += f'<button class="collapsible">Show {current_section.strip(":")} +</button>'
+                                html += f'<div class="content"><pre>{"".join(current_content)}</pre></div>'
+                            else:
+                                if current_section != "Message:":  # Don't show Message: title
+                                    html += f'<div class="section-title">{current_section}</div>'
+                                html += f'<pre>{"".join(current_content)}</pre>'
+
+                        current_section = line.strip()
+                        current_content = []
+                    else:
+                        current_content.append(line + "\n")
+
+                # Process the last section
+                if current_section and current_content:
+                    if current_section in ["Code:", "Code Output:"]:
+                        html += f'<div class="section-title">{current_section}</div>'
+                        html += f'<button class="collapsible">Show {current_section.strip(":")} +</button>'
+                        html += f'<div class="content"><pre>{"".join(current_content)}</pre></div>'
+                    else:
+                        if current_section != "Message:":  # Don't show Message: title
+                            html += f'<div class="section-title">{current_section}</div>'
+                        html += f'<pre>{"".join(current_content)}</pre>'
+            else:
+                html += f'<pre>{message["content"]}</pre>'
+        else:
+            html += f'<pre>{message["content"]}</pre>'
+
+        html += "</div>"
+
+    # Add result section with a clear delimiter
+    html += "<div style='width: 100%;'><div class='separator'></div><div class='result-section'>"
+    html += "<div class='section-title'>Result:</div>"
+    if 'result' in system_data and system_data['result']:
+        html += f'<pre>{system_data["result"]}</pre>'
+    else:
+        html += "<pre>No result returned</pre>"
+    html += "</div></div>"
+
+
+    return html
+
+PAGE_HEAD = """
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <title>Model Comparison</title>
+""" + STYLE + """
         <script>
-            document.addEventListener('DOMContentLoaded', function() {
-                // Collapsible sections
-                var coll = document.getElementsByClassName("collapsible");
-                for (var i = 0; i < coll.length; i++) {
-                    coll[i].addEventListener("click", function() {
-                        this.classList.toggle("active");
-                        var content = this.nextElementSibling;
-                        if (content.style.display === "block") {
-                            content.style.display = "none";
-                        } else {
-                            content.style.display = "block";
-                        }
-                    });
+            // Conversations are in one script per run and system, loaded when
+            // their tab is first shown. Scripts (unlike fetch) also load from file://
+            window.loadFragment = function(id, html) {
+                document.getElementById("system-" + id).innerHTML = html;
+            };
+
+            function loadRun(runId) {
+                var systems = document.querySelectorAll("#run-" + runId + " .system[data-fragment]");
+                for (var i = 0; i < systems.length; i++) {
+                    var script = document.createElement("script");
+                    script.src = systems[i].getAttribute("data-fragment");
+                    systems[i].removeAttribute("data-fragment");
+                    document.head.appendChild(script);
                 }
+            }
+
+            document.addEventListener('DOMContentLoaded', function() {
+                // Collapsible sections, including the ones loaded later
+                document.addEventListener("click", function(event) {
+                    var button = event.target.closest(".collapsible");
+                    if (!button) {
+                        return;
+                    }
+                    button.classList.toggle("active");
+                    var content = button.nextElementSibling;
+                    if (content.style.display === "block") {
+                        content.style.display = "none";
+                    } else {
+                        content.style.display = "block";
+                    }
+                });
 
                 // Tab functionality
                 var tabButtons = document.getElementsByClassName("tab-button");
@@ -469,6 +556,7 @@ def generate_html_content(data: Dict, model: str) -> str:
                         // Activate selected tab and content
                         this.classList.add("active");
                         document.getElementById("run-" + runId).classList.add("active");
+                        loadRun(runId);
                     });
                 }
 
@@ -482,108 +570,87 @@ def generate_html_content(data: Dict, model: str) -> str:
     <body>
     """
 
-    html += f"""<div class="title-container">
-        <h1>With {model.upper()}</h1>
-        <a href="index.html" class="back-link">&larr;Back</a>
-    </div>"""
-    html += f"<div class='timestamp'>Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</div>"
-
-    # Add tab buttons
-    html += "<div class='tabs'>"
-    for run_number in data.keys():
-        html += f"<button class='tab-button' data-run='{run_number}'>Run {run_number}</button>"
-    html += "</div>"
-
-    # Add tab content
-    for run_number, systems in data.items():
-        html += f"<div id='run-{run_number}' class='tab-content'>"
-        html += "<div class='container'>"
-
-        for system_type in ['promptql', 'tool_calling', 'tool_calling_python']:
-            html += "<div class='system-column'>"
-            # Create a sticky header container outside the system div
-            html += f"<div class='sticky-header'>"
-            if system_type in systems:
-                execution_time = systems[system_type].get('execution_time', 'N/A')
-                formatted_time = format_execution_time(execution_time)
-                html += f"<h3 class='system-title'>{system_type}</h3>"
-                html += f"<span class='execution-time'>(Execution time: {formatted_time})</span>"
-            else:
-                html += f"<h3 class='system-title'>{system_type}</h3>"
-            html += "</div>"
-
-            # System content div
-            html += f"<div class='system'>"
-            if system_type in systems:
-                system_data = systems[system_type]
-                for message in system_data['messages']:
-                    html += f"<div class='message {message['role']}'>"
-                    html += f"<strong>{message['role'].title()}:</strong>"
-
-                    if message["role"] == "assistant" and isinstance(message["content"], str):
-                        if system_type == 'promptql':
-                            sections = message["content"].split("\n")
-                            current_section = None
-                            current_content = []
-
-                            for line in sections:
-                                if line.strip() in ["Message:", "Plan:", "Code:", "Code Output:", "Code Error:"]:
-                                    # Process previous section
-                                    if current_section and current_content:
-                                        if current_section in ["Code:", "Code Output:"]:
-                                            html += f'<div class="section-title">{current_section}</div>'
-                                            html += f'<button class="collapsible">Show {current_section.strip(":")} +</button>'
-                                            html += f'<div class="content"><pre>{"".join(current_content)}</pre></div>'
-                                        else:
-                                            if current_section != "Message:":  # Don't show Message: title
-                                                html += f'<div class="section-title">{current_section}</div>'
-                                            html += f'<pre>{"".join(current_content)}</pre>'
-
-                                    current_section = line.strip()
-                                    current_content = []
-                                else:
-                                    current_content.append(line + "\n")
-
-                            # Process the last section
-                            if current_section and current_content:
-                                if current_section in ["Code:", "Code Output:"]:
-                                    html += f'<div class="section-title">{current_section}</div>'
-                                    html += f'<button class="collapsible">Show {current_section.strip(":")} +</button>'
-                                    html += f'<div class="content"><pre>{"".join(current_content)}</pre></div>'
-                                else:
-                                    if current_section != "Message:":  # Don't show Message: title
-                                        html += f'<div class="section-title">{current_section}</div>'
-                                    html += f'<pre>{"".join(current_content)}</pre>'
-                        else:
-                            html += f'<pre>{message["content"]}</pre>'
-                    else:
-                        html += f'<pre>{message["content"]}</pre>'
-
-                    html += "</div>"
-
-                # Add result section with a clear delimiter
-                html += "<div style='width: 100%;'><div class='separator'></div><div class='result-section'>"
-                html += "<div class='section-title'>Result:</div>"
-                if 'result' in system_data and system_data['result']:
-                    html += f'<pre>{system_data["result"]}</pre>'
+def write_comparison_page(base_dir: str, model: str, output_dir: str) -> int:
+    """
+    Write the comparison page of a model to {output_dir}/{model}_comparison.html,
+    and the conversation of each run and system to a script in
+    {output_dir}/{model}_runs/. Runs are read and written one at a time and the
+    page is streamed to disk. Returns the number of runs.
+    """
+    runs = {system: find_runs(base_dir, model, system) for system in SYSTEMS}
+    run_numbers = sorted(set().union(*runs.values()))
+    fragments_dir = Path(output_dir) / f"{model}_runs"
+
+    written_runs = []
+    # Tabs go before the runs but are only known once the runs are read,
+    # so the runs are streamed to a temporary file first
+    with tempfile.TemporaryFile('w+', encoding='utf-8') as body:
+        for run_number in run_numbers:
+            systems = {
+                system: read_run(runs[system][run_number], system)
+                for system in SYSTEMS if run_number in runs[system]
+            }
+            systems = {system: data for system, data in systems.items() if data}
+            if not systems:
+                continue
+            written_runs.append(run_number)
+
+            body.write(f"<div id='run-{run_number}' class='tab-content'>")
+            body.write("<div class='container'>")
+            for system_type in SYSTEMS:
+                body.write("<div class='system-column'>")
+                # Create a sticky header container outside the system div
+                body.write(f"<div class='sticky-header'>")
+                body.write(f"<h3 class='system-title'>{system_type}</h3>")
+                if system_type in systems:
+                    execution_time = systems[system_type].get('execution_time', 'N/A')
+                    formatted_time = format_execution_time(execution_time)
+                    body.write(f"<span class='execution-time'>(Execution time: {formatted_time})</span>")
+                body.write("</div>")
+
+                # System content div, filled by its script
+                if system_type in systems:
+                    fragment_id = f"{run_number}-{system_type}"
+                    fragment_file = fragments_dir / f"run_{run_number}_{system_type}.js"
+                    fragments_dir.mkdir(parents=True, exist_ok=True)
+                    with open(fragment_file, 'w', encoding='utf-8') as fragment:
+                        html = generate_system_html(systems[system_type], system_type)
+                        fragment.write(f"loadFragment({json.dumps(fragment_id)}, {json.dumps(html)});\n")
+                    body.write(
+                        f"<div id='system-{fragment_id}' class='system' "
+                        f"data-fragment='{fragments_dir.name}/{fragment_file.name}'><p>Loading...</p></div>"
+                    )
                 else:
-                    html += "<pre>No result returned</pre>"
-                html += "</div></div>"
-
-            else:
-                html += "<p>Run not found</p>"
+                    body.write("<div class='system'><p>Run not found</p></div>")
+                body.write("</div>")
+            body.write("</div></div>")
 
-            html += "</div>"
-            html += "</div>"
+        with open(Path(output_dir) / f"{model}_comparison.html", 'w', encoding='utf-8') as page:
+            if not written_runs:
+                page.write(generate_empty_html(model))
+                return 0
 
-        html += "</div></div>"
-
-    html += """
+            page.write(PAGE_HEAD)
+            page.write(f"""<div class="title-container">
+        <h1>With {model.upper()}</h1>
+        <a href="index.html" class="back-link">&larr;Back</a>
+    </div>""")
+            page.write(f"<div class='timestamp'>Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</div>")
+
+            # Add tab buttons
+            page.write("<div class='tabs'>")
+            for run_number in written_runs:
+                page.write(f"<button class='tab-button' data-run='{run_number}'>Run {run_number}</button>")
+            page.write("</div>")
+
+            body.seek(0)
+            shutil.copyfileobj(body, page)
+            page.write("""
     </body>
     </html>
-    """
+    """)
 
-    return html
+    return len(written_runs)
 
 def generate_index_html(models: List[str]) -> str:
     """Generate an index HTML page with links to all comparison pages"""
@@ -657,50 +724,45 @@ def generate_index_html(models: List[str]) -> str:
     """
     return html
 
+def write_model_report(base_dir: str, model: str, output_dir: str) -> str:
+    output_file = f'{output_dir}/{model}_comparison.html'
+    try:
+        num_runs = write_comparison_page(base_dir, model, output_dir)
+        if num_runs:
+            return f"Generated comparison for {model}: {output_file}"
+        return f"Generated empty comparison for {model}: {output_file} (no data found)"
+    except Exception as e:
+        return f"Error processing {model}: {str(e)}"
+
 def main():
-    base_dir = "score_based_prioritization"
-    models = ["claude", "o1", "o3-mini"]
-    systems = ["promptql", "tool_calling", "tool_calling_python"]
-    
+    parser = argparse.ArgumentParser(description='Generate the HTML comparison of the systems for each model')
+    parser.add_argument('--base_dir', type=str, default='score_based_prioritization',
+                        help='Benchmark output directory (default: score_based_prioritization)')
+    parser.add_argument('--output_dir', type=str, default='comparison_output',
+                        help='Directory of the HTML pages (default: comparison_output)')
+    parser.add_argument('--models', type=str, nargs='+', default=["claude", "o1", "o3-mini"])
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of models processed in parallel (default: number of CPUs)')
+    args = parser.parse_args()
+
     # Create output directory
-    os.makedirs('comparison_output', exist_ok=True)
+    os.makedirs(args.output_dir, exist_ok=True)
     
     # Generate index page
-    index_html = generate_index_html(models)
-    with open('comparison_output/index.html', 'w', encoding='utf-8') as f:
+    index_html = generate_index_html(args.models)
+    with open(f'{args.output_dir}/index.html', 'w', encoding='utf-8') as f:
         f.write(index_html)
-    print("Generated index page: comparison_output/index.html")
-    
-    for model in models:
-        try:
-            # Create a dictionary to store all data for this model
-            model_data = {}
-            
-            # Read data for each system
-            for system in systems:
-                system_data = read_system_data(base_dir, model, system)
-                
-                # Add system data to runs
-                for run_number, data in system_data.items():
-                    if run_number not in model_data:
-                        model_data[run_number] = {}
-                    model_data[run_number][system] = data
-            
-            # Generate HTML regardless of whether we found data
-            html_content = generate_html_content(model_data, model)
-            
-            # Write HTML file
-            output_file = f'comparison_output/{model}_comparison.html'
-            with open(output_file, 'w', encoding='utf-8') as f:
-                f.write(html_content)
-                
-            if model_data:
-                print(f"Generated comparison for {model}: {output_file}")
-            else:
-                print(f"Generated empty comparison for {model}: {output_file} (no data found)")
-            
-        except Exception as e:
-            print(f"Error processing {model}: {str(e)}")
+    print(f"Generated index page: {args.output_dir}/index.html")
+
+    workers = min(args.workers or os.cpu_count() or 1, len(args.models))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for message in executor.map(
+            write_model_report,
+            [args.base_dir] * len(args.models),
+            args.models,
+            [args.output_dir] * len(args.models),
+        ):
+            print(message)
 
 if __name__ == "__main__":
     main()